@@ -0,0 +1,115 @@
+'''
+
+Batch retrieval: scores a batch of query vectors against every document with one sparse matrix product.
+Used by test_scheme.py (--matrix) to evaluate many queries and weighting schemes quickly.
+
+The index is turned into a CSR term-document matrix (the transpose of the document-term matrix)
+once per tf/df weighting, the queries into a CSR query-term matrix, and
+
+    scores = queries @ term_document_matrix
+
+gives the score of every query and document at once. Requires scipy.
+
+'''
+
+import math
+
+import numpy as np
+from scipy import sparse
+
+from scoring import get_scorer
+from scoring import select_top_k
+
+
+class MatrixRetriever:
+    '''
+    Answers batches of query vectors on one index with the same scores and rankings as tokenize_and_answer.
+    '''
+    def __init__(self, inverted_index):
+        # Shares the postings arrays and norms that the accumulator scoring keeps for the index
+        self.scorer = get_scorer(inverted_index)
+        self.terms = [term for term in inverted_index.keys() if not term.startswith('_')]
+        self.term_numbers = {term: term_number for term_number, term in enumerate(self.terms)}
+        self.matrices = {}      # tf/df scheme -> weighted term-document matrix
+        self.pattern = None     # term-document matrix of ones, used to find zero score candidates
+
+    def term_document_matrix(self, tf_scheme, df_scheme):
+        '''
+        Return the term-document matrix holding the tf-idf weight of every posting for a tf/df scheme.
+        '''
+        scheme = tf_scheme + df_scheme
+        if scheme not in self.matrices:
+            doc_numbers = []
+            weights = []
+            for term in self.terms:
+                term_doc_numbers, _ = self.scorer.term_postings(term)
+                doc_numbers.append(term_doc_numbers)
+                # The same weights as the accumulator scoring: the DF of the whole collection for a shard, and the stored impacts
+                weights.append(self.scorer.posting_impacts(term, tf_scheme, df_scheme))
+
+            # Every postings list becomes one row of the matrix
+            indptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+            np.cumsum([len(row) for row in doc_numbers], out=indptr[1:])
+            shape = (len(self.terms), len(self.scorer.documents))
+            data = np.concatenate(weights) if weights else np.zeros(0)
+            indices = np.concatenate(doc_numbers) if doc_numbers else np.zeros(0, dtype=np.int64)
+            matrix = sparse.csr_matrix((data, indices, indptr), shape=shape)
+            matrix.sort_indices()
+            self.matrices[scheme] = matrix
+
+            if self.pattern is None:
+                self.pattern = matrix.copy()
+                self.pattern.data = np.ones_like(self.pattern.data)
+        return self.matrices[scheme]
+
+    def query_matrix(self, query_vectors):
+        '''
+        Return the query-term matrix of a list of query vectors (terms outside the vocabulary are ignored).
+        The terms of a row keep the order of the query vector, so every score is summed in the same
+        order as the accumulator scoring and both give exactly the same floating point scores.
+        '''
+        indptr = [0]
+        columns = []
+        weights = []
+        for query_vector in query_vectors:
+            for term, weight in query_vector.items():
+                if term in self.term_numbers:
+                    columns.append(self.term_numbers[term])
+                    weights.append(weight)
+            indptr.append(len(columns))
+        shape = (len(query_vectors), len(self.terms))
+        return sparse.csr_matrix((np.array(weights, dtype=np.float64), np.array(columns, dtype=np.int64), np.array(indptr, dtype=np.int64)), shape=shape)
+
+    def top_k(self, query_vectors, tf_scheme, df_scheme, normalization, k):
+        '''
+        Scores every query vector against every document with one sparse matrix product.
+        Returns one list of (docID, score) per query vector, sorted by decreasing score.
+        '''
+        term_documents = self.term_document_matrix(tf_scheme, df_scheme)
+        queries = self.query_matrix(query_vectors)
+        scores = (queries @ term_documents).tocsr()
+
+        if normalization == "c":
+            query_norms = np.array([math.sqrt(sum(value * value for value in query_vector.values())) for query_vector in query_vectors])
+            doc_norms = self.scorer.document_norms(tf_scheme + df_scheme)
+            rows = np.repeat(np.arange(len(query_vectors)), np.diff(scores.indptr))
+            denominators = query_norms[rows] * doc_norms[scores.indices]
+            # Prevent division by zero, those documents score 0
+            scores.data = np.divide(scores.data, denominators, out=np.zeros_like(scores.data), where=denominators != 0)
+
+        answers = []
+        for row in range(len(query_vectors)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            doc_numbers = scores.indices[start:end]
+            row_scores = scores.data[start:end]
+
+            if len(doc_numbers) < k:
+                # The product drops documents whose score sums to exactly 0 (e.g. terms with an idf of 0),
+                # but they are still candidates when there are fewer than k others
+                matching = (queries[row] @ self.pattern).indices
+                zero_scores = np.setdiff1d(matching, doc_numbers)
+                doc_numbers = np.concatenate((doc_numbers, zero_scores))
+                row_scores = np.concatenate((row_scores, np.zeros(len(zero_scores))))
+
+            answers.append(select_top_k(doc_numbers, row_scores, k, self.scorer.documents, self.scorer.tie_break_ranks()))
+        return answers
@@ -0,0 +1,1540 @@
+'''
+
+Speed and memory benchmarks for the indexing and query programs.
+
+Input (in order):
+    the benchmark to run, followed by its own arguments (see --help of each benchmark)
+
+Benchmarks:
+    index-load      load time and resident memory of an index in every on-disk format
+    compact-index   resident memory, load time and query latency of a JSON index held as nested lists and as a
+                    CompactIndex, and optionally the time and peak RSS of building it
+    scoring         latency of the accumulator scoring against the document vector scoring, by k and query length
+    pruning         latency of exhaustive and pruned (MaxScore) top-k retrieval on long queries, with the share
+                    of postings skipped
+    result-cache    latency of a stream of repeated queries with and without the result cache, with its hit rate
+    batch           one query at a time against sparse matrix batch retrieval over every weighting scheme
+    evaluation      time to compute every metric of evaluation.py and the significance tests for thousands of
+                    random runs over the judged queries of a collection
+    impacts         size of the float and quantized impacts against the index, and query latency with the
+                    weights computed at query time and read from each of them
+    build           wall-clock time of build_index.py by number of worker processes, one index at a time
+                    and all indexes in a single pass over the documents
+    normalization-cache
+                    build time without the normalization cache, with it in memory, and with a cold and warm store on disk
+    compression     size, postings decode throughput and cold query latency of every index format
+    update          indexing added, replaced and deleted documents into a segment against a full rebuild,
+                    and query latency on the segmented index against the rebuilt one
+    streaming       time and peak RSS of an in-memory build against streaming builds with a memory limit,
+                    on a corpus resampled from a collection
+    sharding        latency and throughput of queries answered by 1, 2, 4 and 8 shard worker processes
+                    (see sharding.py) against the unsharded index, checking that the answers are the same
+    scaling         on synthetic collections of increasing size (see synthetic_collection.py): time to read the
+                    corpus, build each index, write and load it in every format, and query latency percentiles
+                    and throughput per weighting scheme and k; writes the results as JSON and compares them
+                    with an earlier run
+    phrases         latency of phrase and NEAR/k queries of 2 to 5 words drawn from the documents (see positional_index.py)
+                    against ranked queries of the same words, with the documents matched and the positions read
+    boolean         latency of Boolean AND queries of 2 to 5 words of random documents (see boolean_query.py),
+                    unranked and ranked, against ranked queries of the same words, with the share of the
+                    postings of the words the skip pointer intersection reads
+    lexicon         time to build and load the lexicon of an index (see lexicon.py), and latency of prefix, wildcard
+                    and fuzzy expansions of random terms against a scan of the vocabulary, with the terms compared
+    startup         import time of the query CLI (python -X importtime), checked against STARTUP_BUDGET_MS
+
+Every measurement that depends on memory usage is taken in a fresh Python process.
+
+The program will be run from the root of the repository.
+
+'''
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import resource
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import collection_object
+from compact_index import document_frequency
+
+# Tracked startup budget: time to import query.py and everything it imports at startup
+STARTUP_BUDGET_MS = 200
+
+
+def current_rss_kb():
+    '''
+    Return the resident set size of this process in kilobytes (peak RSS if /proc is unavailable).
+    '''
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def peak_rss_kb():
+    '''
+    Return the peak resident set size of this process in kilobytes.
+    ru_maxrss is only the fallback: after fork and exec it also counts the memory of the parent process.
+    '''
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_worker(arguments):
+    '''
+    Runs a worker benchmark in a new interpreter and returns the JSON it prints.
+    '''
+    command = [sys.executable, __file__] + [str(argument) for argument in arguments]
+    process = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def index_load_worker(args):
+    '''
+    Loads one index, then looks up a number of its terms, and prints the measurements as JSON.
+    '''
+    collection = collection_object.Collection()
+    rss_before = current_rss_kb()
+
+    start_time = time.perf_counter()
+    index = collection.read_data(args.path)
+    load_seconds = time.perf_counter() - start_time
+    rss_after_load = current_rss_kb()
+
+    # Look up every n-th term, like a stream of queries touching a few terms each
+    terms = [term for term in index.keys() if not term.startswith('_')][::args.term_stride]
+    start_time = time.perf_counter()
+    postings_read = 0
+    for term in terms:
+        postings_read += len(index[term][1])
+    lookup_seconds = time.perf_counter() - start_time
+
+    print(json.dumps({
+        "load_seconds": load_seconds,
+        "lookup_seconds": lookup_seconds,
+        "terms_looked_up": len(terms),
+        "postings_read": postings_read,
+        "rss_after_load_kb": rss_after_load - rss_before,
+        "rss_after_lookup_kb": current_rss_kb() - rss_before,
+        "peak_rss_kb": peak_rss_kb()
+    }))
+
+def index_load(args):
+    '''
+    Compares the load time and memory use of every index format of a collection.
+    '''
+    collection = collection_object.Collection()
+    file_type = collection.index_file_types[collection_object.Collection.tokenization(args.tokenization)]
+
+    print(f"{'format':<8}{'load (s)':>10}{'lookup (s)':>12}{'RSS load (KB)':>15}{'RSS lookup (KB)':>17}{'peak RSS (KB)':>15}")
+    for index_format in collection.index_formats:
+        path = collection.get_output_path(args.collection, file_type, throw_file_exists_error=False, index_format=index_format)
+        runs = [run_worker(['_index-load-worker', path, '--term-stride', args.term_stride]) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run["load_seconds"])
+        print(f"{index_format:<8}{best['load_seconds']:>10.4f}{best['lookup_seconds']:>12.4f}"
+              f"{best['rss_after_load_kb']:>15}{best['rss_after_lookup_kb']:>17}{best['peak_rss_kb']:>15}")
+
+def compact_index_worker(args):
+    '''
+    Builds or loads one index held as a dictionary of postings lists or as a CompactIndex, answers random
+    queries on a loaded one, and prints the time, memory and a digest of the answers as JSON.
+    '''
+    import gc
+    import query
+    from scoring import get_scorer
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    compact = args.representation == "compact"
+    rss_before = current_rss_kb()
+
+    if args.mode == "build":
+        import preprocessing
+        from build_index import build_indexes
+        from build_index import read_documents
+
+        preprocessing.check_resources([preprocessing_method])
+        documents = read_documents(collection.get_input_path(args.collection, file_type='corpus'))
+        rss_before = current_rss_kb()
+        start_time = time.perf_counter()
+        build_indexes(documents, [preprocessing_method], compact=compact)
+        print(json.dumps({"build_seconds": time.perf_counter() - start_time, "build_peak_rss_kb": peak_rss_kb() - rss_before}))
+        return
+
+    start_time = time.perf_counter()
+    inverted_index = query.load_index(collection, args.collection, preprocessing_method, "json", compact=compact)
+    load_seconds = time.perf_counter() - start_time
+    # The objects freed while the index was read are not part of its footprint
+    gc.collect()
+    rss_after_load = current_rss_kb()
+
+    tf_scheme, df_scheme, normalization = args.weighting_scheme
+    # Terms in sorted order, scores are summed in the same order in every process whatever its hash seed
+    query_vectors = [dict(sorted(query_vector.items())) for query_vector in sample_query_vectors(random.Random(args.seed), inverted_index, args.query_length, args.queries)]
+    scorer = get_scorer(inverted_index)
+    start_time = time.perf_counter()
+    answers = [scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, args.k) for query_vector in query_vectors]
+    query_seconds = time.perf_counter() - start_time
+
+    print(json.dumps({
+        "load_seconds": load_seconds,
+        "query_ms": query_seconds * 1000 / len(query_vectors),
+        "rss_after_load_kb": rss_after_load - rss_before,
+        "rss_after_queries_kb": current_rss_kb() - rss_before,
+        "peak_rss_kb": peak_rss_kb() - rss_before,
+        "answers": hashlib.sha256(json.dumps(answers).encode()).hexdigest()
+    }))
+
+def compact_index(args):
+    '''
+    Compares the memory, load time, query latency and build of a JSON index held as nested lists and as a CompactIndex.
+    '''
+    collection = collection_object.Collection()
+    file_type = collection.index_file_types[collection_object.Collection.tokenization(args.tokenization)]
+    path = collection.get_output_path(args.collection, file_type, throw_file_exists_error=False)
+    print(f"{os.path.getsize(path) / 1024 / 1024:.1f} MB JSON index, {args.queries} queries of {args.query_length} terms, k = {args.k}")
+
+    print(f"{'index':<9}{'load (s)':>10}{'RSS load (MB)':>15}{'RSS queries (MB)':>18}{'peak RSS (MB)':>15}"
+          f"{'query (ms)':>12}{'build (s)':>11}{'build peak (MB)':>17}{'same answers':>14}")
+    reference = None
+    for representation in ["dict", "compact"]:
+        arguments = [args.collection, args.tokenization, representation, '--weighting-scheme', args.weighting_scheme,
+                     '--k', args.k, '--queries', args.queries, '--query-length', args.query_length, '--seed', args.seed]
+        run = run_worker(['_compact-index-worker'] + arguments)
+        if args.build:
+            run.update(run_worker(['_compact-index-worker'] + arguments + ['--mode', 'build']))
+        if reference is None:
+            reference = run["answers"]
+        build = f"{run['build_seconds']:>11.2f}{run['build_peak_rss_kb'] / 1024:>17.1f}" if args.build else f"{'':>11}{'':>17}"
+        print(f"{representation:<9}{run['load_seconds']:>10.2f}{run['rss_after_load_kb'] / 1024:>15.1f}{run['rss_after_queries_kb'] / 1024:>18.1f}"
+              f"{run['peak_rss_kb'] / 1024:>15.1f}{run['query_ms']:>12.3f}{build}{str(run['answers'] == reference):>14}")
+
+def sample_query_vectors(rng, inverted_index, query_length, count):
+    '''
+    Draws query vectors of distinct vocabulary terms, picking terms in proportion to their DF
+    like real queries, which mostly use common terms.
+    '''
+    vocabulary = [term for term in inverted_index.keys() if not term.startswith('_')]
+    cumulative_weights = list(itertools.accumulate(document_frequency(inverted_index, term) for term in vocabulary))
+    query_length = min(query_length, len(vocabulary))
+
+    query_vectors = []
+    for _ in range(count):
+        terms = set()
+        while len(terms) < query_length:
+            terms.add(rng.choices(vocabulary, cum_weights=cumulative_weights)[0])
+        query_vectors.append({term: 1 for term in terms})
+    return query_vectors
+
+def scoring(args):
+    '''
+    Times both ranking implementations of query.py on random queries of increasing length
+    and checks that they return the same documents.
+    '''
+    import query
+    from scoring import get_scorer
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    tf_scheme, df_scheme, normalization = args.weighting_scheme
+    inverted_index = query.load_index(collection, args.collection, preprocessing_method, args.format)
+    scorer = get_scorer(inverted_index)
+
+    # Queries are drawn from the vocabulary, so they do not need to be normalized
+    rng = random.Random(args.seed)
+    for term in inverted_index.keys():
+        if not term.startswith('_'):
+            scorer.term_postings(term)
+
+    print(f"{'terms':>6}{'k':>7}{'vectors (ms)':>14}{'accumulator (ms)':>18}{'speedup':>9}{'same top-k':>12}")
+    for query_length in args.query_lengths:
+        query_vectors = sample_query_vectors(rng, inverted_index, query_length, args.queries)
+        for k in args.k:
+            start_time = time.perf_counter()
+            expected = [query.rank_with_document_vectors(query_vector, tf_scheme, df_scheme, normalization, k, inverted_index) for query_vector in query_vectors]
+            vectors_ms = (time.perf_counter() - start_time) * 1000 / len(query_vectors)
+
+            start_time = time.perf_counter()
+            answers = [scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, k) for query_vector in query_vectors]
+            accumulator_ms = (time.perf_counter() - start_time) * 1000 / len(query_vectors)
+
+            same = all([doc_id for doc_id, _ in a] == [doc_id for doc_id, _ in b] for a, b in zip(expected, answers))
+            print(f"{query_length:>6}{k:>7}{vectors_ms:>14.3f}{accumulator_ms:>18.3f}{vectors_ms / accumulator_ms:>8.1f}x{str(same):>12}")
+
+def pruning(args):
+    '''
+    Times exhaustive and pruned top-k retrieval on random long queries, counts the postings each of them scores
+    and checks that they return the same documents with the same scores.
+    '''
+    import query
+    from scoring import AccumulatorScorer
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    tf_scheme, df_scheme, normalization = args.weighting_scheme
+    inverted_index = query.load_index(collection, args.collection, preprocessing_method, args.format)
+    if '_U_' not in inverted_index:
+        print("The index has no term bounds, they are computed from the postings (run convert_index.py to store them)")
+
+    # Separate scorers keep the postings counters apart, the postings are decoded before timing
+    exhaustive_scorer = AccumulatorScorer(inverted_index, cache_bytes=None)
+    pruned_scorer = AccumulatorScorer(inverted_index, cache_bytes=None)
+    for term in inverted_index.keys():
+        if not term.startswith('_'):
+            pruned_scorer.postings[term] = exhaustive_scorer.term_postings(term)
+
+    rng = random.Random(args.seed)
+    print(f"{'terms':>6}{'k':>7}{'exhaustive (ms)':>17}{'pruned (ms)':>13}{'speedup':>9}{'scored':>12}{'skipped':>12}{'same top-k':>12}")
+    for query_length in args.query_lengths:
+        query_vectors = sample_query_vectors(rng, inverted_index, query_length, args.queries)
+        for k in args.k:
+            start_time = time.perf_counter()
+            expected = [exhaustive_scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, k) for query_vector in query_vectors]
+            exhaustive_ms = (time.perf_counter() - start_time) * 1000 / len(query_vectors)
+
+            pruned_scorer.postings_scored = pruned_scorer.postings_skipped = 0
+            start_time = time.perf_counter()
+            answers = [pruned_scorer.top_k_pruned(query_vector, tf_scheme, df_scheme, normalization, k) for query_vector in query_vectors]
+            pruned_ms = (time.perf_counter() - start_time) * 1000 / len(query_vectors)
+
+            same = sum(a == b for a, b in zip(expected, answers))
+            postings = pruned_scorer.postings_scored + pruned_scorer.postings_skipped
+            print(f"{query_length:>6}{k:>7}{exhaustive_ms:>17.3f}{pruned_ms:>13.3f}{exhaustive_ms / pruned_ms:>8.1f}x"
+                  f"{pruned_scorer.postings_scored:>12}{pruned_scorer.postings_skipped / max(postings, 1):>11.1%}{same:>7}/{len(query_vectors)}")
+
+def evaluation_suite(args):
+    '''
+    Draws random runs (a ranking of k documents for every judged query, where each relevant document
+    is retrieved with some probability) for many configurations, then times the metrics of all of them
+    and the randomization and bootstrap tests of every configuration against the first one.
+    '''
+    import numpy as np
+    import evaluation
+    from utils import read_answers
+
+    answers = read_answers(f"./collections/{args.collection}.REL")
+    qrels = evaluation.Qrels(answers)
+    documents = sorted({doc_id for doc_ids in answers.values() for doc_id in doc_ids})
+    rng = np.random.default_rng(args.seed)
+
+    runs = []
+    for _ in range(args.configurations):
+        recall = rng.uniform(0, 0.5)
+        run = {}
+        for query_id, relevant_docs in answers.items():
+            retrieved = [doc_id for doc_id in relevant_docs if rng.random() < recall]
+            ranking = list(dict.fromkeys(retrieved + rng.choice(documents, size=args.k).tolist()))[:args.k]
+            rng.shuffle(ranking)
+            run[query_id] = ranking
+        runs.append(run)
+
+    start_time = time.perf_counter()
+    metrics = [evaluation.evaluate(run, qrels) for run in runs]
+    metrics_seconds = time.perf_counter() - start_time
+
+    print(f"{args.configurations} configurations of {len(answers)} queries, k = {args.k}: {len(metrics[0])} metrics each")
+    print(f"{'step':<24}{'seconds':>10}{'configurations/s':>18}")
+    print(f"{'metrics':<24}{metrics_seconds:>10.3f}{args.configurations / metrics_seconds:>18.0f}")
+    scores = np.array([configuration_metrics["map"] for configuration_metrics in metrics])
+    for name, test in [("randomization test", evaluation.randomization_test), ("bootstrap test", evaluation.bootstrap_test)]:
+        start_time = time.perf_counter()
+        p_values = test(scores[0], scores[1:], samples=args.samples, seed=args.seed)
+        test_seconds = time.perf_counter() - start_time
+        print(f"{name:<24}{test_seconds:>10.3f}{(args.configurations - 1) / test_seconds:>18.0f}"
+              f"   {np.mean(p_values < 0.05):.1%} differ from the first at p < 0.05")
+
+def impact_weights(args):
+    '''
+    Writes the float and quantized impacts of the JSON index of a collection, then compares their size
+    with the index and the latency of queries that compute the weights of their postings with queries
+    that read them, for every document weighting. Float impacts must give the same answers,
+    quantized ones are compared by the overlap of their top k with the exact one.
+    '''
+    import impacts
+    import query
+    from scoring import AccumulatorScorer
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    index_path = collection.get_output_path(args.collection, collection.index_file_types[preprocessing_method], throw_file_exists_error=False)
+    inverted_index = query.load_index(collection, args.collection, preprocessing_method, "json")
+    query_vectors = sample_query_vectors(random.Random(args.seed), inverted_index, args.query_length, args.queries)
+    index_size = os.path.getsize(index_path)
+
+    with tempfile.TemporaryDirectory() as directory:
+        scorers = {"computed": AccumulatorScorer(inverted_index, cache_bytes=None)}
+        print(f"{'impacts':<12}{'build (s)':>10}{'size (MB)':>11}{'of index':>10}")
+        for quantization in impacts.QUANTIZATIONS:
+            path = os.path.join(directory, f'index.{quantization}')
+            start_time = time.perf_counter()
+            impacts.write_impacts(inverted_index, path, quantization)
+            build_seconds = time.perf_counter() - start_time
+            size = sum(os.path.getsize(file) for file in impacts.get_impact_paths(path))
+            print(f"{quantization:<12}{build_seconds:>10.2f}{size / 1024 / 1024:>11.2f}{size / index_size:>10.1%}")
+            scorers[quantization] = AccumulatorScorer(inverted_index, impacts.ImpactIndex(path), cache_bytes=None)
+
+        # Postings are decoded before timing, only the weights differ
+        for scorer in scorers.values():
+            for term in inverted_index.keys():
+                if not term.startswith('_'):
+                    scorer.term_postings(term)
+
+        print(f"\n{len(query_vectors)} queries of {args.query_length} terms, k = {args.k}")
+        print(f"{'scheme':<8}" + "".join(f"{name + ' (ms)':>17}" for name in scorers) + f"{'same top-k':>12}{'overlap':>10}")
+        for weighting_scheme in args.weighting_schemes:
+            tf_scheme, df_scheme, normalization = weighting_scheme
+            answers = {}
+            latencies = {}
+            for name, scorer in scorers.items():
+                start_time = time.perf_counter()
+                answers[name] = [scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, args.k) for query_vector in query_vectors]
+                latencies[name] = (time.perf_counter() - start_time) * 1000 / len(query_vectors)
+
+            same = sum(a == b for a, b in zip(answers["computed"], answers["float"]))
+            overlap = sum(len({doc_id for doc_id, _ in a} & {doc_id for doc_id, _ in b}) / max(len(a), 1)
+                          for a, b in zip(answers["computed"], answers["quantized"])) / len(query_vectors)
+            print(f"{weighting_scheme:<8}" + "".join(f"{latency:>17.3f}" for latency in latencies.values())
+                  + f"{same:>7}/{len(query_vectors)}{overlap:>10.1%}")
+
+def result_cache_suite(args):
+    '''
+    Answers a stream of queries of a collection, drawn with Zipfian popularity like the queries of real users
+    and with a random k each, without and with a result cache of several sizes. Checks that the cached answers
+    are the ones computed, and reports the latency and the statistics of each cache.
+    '''
+    import preprocessing
+    import query
+    from result_cache import ResultCache
+    from utils import read_queries
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    tf_scheme, df_scheme, normalization = args.weighting_scheme
+    preprocessing.check_resources([preprocessing_method])
+    inverted_index = query.load_index(collection, args.collection, preprocessing_method, args.format)
+
+    # Queries with terms outside the vocabulary have no answer
+    queries = []
+    for query_text in read_queries(f"./collections/{args.collection}.QRY").values():
+        try:
+            query.build_query_vector(query_text, preprocessing_method, inverted_index)
+        except ValueError:
+            continue
+        queries.append(query_text)
+    rng = random.Random(args.seed)
+    rng.shuffle(queries)
+    popularity = [1 / (rank + 1) ** args.zipf for rank in range(len(queries))]
+    stream = [(query_text, rng.choice(args.k)) for query_text in rng.choices(queries, weights=popularity, k=args.requests)]
+
+    # The first pass also warms up the normalization cache and the scorer
+    expected = [query.tokenize_and_answer(query_text, tf_scheme, df_scheme, normalization, k, preprocessing_method, inverted_index) for query_text, k in stream]
+    start_time = time.perf_counter()
+    for query_text, k in stream:
+        query.tokenize_and_answer(query_text, tf_scheme, df_scheme, normalization, k, preprocessing_method, inverted_index)
+    uncached_ms = (time.perf_counter() - start_time) * 1000 / len(stream)
+
+    print(f"{len(stream)} requests over {len(queries)} distinct queries (Zipf s = {args.zipf}), k in {args.k}")
+    print(f"{'cache size':>10}{'ms/query':>10}{'speedup':>9}{'hit rate':>10}{'evictions':>11}{'same answers':>14}")
+    print(f"{'none':>10}{uncached_ms:>10.3f}{1:>8.1f}x")
+    for cache_size in args.cache_sizes:
+        cache = ResultCache(cache_size)
+        start_time = time.perf_counter()
+        answers = [query.tokenize_and_answer(query_text, tf_scheme, df_scheme, normalization, k, preprocessing_method, inverted_index, cache=cache)
+                   for query_text, k in stream]
+        cached_ms = (time.perf_counter() - start_time) * 1000 / len(stream)
+        statistics = cache.statistics()
+        same = sum(a == b for a, b in zip(expected, answers))
+        print(f"{cache_size:>10}{cached_ms:>10.3f}{uncached_ms / cached_ms:>8.1f}x{statistics['hit_rate']:>10.1%}{statistics['evictions']:>11}{same:>8}/{len(stream)}")
+
+def batch(args):
+    '''
+    Answers a large batch of random queries with every weighting scheme, one query at a time
+    with the accumulator scoring and all at once with a sparse matrix product.
+    '''
+    import query
+    from batch_retrieval import MatrixRetriever
+    from scoring import get_scorer
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    inverted_index = query.load_index(collection, args.collection, preprocessing_method, args.format)
+    query_vectors = sample_query_vectors(random.Random(args.seed), inverted_index, args.query_length, args.queries)
+
+    scorer = get_scorer(inverted_index)
+    retriever = MatrixRetriever(inverted_index)
+
+    print(f"{len(query_vectors)} queries of {args.query_length} terms, k = {args.k}")
+    print(f"{'scheme':<8}{'one by one (s)':>16}{'matrix build (s)':>18}{'matrix (s)':>12}{'speedup':>9}{'same top-k':>12}")
+    total_one_by_one = 0
+    total_matrix = 0
+    for weighting_scheme in args.weighting_schemes:
+        tf_scheme, df_scheme, normalization = weighting_scheme
+
+        start_time = time.perf_counter()
+        expected = [scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, args.k) for query_vector in query_vectors]
+        one_by_one_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        retriever.term_document_matrix(tf_scheme, df_scheme)
+        build_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        answers = retriever.top_k(query_vectors, tf_scheme, df_scheme, normalization, args.k)
+        matrix_seconds = time.perf_counter() - start_time
+
+        same = sum([doc_id for doc_id, _ in a] == [doc_id for doc_id, _ in b] for a, b in zip(expected, answers))
+        total_one_by_one += one_by_one_seconds
+        total_matrix += build_seconds + matrix_seconds
+        print(f"{weighting_scheme:<8}{one_by_one_seconds:>16.3f}{build_seconds:>18.3f}{matrix_seconds:>12.3f}"
+              f"{one_by_one_seconds / matrix_seconds:>8.1f}x{same:>7}/{len(query_vectors)}")
+    print(f"{'total':<8}{total_one_by_one:>16.3f}{total_matrix:>30.3f}")
+
+def build(args):
+    '''
+    Builds the indexes of a collection with increasing numbers of worker processes, one index
+    at a time and then all of them in one pass, and checks that every build gives the index
+    of the first single index build.
+    '''
+    from build_index import build_index
+    from build_index import build_indexes
+    from build_index import read_documents
+
+    collection = collection_object.Collection()
+    documents = read_documents(collection.get_input_path(args.collection, file_type='corpus'))
+    preprocessing_methods = [collection_object.Collection.tokenization(tokenization) for tokenization in args.tokenizations]
+
+    print(f"{'tokenization':<14}{'workers':>8}{'time (s)':>10}{'speedup':>9}{'identical':>11}")
+    references = {}
+    reference_seconds = {}
+    for preprocessing_method in preprocessing_methods:
+        for workers in args.workers:
+            start_time = time.perf_counter()
+            index = build_index(documents, preprocessing_method, workers)
+            seconds = time.perf_counter() - start_time
+            if preprocessing_method not in references:
+                references[preprocessing_method] = index
+                reference_seconds[preprocessing_method] = seconds
+            speedup = reference_seconds[preprocessing_method] / seconds
+            print(f"{preprocessing_method:<14}{workers:>8}{seconds:>10.2f}{speedup:>8.2f}x{str(index == references[preprocessing_method]):>11}")
+
+    # Every index from one tokenization pass, compared with building them one after the other
+    separate_seconds = sum(reference_seconds.values())
+    for workers in args.workers:
+        start_time = time.perf_counter()
+        indexes = build_indexes(documents, preprocessing_methods, workers)
+        seconds = time.perf_counter() - start_time
+        identical = all(indexes[method] == references[method] for method in preprocessing_methods)
+        print(f"{'single pass':<14}{workers:>8}{seconds:>10.2f}{separate_seconds / seconds:>8.2f}x{str(identical):>11}")
+
+def resample_documents(documents, count, length, seed):
+    '''
+    Builds a larger corpus of documents whose words are drawn from the words of a collection,
+    which keeps their natural (Zipfian) frequencies.
+    '''
+    rng = random.Random(seed)
+    words = [word for text in documents.values() for word in text.split()]
+    return {str(doc_id): ' '.join(rng.choices(words, k=length)) for doc_id in range(1, count + 1)}
+
+def normalization_cache(args):
+    '''
+    Builds the indexes of a collection and of a larger resampled corpus with every cache setup
+    and checks that the cache does not change the indexes.
+    '''
+    import preprocessing
+    from build_index import build_indexes
+    from build_index import read_documents
+
+    collection = collection_object.Collection()
+    documents = read_documents(collection.get_input_path(args.collection, file_type='corpus'))
+    corpora = {
+        args.collection: documents,
+        f"resampled ({args.synthetic_documents} docs)": resample_documents(documents, args.synthetic_documents, args.synthetic_length, args.seed)
+    }
+    preprocessing_methods = [collection_object.Collection.tokenization(tokenization) for tokenization in args.tokenizations]
+
+    print(f"{'corpus':<26}{'cache':<12}{'time (s)':>10}{'speedup':>9}{'hit rate':>10}{'identical':>11}")
+    for corpus_name, corpus in corpora.items():
+        with tempfile.TemporaryDirectory() as directory:
+            store_path = os.path.join(directory, 'normalization_cache.sqlite')
+            setups = [("none", 0, None), ("memory", args.cache_size, None), ("disk cold", args.cache_size, store_path), ("disk warm", args.cache_size, store_path)]
+            reference = None
+            for setup_name, cache_size, path in setups:
+                cache = preprocessing.configure_cache(cache_size, path)
+                start_time = time.perf_counter()
+                indexes = build_indexes(corpus, preprocessing_methods)
+                seconds = time.perf_counter() - start_time
+                if reference is None:
+                    reference = indexes
+                    reference_seconds = seconds
+                hit_rate = cache.statistics()["hit_rate"]
+                print(f"{corpus_name:<26}{setup_name:<12}{seconds:>10.2f}{reference_seconds / seconds:>8.2f}x{hit_rate:>10.1%}{str(indexes == reference):>11}")
+    preprocessing.configure_cache(0)
+
+def compression(args):
+    '''
+    Writes the JSON index of a collection in every other index format, then compares their size on disk,
+    how fast the postings of every term are decoded into scoring arrays and the latency of queries
+    that decode their postings (a new scorer per query), and checks that all formats give the same answers.
+    '''
+    import query
+    from scoring import AccumulatorScorer
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    tf_scheme, df_scheme, normalization = args.weighting_scheme
+    json_index = query.load_index(collection, args.collection, preprocessing_method, "json")
+    json_path = collection.get_output_path(args.collection, collection.index_file_types[preprocessing_method], throw_file_exists_error=False)
+    query_vectors = sample_query_vectors(random.Random(args.seed), json_index, args.query_length, args.queries)
+
+    print(f"{'format':<12}{'size (MB)':>10}{'ratio':>7}{'decode (Mpostings/s)':>22}{'query (ms)':>12}{'same top-k':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        sizes = {}
+        expected = None
+        for index_format, extension in collection.index_formats.items():
+            if index_format == "json":
+                path = json_path
+            else:
+                path = os.path.join(directory, f'index{extension}')
+                collection.write_data(json_index, path, index_format)
+            sizes[index_format] = sum(os.path.getsize(file) for file in collection.get_index_files(path, index_format))
+            index = json_index if index_format == "json" else collection.read_data(path, index_format)
+
+            # Decode every postings list once
+            scorer = AccumulatorScorer(index)
+            terms = [term for term in index.keys() if not term.startswith('_')]
+            start_time = time.perf_counter()
+            postings_decoded = sum(len(scorer.term_postings(term)[0]) for term in terms)
+            decode_seconds = time.perf_counter() - start_time
+
+            answers = []
+            start_time = time.perf_counter()
+            for query_vector in query_vectors:
+                scorer = AccumulatorScorer(index)
+                answers.append([doc_id for doc_id, _ in scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, args.k)])
+            query_ms = (time.perf_counter() - start_time) * 1000 / len(query_vectors)
+            if expected is None:
+                expected = answers
+            same = sum(a == b for a, b in zip(expected, answers))
+
+            print(f"{index_format:<12}{sizes[index_format] / 1024 / 1024:>10.2f}{sizes['json'] / sizes[index_format]:>6.1f}x"
+                  f"{postings_decoded / decode_seconds / 1e6:>22.2f}{query_ms:>12.3f}{same:>7}/{len(query_vectors)}")
+
+def update(args):
+    '''
+    Holds out the last documents of a collection, builds its indexes, then applies an update that adds
+    them back, replaces and deletes other documents. Compares the time of indexing the update into a
+    segment with a full rebuild, and checks that the segmented and merged indexes match the rebuilt one.
+    The normalization cache is disabled, so no build reuses the work of another.
+    '''
+    import preprocessing
+    from build_index import build_indexes
+    from build_index import read_documents
+    from scoring import AccumulatorScorer
+    from segments import SegmentedIndex
+    from update_index import build_segments
+    from update_index import compact_index
+
+    preprocessing.configure_cache(0)
+    collection = collection_object.Collection()
+    documents = read_documents(collection.get_input_path(args.collection, file_type='corpus'))
+    preprocessing_methods = [collection_object.Collection.tokenization(tokenization) for tokenization in args.tokenizations]
+
+    rng = random.Random(args.seed)
+    doc_ids = list(documents.keys())
+    added = doc_ids[len(doc_ids) - args.added:]
+    base = {doc_id: documents[doc_id] for doc_id in doc_ids[:len(doc_ids) - args.added]}
+    replaced = rng.sample(list(base.keys()), args.replaced)
+    deleted = rng.sample([doc_id for doc_id in base if doc_id not in replaced], args.deleted)
+    # Replaced documents get the text of another document
+    changes = {doc_id: documents[rng.choice(doc_ids)] for doc_id in replaced}
+    changes.update({doc_id: documents[doc_id] for doc_id in added})
+    final = {doc_id: changes.get(doc_id, text) for doc_id, text in base.items() if doc_id not in deleted}
+    final.update({doc_id: documents[doc_id] for doc_id in added})
+
+    base_indexes = build_indexes(base, preprocessing_methods)
+    start_time = time.perf_counter()
+    rebuilt_indexes = build_indexes(final, preprocessing_methods)
+    rebuild_seconds = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    segment_indexes = build_segments(changes, deleted, preprocessing_methods)
+    update_seconds = time.perf_counter() - start_time
+    print(f"{len(added)} added, {len(replaced)} replaced, {len(deleted)} deleted out of {len(documents)} documents")
+    print(f"rebuild {rebuild_seconds:.2f}s, segment {update_seconds:.2f}s ({rebuild_seconds / update_seconds:.1f}x faster)")
+
+    print(f"{'tokenization':<14}{'norms (s)':>10}{'merge (s)':>11}{'segmented (ms)':>16}{'rebuilt (ms)':>14}{'same DF':>9}{'same top-k':>12}")
+    tf_scheme, df_scheme, normalization = args.weighting_scheme
+    for preprocessing_method in preprocessing_methods:
+        rebuilt = rebuilt_indexes[preprocessing_method]
+        segmented = SegmentedIndex(base_indexes[preprocessing_method], [segment_indexes[preprocessing_method]])
+
+        start_time = time.perf_counter()
+        segmented.document_norms()
+        norms_seconds = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        merged = compact_index(segmented)
+        merge_seconds = time.perf_counter() - start_time
+
+        vocabulary = [term for term in rebuilt.keys() if not term.startswith('_')]
+        same_df = (sorted(vocabulary) == sorted(segmented.vocabulary()) and rebuilt['_M_'] == segmented['_M_'] == merged['_M_']
+                   and all(rebuilt[term][0] == segmented[term][0] == merged[term][0] for term in vocabulary))
+
+        query_vectors = sample_query_vectors(rng, rebuilt, args.query_length, args.queries)
+        latencies = {}
+        answers = {}
+        for name, index in [("segmented", segmented), ("rebuilt", rebuilt), ("merged", merged)]:
+            scorer = AccumulatorScorer(index)
+            start_time = time.perf_counter()
+            answers[name] = [[doc_id for doc_id, _ in scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, args.k)] for query_vector in query_vectors]
+            latencies[name] = (time.perf_counter() - start_time) * 1000 / len(query_vectors)
+        same = sum(a == b == c for a, b, c in zip(answers["segmented"], answers["rebuilt"], answers["merged"]))
+        print(f"{preprocessing_method:<14}{norms_seconds:>10.3f}{merge_seconds:>11.3f}{latencies['segmented']:>16.3f}{latencies['rebuilt']:>14.3f}"
+              f"{str(same_df):>9}{same:>7}/{len(query_vectors)}")
+
+def write_corpus(documents, path):
+    '''
+    Writes documents (docID: text) to a file in the .ALL format.
+    '''
+    with open(path, 'w') as file:
+        for doc_id, text in documents.items():
+            file.write(f'.I {doc_id}\n.W\n{text}\n')
+
+def streaming_worker(args):
+    '''
+    Builds the indexes of a corpus file into a folder, in memory or streamed under a memory limit,
+    and prints the build time and peak RSS as JSON.
+    '''
+    import preprocessing
+    from build_index import build_indexes
+    from build_index import iter_documents
+    from build_index import read_documents
+    from streaming_index import write_indexes_streaming
+
+    preprocessing.configure_cache(args.cache_size)
+    collection = collection_object.Collection()
+    output_paths = {normalization: os.path.join(args.output, f'{file_type}.json') for normalization, file_type in collection.index_file_types.items()}
+
+    start_time = time.perf_counter()
+    runs = 0
+    if args.memory_limit_mb == 0:
+        indexes = build_indexes(read_documents(args.corpus), list(output_paths.keys()))
+        for normalization, index in indexes.items():
+            collection.write_data(index, output_paths[normalization])
+    else:
+        _, spilled = write_indexes_streaming(collection, iter_documents(args.corpus), output_paths, args.memory_limit_mb * 1024 * 1024, spill_directory=args.output)
+        runs = max(spilled.values())
+
+    print(json.dumps({
+        "seconds": time.perf_counter() - start_time,
+        "runs": runs,
+        "peak_rss_kb": peak_rss_kb()
+    }))
+
+def streaming(args):
+    '''
+    Builds the indexes of a corpus resampled from a collection in memory, then streamed under
+    decreasing memory limits, each in a fresh process, and checks that every build writes the same files.
+    '''
+    from build_index import read_documents
+
+    collection = collection_object.Collection()
+    documents = read_documents(collection.get_input_path(args.collection, file_type='corpus'))
+    corpus = resample_documents(documents, args.synthetic_documents, args.synthetic_length, args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus_path = os.path.join(directory, 'corpus.ALL')
+        write_corpus(corpus, corpus_path)
+        print(f"{len(corpus)} documents, {os.path.getsize(corpus_path) / 1024 / 1024:.1f} MB corpus file")
+
+        print(f"{'memory limit':<14}{'time (s)':>10}{'runs':>6}{'peak RSS (MB)':>15}{'identical':>11}")
+        reference = None
+        for memory_limit_mb in [0] + args.memory_limits:
+            output = os.path.join(directory, f'limit{memory_limit_mb}')
+            os.makedirs(output)
+            run = run_worker(['_streaming-worker', corpus_path, output, '--memory-limit-mb', memory_limit_mb, '--cache-size', args.cache_size])
+            files = {}
+            for name in sorted(os.listdir(output)):
+                with open(os.path.join(output, name), 'rb') as file:
+                    files[name] = hashlib.sha256(file.read()).hexdigest()
+            if reference is None:
+                reference = files
+            label = "in memory" if memory_limit_mb == 0 else f"{memory_limit_mb} MB"
+            print(f"{label:<14}{run['seconds']:>10.2f}{run['runs']:>6}{run['peak_rss_kb'] / 1024:>15.1f}{str(files == reference):>11}")
+            shutil.rmtree(output)
+
+def percentiles_ms(latencies):
+    '''
+    Return the p50, p95 and p99 of latencies in seconds, in milliseconds.
+    '''
+    import numpy as np
+
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+def sharded_queries(args):
+    '''
+    Splits an index into shards of increasing number, each in a temporary folder, and times queries answered
+    by shard worker processes against the unsharded index: latency of one query at a time, and throughput
+    with several clients at once. Checks that every shard count returns the answers of the unsharded index.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    import query
+    import sharding
+    from scoring import get_scorer
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    tf_scheme, df_scheme, normalization = args.weighting_scheme
+    inverted_index = query.load_index(collection, args.collection, preprocessing_method, "json")
+    index_path = query.get_index_path(collection, args.collection, preprocessing_method, "json")
+    query_vectors = [dict(sorted(query_vector.items())) for query_vector in sample_query_vectors(random.Random(args.seed), inverted_index, args.query_length, args.queries)]
+
+    def measure(scorer):
+        # The first pass loads the postings of every query term
+        answers = [scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, args.k) for query_vector in query_vectors]
+        latencies = []
+        for query_vector in query_vectors:
+            start_time = time.perf_counter()
+            scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, args.k)
+            latencies.append(time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            list(executor.map(lambda query_vector: scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, args.k), query_vectors))
+        result = percentiles_ms(latencies)
+        result["queries_per_second"] = len(query_vectors) / (time.perf_counter() - start_time)
+        return answers, result
+
+    print(f"{inverted_index['_M_']} documents, {len(query_vectors)} queries of {args.query_length} terms, "
+          f"{args.weighting_scheme}, k = {args.k}, {args.clients} clients for the throughput")
+    print(f"{'shards':<10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'queries/s':>11}{'speedup':>9}{'same answers':>14}")
+    expected, result = measure(get_scorer(inverted_index))
+    results = {"unsharded": result}
+    print(f"{'none':<10}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{result['queries_per_second']:>11.1f}{1:>8.1f}x")
+
+    for shard_count in args.shards:
+        with tempfile.TemporaryDirectory() as directory:
+            shard_index_path = os.path.join(directory, os.path.basename(index_path))
+            sharding.write_shards(collection, inverted_index, shard_index_path, shard_count, "json")
+            coordinator = sharding.open_coordinator(collection, shard_index_path, "process")
+            try:
+                answers, result = measure(coordinator)
+            finally:
+                coordinator.close()
+        results[shard_count] = result
+        speedup = result['queries_per_second'] / results["unsharded"]['queries_per_second']
+        print(f"{shard_count:<10}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{result['queries_per_second']:>11.1f}"
+              f"{speedup:>8.1f}x{str(answers == expected):>14}")
+
+    if args.output is not None:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as file:
+            json.dump({"parameters": {name: value for name, value in vars(args).items() if name != "function"}, "results": results}, file, indent=2)
+        print(f"Results written to {args.output}")
+
+def phrase_queries(args):
+    '''
+    Times phrase queries of 2 to 5 consecutive words of random documents, the same words as NEAR/k
+    queries, and as ranked queries. Checks that every phrase matches the document it was drawn from.
+    The index must have been built with build_index.py --positions.
+    '''
+    import numpy as np
+    import positional_index
+    import preprocessing
+    import query
+    from build_index import iter_documents
+    from scoring import get_scorer
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    tf_scheme, df_scheme, normalization = args.weighting_scheme
+    inverted_index = query.load_index(collection, args.collection, preprocessing_method, args.format)
+    try:
+        positions = positional_index.get_positions(inverted_index)
+    except LookupError as error:
+        print(error, file=sys.stderr)
+        exit(1)
+    scorer = get_scorer(inverted_index)
+    matcher = positional_index.PhraseMatcher(scorer, positions)
+
+    # Phrases are drawn from the normalized tokens of random documents long enough for the longest phrase
+    rng = random.Random(args.seed)
+    documents = [(doc_id, text) for doc_id, text in iter_documents(collection.get_input_path(args.collection, 'corpus'))]
+    samples = []
+    while len(samples) < args.queries:
+        doc_id, text = rng.choice(documents)
+        tokens = preprocessing.normalize(preprocessing.tokenize(text), preprocessing_method)
+        if len(tokens) >= max(args.phrase_lengths):
+            samples.append((doc_id, tokens, rng.random()))
+    document_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(scorer.documents)}
+
+    def measure(clauses, query_vector):
+        start_time = time.perf_counter()
+        doc_candidates = matcher.match(clauses)
+        scorer.top_k_of(query_vector, tf_scheme, df_scheme, normalization, args.k, doc_candidates)
+        return time.perf_counter() - start_time, doc_candidates
+
+    print(f"{inverted_index['_M_']} documents, {args.queries} phrases per length, {args.weighting_scheme}, k = {args.k}, NEAR/{args.distance}")
+    print(f"{'words':>6}{'phrase p50 (ms)':>17}{'p95 (ms)':>10}{'NEAR p50 (ms)':>15}{'ranked p50 (ms)':>17}"
+          f"{'matches':>10}{'positions':>11}{'postings':>10}{'source found':>14}")
+    for phrase_length in args.phrase_lengths:
+        phrases = []
+        for doc_id, tokens, start in samples:
+            start = int(start * (len(tokens) - phrase_length + 1))
+            phrases.append((doc_id, tuple(tokens[start:start + phrase_length])))
+
+        # The first pass reads the postings and positions of every word
+        for _, terms in phrases:
+            matcher.match([((terms,), ())])
+        phrase_latencies, near_latencies, ranked_latencies = [], [], []
+        matches = postings = positions_read = found = 0
+        for doc_id, terms in phrases:
+            query_vector = query.terms_query_vector(list(terms), inverted_index)
+            before = matcher.positions_scanned
+            seconds, doc_candidates = measure([((terms,), ())], query_vector)
+            positions_read += matcher.positions_scanned - before
+            phrase_latencies.append(seconds)
+            matches += len(doc_candidates)
+            postings += sum(len(scorer.term_postings(term)[0]) for term in query_vector)
+            found += bool(np.isin(document_numbers[doc_id], doc_candidates))
+
+            # First and last word of the phrase, apart by at most the distance
+            seconds, _ = measure([(((terms[0],), (terms[-1],)), (args.distance,))], query_vector)
+            near_latencies.append(seconds)
+
+            start_time = time.perf_counter()
+            scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, args.k)
+            ranked_latencies.append(time.perf_counter() - start_time)
+
+        phrase, near, ranked = percentiles_ms(phrase_latencies), percentiles_ms(near_latencies), percentiles_ms(ranked_latencies)
+        print(f"{phrase_length:>6}{phrase['p50_ms']:>17.3f}{phrase['p95_ms']:>10.3f}{near['p50_ms']:>15.3f}{ranked['p50_ms']:>17.3f}"
+              f"{matches / len(phrases):>10.1f}{positions_read / len(phrases):>11.0f}{postings / len(phrases):>10.0f}{found:>9}/{len(phrases)}")
+
+def boolean_queries(args):
+    '''
+    Times conjunctions of 2 to 5 distinct words of random documents, matched only and ranked, against ranked
+    queries of the same words, which score the union of their postings. Checks that every conjunction
+    matches the document it was drawn from.
+    '''
+    import numpy as np
+    import boolean_query
+    import preprocessing
+    import query
+    from build_index import iter_documents
+    from scoring import get_scorer
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    tf_scheme, df_scheme, normalization = args.weighting_scheme
+    inverted_index = query.load_index(collection, args.collection, preprocessing_method, args.format)
+    scorer = get_scorer(inverted_index)
+    matcher = boolean_query.BooleanMatcher(scorer)
+
+    # Words are drawn from the normalized tokens of random documents with enough distinct terms
+    rng = random.Random(args.seed)
+    documents = [(doc_id, text) for doc_id, text in iter_documents(collection.get_input_path(args.collection, 'corpus'))]
+    samples = []
+    while len(samples) < args.queries:
+        doc_id, text = rng.choice(documents)
+        terms = sorted(set(preprocessing.normalize(preprocessing.tokenize(text), preprocessing_method)))
+        if len(terms) >= max(args.query_lengths):
+            samples.append((doc_id, terms))
+    document_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(scorer.documents)}
+
+    print(f"{inverted_index['_M_']} documents, {args.queries} queries per length, {args.weighting_scheme}, k = {args.k}")
+    print(f"{'words':>6}{'AND p50 (ms)':>14}{'p95 (ms)':>10}{'ranked AND p50 (ms)':>21}{'ranked p50 (ms)':>17}"
+          f"{'matches':>10}{'read':>8}{'postings':>10}{'share':>8}{'source found':>14}")
+    for query_length in args.query_lengths:
+        queries = [(doc_id, rng.sample(terms, query_length)) for doc_id, terms in samples]
+
+        # The first pass reads the postings and skip pointers of every word
+        for _, terms in queries:
+            matcher.match(("and", tuple(("term", term) for term in terms)))
+        and_latencies, ranked_and_latencies, ranked_latencies = [], [], []
+        matches = postings = postings_read = found = 0
+        for doc_id, terms in queries:
+            tree = ("and", tuple(("term", term) for term in terms))
+            query_vector = query.terms_query_vector(terms, inverted_index)
+            before = matcher.postings_read
+            start_time = time.perf_counter()
+            doc_candidates = matcher.match(tree)
+            and_latencies.append(time.perf_counter() - start_time)
+            postings_read += matcher.postings_read - before
+            matches += len(doc_candidates)
+            postings += sum(scorer.document_frequency(term) for term in terms)
+            found += bool(np.isin(document_numbers[doc_id], doc_candidates))
+
+            start_time = time.perf_counter()
+            scorer.top_k_of(query_vector, tf_scheme, df_scheme, normalization, args.k, matcher.match(tree))
+            ranked_and_latencies.append(time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, args.k)
+            ranked_latencies.append(time.perf_counter() - start_time)
+
+        matched, ranked_and, ranked = percentiles_ms(and_latencies), percentiles_ms(ranked_and_latencies), percentiles_ms(ranked_latencies)
+        print(f"{query_length:>6}{matched['p50_ms']:>14.3f}{matched['p95_ms']:>10.3f}{ranked_and['p50_ms']:>21.3f}{ranked['p50_ms']:>17.3f}"
+              f"{matches / len(queries):>10.1f}{postings_read / len(queries):>8.0f}{postings / len(queries):>10.0f}"
+              f"{postings_read / max(postings, 1):>8.1%}{found:>9}/{len(queries)}")
+
+def lexicon_expansion(args):
+    '''
+    Times the expansion of prefixes, wildcard patterns and misspellings (1 and 2 random edits) of random terms
+    with the lexicon against a scan of the whole vocabulary, which finds every match. Reports the terms and
+    gram entries the lexicon reads, and how often a misspelling is expanded into the term it came from.
+    '''
+    import re
+    import numpy as np
+    import lexicon
+    import query
+
+    collection = collection_object.Collection()
+    preprocessing_method = collection_object.Collection.tokenization(args.tokenization)
+    index_path = query.get_index_path(collection, args.collection, preprocessing_method, args.format)
+    inverted_index = query.load_index(collection, args.collection, preprocessing_method, args.format)
+
+    start_time = time.perf_counter()
+    stored = lexicon.open_lexicon(index_path, inverted_index)
+    load_seconds = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    lex = lexicon.build_lexicon(lexicon.vocabulary(inverted_index))
+    build_seconds = time.perf_counter() - start_time
+    load = f'read from its files in {load_seconds * 1000:.1f} ms' if stored is not None else 'not stored with the index (build_index.py --lexicon)'
+    print(f"{len(lex)} terms, {len(lex.grams)} grams, built in {build_seconds * 1000:.1f} ms, {load}")
+
+    rng = random.Random(args.seed)
+    terms = [term for term in lex.terms if len(term) >= 5]
+    alphabet = sorted({character for term in terms for character in term})
+
+    def misspell(term, edits):
+        characters = list(term)
+        for _ in range(edits):
+            position = rng.randrange(len(characters))
+            operation = rng.choice(["delete", "insert", "replace"])
+            if operation == "delete" and len(characters) > 1:
+                del characters[position]
+            elif operation == "insert":
+                characters.insert(position, rng.choice(alphabet))
+            else:
+                characters[position] = rng.choice(alphabet)
+        return ''.join(characters)
+
+    def scan_pattern(pattern):
+        expression = re.compile(''.join('.*' if character == '*' else '.' if character == '?' else re.escape(character) for character in pattern))
+        return [term for term in lex.terms if expression.fullmatch(term)]
+
+    def scan_fuzzy(word, distance):
+        distances = lexicon.edit_distances(word, lex.terms, distance)
+        return [lex.terms[number] for number in np.flatnonzero(distances <= distance)]
+
+    # Kind of expansion, number of edits of the misspellings (None for patterns), (source term, pattern or misspelling)
+    sources = [rng.choice(terms) for _ in range(args.queries)]
+    workloads = [
+        ("prefix", None, [(term, term[:rng.randint(3, 5)] + '*') for term in sources]),
+        ("wildcard", None, [(term, term[:2] + '*' + term[-3:]) for term in sources]),
+        ("one ?", None, [(term, term[:2] + '?' + term[3:]) for term in sources]),
+        ("1 edit", 1, [(term, misspell(term, 1)) for term in sources]),
+        ("2 edits", 2, [(term, misspell(term, 2)) for term in sources])
+    ]
+
+    print(f"{args.queries} expansions per kind")
+    print(f"{'kind':>9}{'lexicon p50 (ms)':>18}{'p95 (ms)':>10}{'scan p50 (ms)':>15}{'compared':>10}{'grams read':>12}"
+          f"{'matches':>9}{'missed':>8}{'source found':>14}")
+    for kind, edits, queries in workloads:
+        latencies, scan_latencies = [], []
+        compared = grams_read = matches = missed = found = 0
+        for source, text in queries:
+            terms_compared, grams_before = lex.terms_compared, lex.grams_read
+            start_time = time.perf_counter()
+            if edits is None:
+                expanded = lex.expand_pattern(text)
+            else:
+                distance = max(edits, lexicon.automatic_distance(text))
+                expanded = [term for term, _ in lex.expand_fuzzy(text, distance)]
+            latencies.append(time.perf_counter() - start_time)
+            compared += lex.terms_compared - terms_compared
+            grams_read += lex.grams_read - grams_before
+
+            start_time = time.perf_counter()
+            scanned = scan_pattern(text) if edits is None else scan_fuzzy(text, distance)
+            scan_latencies.append(time.perf_counter() - start_time)
+
+            matches += len(expanded)
+            # Patterns find every match, misspellings may miss terms that share too few grams with them
+            missed += len(set(scanned) - set(expanded))
+            found += source in expanded
+
+        lookup, scan = percentiles_ms(latencies), percentiles_ms(scan_latencies)
+        print(f"{kind:>9}{lookup['p50_ms']:>18.3f}{lookup['p95_ms']:>10.3f}{scan['p50_ms']:>15.3f}{compared / len(queries):>10.0f}"
+              f"{grams_read / len(queries):>12.0f}{matches / len(queries):>9.1f}{missed / len(queries):>8.1f}{found:>9}/{len(queries)}")
+
+def scaling_worker(args):
+    '''
+    Generates a synthetic collection of one size into a folder, times every stage of indexing and querying it,
+    and prints the measurements as JSON.
+    '''
+    import preprocessing
+    import query
+    from build_index import build_index
+    from build_index import read_documents
+    from synthetic_collection import write_collection
+    from utils import read_queries
+
+    collection = collection_object.Collection()
+    path_prefix = os.path.join(args.output, 'synthetic')
+    preprocessing_methods = [collection_object.Collection.tokenization(tokenization) for tokenization in args.tokenizations]
+    results = {"documents": args.documents}
+
+    start_time = time.perf_counter()
+    results["words"] = write_collection(path_prefix, args.documents, args.vocabulary, args.length, args.zipf,
+                                        args.queries, args.query_length, seed=args.seed)
+    results["generate_seconds"] = time.perf_counter() - start_time
+    results["corpus_bytes"] = os.path.getsize(path_prefix + '.ALL')
+
+    start_time = time.perf_counter()
+    documents = read_documents(path_prefix + '.ALL')
+    results["read_documents_seconds"] = time.perf_counter() - start_time
+    queries = list(read_queries(path_prefix + '.QRY').values())
+
+    for key in ["build_seconds", "terms", "postings", "write_seconds", "load_seconds", "index_bytes", "queries"]:
+        results[key] = {}
+    for preprocessing_method in preprocessing_methods:
+        start_time = time.perf_counter()
+        index = build_index(documents, preprocessing_method, args.workers)
+        results["build_seconds"][preprocessing_method] = time.perf_counter() - start_time
+        vocabulary = [term for term in index.keys() if not term.startswith('_')]
+        results["terms"][preprocessing_method] = len(vocabulary)
+        results["postings"][preprocessing_method] = sum(index[term][0] for term in vocabulary)
+
+        writes = results["write_seconds"][preprocessing_method] = {}
+        loads = results["load_seconds"][preprocessing_method] = {}
+        sizes = results["index_bytes"][preprocessing_method] = {}
+        for index_format in args.formats:
+            path = os.path.join(args.output, preprocessing_method + collection.index_formats[index_format])
+            start_time = time.perf_counter()
+            collection.write_data(index, path, index_format)
+            writes[index_format] = time.perf_counter() - start_time
+            sizes[index_format] = sum(os.path.getsize(file) for file in collection.get_index_files(path, index_format))
+            start_time = time.perf_counter()
+            collection.read_data(path, index_format)
+            loads[index_format] = time.perf_counter() - start_time
+            for file in collection.get_index_files(path, index_format):
+                os.remove(file)
+
+        # The first pass normalizes the query words and decodes their postings, like a warm server
+        for query_text in queries:
+            query.tokenize_and_answer(query_text, "n", "n", "n", 1, preprocessing_method, index)
+        latencies = results["queries"][preprocessing_method] = {}
+        for weighting_scheme in args.weighting_schemes:
+            tf_scheme, df_scheme, normalization = weighting_scheme
+            latencies[weighting_scheme] = {}
+            for k in args.k:
+                query_seconds = []
+                for query_text in queries:
+                    start_time = time.perf_counter()
+                    query.tokenize_and_answer(query_text, tf_scheme, df_scheme, normalization, k, preprocessing_method, index)
+                    query_seconds.append(time.perf_counter() - start_time)
+                measurements = percentiles_ms(query_seconds)
+                measurements["queries_per_second"] = len(query_seconds) / sum(query_seconds)
+                latencies[weighting_scheme][str(k)] = measurements
+        del index
+
+    results["peak_rss_kb"] = peak_rss_kb()
+    print(json.dumps(results))
+
+def flatten_results(results, prefix=''):
+    '''
+    Return the numbers of nested results as a dictionary of path ('10000/build_seconds/stemming'): number.
+    '''
+    numbers = {}
+    for key, value in results.items():
+        path = f'{prefix}/{key}' if prefix else str(key)
+        if isinstance(value, dict):
+            numbers.update(flatten_results(value, path))
+        elif isinstance(value, (int, float)):
+            numbers[path] = value
+    return numbers
+
+def compare_results(results, previous, tolerance):
+    '''
+    Prints the measurements that changed by more than tolerance (0.1 for 10%) since a previous run.
+    Larger is better for throughput, smaller for everything else. Returns the number of regressions.
+    '''
+    numbers = flatten_results(results["sizes"])
+    previous_numbers = flatten_results(previous["sizes"])
+    regressions = 0
+    if results["parameters"] != previous["parameters"] or results["environment"] != previous["environment"]:
+        print("\nThe runs were made with different parameters or environments, their measurements may not be comparable")
+    print(f"\nChanges of more than {tolerance:.0%} since the run of {previous['created']}:")
+    for path, value in numbers.items():
+        previous_value = previous_numbers.get(path)
+        if not previous_value or path.endswith(("/documents", "/words", "/terms", "/postings")) or "/terms/" in path or "/postings/" in path:
+            continue
+        ratio = value / previous_value
+        better = ratio > 1 if path.endswith("queries_per_second") else ratio < 1
+        if abs(ratio - 1) > tolerance:
+            regressions += not better
+            print(f"    {path:<60}{previous_value:>12.4g}{value:>12.4g}{ratio:>8.2f}x  {'better' if better else 'WORSE'}")
+    if not regressions:
+        print("    no regressions")
+    return regressions
+
+def scaling(args):
+    '''
+    Runs the scaling worker for every collection size, each in a fresh process, prints a summary,
+    writes every measurement to a JSON file and compares it with an earlier run.
+    '''
+    import platform
+    import numpy as np
+
+    results = {
+        "benchmark": "scaling",
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count()
+        },
+        "parameters": {name: value for name, value in vars(args).items() if name not in ("benchmark", "function", "compare", "output", "tolerance")},
+        "sizes": {}
+    }
+
+    print(f"{'documents':>10}{'generate (s)':>14}{'read (s)':>10}" + "".join(f"{'build ' + tokenization + ' (s)':>14}" for tokenization in args.tokenizations)
+          + f"{'write (s)':>11}{'load (s)':>10}{'peak RSS (MB)':>15}")
+    for documents in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            run = run_worker(['_scaling-worker', directory, documents, '--vocabulary', args.vocabulary, '--length', args.length,
+                              '--zipf', args.zipf, '--queries', args.queries, '--query-length', args.query_length,
+                              '--workers', args.workers, '--seed', args.seed, '--tokenizations', *args.tokenizations,
+                              '--formats', *args.formats, '--weighting-schemes', *args.weighting_schemes, '--k', *args.k])
+        results["sizes"][str(documents)] = run
+        # Write and load of the first index in the first format
+        first_method = next(iter(run["build_seconds"]))
+        print(f"{documents:>10}{run['generate_seconds']:>14.2f}{run['read_documents_seconds']:>10.2f}"
+              + "".join(f"{seconds:>14.2f}" for seconds in run["build_seconds"].values())
+              + f"{run['write_seconds'][first_method][args.formats[0]]:>11.2f}{run['load_seconds'][first_method][args.formats[0]]:>10.2f}"
+              + f"{run['peak_rss_kb'] / 1024:>15.1f}")
+
+    print(f"\n{'documents':>10}{'index':>15}{'scheme':>8}{'k':>6}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'queries/s':>11}")
+    for documents, run in results["sizes"].items():
+        for preprocessing_method, schemes in run["queries"].items():
+            for weighting_scheme, by_k in schemes.items():
+                for k, measurements in by_k.items():
+                    print(f"{documents:>10}{preprocessing_method:>15}{weighting_scheme:>8}{k:>6}{measurements['p50_ms']:>10.3f}"
+                          f"{measurements['p95_ms']:>10.3f}{measurements['p99_ms']:>10.3f}{measurements['queries_per_second']:>11.0f}")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as file:
+            previous = json.load(file)
+        if compare_results(results, previous, args.tolerance):
+            exit(1)
+
+def import_times(module):
+    '''
+    Imports a module in a new interpreter with -X importtime.
+    Returns the cumulative import time of every module in microseconds.
+    '''
+    code_folder = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, '-X', 'importtime', '-c', f'import {module}']
+    process = subprocess.run(command, capture_output=True, text=True, check=True, cwd=code_folder)
+
+    cumulative_times = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        cumulative_times[name.strip()] = int(cumulative)
+    return cumulative_times
+
+def startup(args):
+    '''
+    Measures how long the query CLI takes to import, and how long nltk takes when the first
+    query is tokenized. Exits with an error when the import time is over the budget.
+    '''
+    runs = [import_times('query') for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times['query'])
+    query_ms = best['query'] / 1000
+    nltk_ms = min(import_times('nltk')['nltk'] for _ in range(args.repeat)) / 1000
+
+    print(f"Slowest imports of query.py (cumulative):")
+    top_level = sorted(((time_us, name) for name, time_us in best.items() if name != 'query'), reverse=True)[:args.top]
+    for time_us, name in top_level:
+        print(f"    {name:<40}{time_us / 1000:>8.1f} ms")
+    print(f"import query{query_ms:>38.1f} ms (budget {args.budget_ms} ms)")
+    print(f"import nltk (first tokenization){nltk_ms:>18.1f} ms")
+
+    if query_ms > args.budget_ms:
+        print("Startup budget exceeded")
+        exit(1)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Speed and memory benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    parser_index_load = subparsers.add_parser('index-load', help='Compare load time and memory of the index formats')
+    parser_index_load.add_argument('collection', type=str, help='Name of the collection (its indexes must exist in every format)')
+    parser_index_load.add_argument('tokenization', choices=['l', 's'], help='Index to load: l for lemmatization, s for stemming')
+    parser_index_load.add_argument('--repeat', type=collection_object.Collection.positive_int, default=3, help='Number of runs per format, the fastest is reported')
+    parser_index_load.add_argument('--term-stride', type=collection_object.Collection.positive_int, default=100, help='Look up every n-th term of the vocabulary')
+    parser_index_load.set_defaults(function=index_load)
+
+    parser_compact = subparsers.add_parser('compact-index', help='Compare the memory and speed of nested-list and compact in-memory indexes')
+    parser_compact.add_argument('collection', type=str, help='Name of the collection (its JSON indexes must exist)')
+    parser_compact.add_argument('tokenization', choices=['l', 's'], help='Index to compare: l for lemmatization, s for stemming')
+    parser_compact.add_argument('--weighting-scheme', type=collection_object.Collection.weighting_scheme, default='ltc', help='Weighting scheme of the queries')
+    parser_compact.add_argument('--k', type=collection_object.Collection.positive_int, default=100, help='Number of answers to retrieve')
+    parser_compact.add_argument('--queries', type=collection_object.Collection.positive_int, default=200, help='Number of random queries')
+    parser_compact.add_argument('--query-length', type=collection_object.Collection.positive_int, default=8, help='Number of terms per query')
+    parser_compact.add_argument('--seed', type=int, default=361, help='Seed of the random queries')
+    parser_compact.add_argument('--build', action='store_true', help='Also build the index with each representation')
+    parser_compact.set_defaults(function=compact_index)
+
+    parser_scoring = subparsers.add_parser('scoring', help='Compare the latency of the two ranking implementations')
+    parser_scoring.add_argument('collection', type=str, help='Name of the collection')
+    parser_scoring.add_argument('weighting_scheme', type=collection_object.Collection.weighting_scheme, help='Weighting scheme of the documents')
+    parser_scoring.add_argument('tokenization', choices=['l', 's'], help='Index to query: l for lemmatization, s for stemming')
+    parser_scoring.add_argument('--k', type=collection_object.Collection.positive_int, nargs='+', default=[10, 100, 1000], help='Numbers of answers to retrieve')
+    parser_scoring.add_argument('--query-lengths', type=collection_object.Collection.positive_int, nargs='+', default=[1, 2, 4, 8, 16, 32], help='Numbers of terms per query')
+    parser_scoring.add_argument('--queries', type=collection_object.Collection.positive_int, default=50, help='Number of queries per query length')
+    parser_scoring.add_argument('--seed', type=int, default=361, help='Seed of the random queries')
+    parser_scoring.add_argument('--format', choices=['json', 'binary', 'compressed'], default='json', help='On-disk format of the index')
+    parser_scoring.set_defaults(function=scoring)
+
+    parser_pruning = subparsers.add_parser('pruning', help='Compare exhaustive and pruned top-k retrieval on long queries')
+    parser_pruning.add_argument('collection', type=str, help='Name of the collection')
+    parser_pruning.add_argument('weighting_scheme', type=collection_object.Collection.weighting_scheme, help='Weighting scheme of the documents')
+    parser_pruning.add_argument('tokenization', choices=['l', 's'], help='Index to query: l for lemmatization, s for stemming')
+    parser_pruning.add_argument('--k', type=collection_object.Collection.positive_int, nargs='+', default=[10, 100], help='Numbers of answers to retrieve')
+    parser_pruning.add_argument('--query-lengths', type=collection_object.Collection.positive_int, nargs='+', default=[8, 16, 32, 64], help='Numbers of terms per query')
+    parser_pruning.add_argument('--queries', type=collection_object.Collection.positive_int, default=50, help='Number of queries per query length')
+    parser_pruning.add_argument('--seed', type=int, default=361, help='Seed of the random queries')
+    parser_pruning.add_argument('--format', choices=['json', 'binary', 'compressed'], default='json', help='On-disk format of the index')
+    parser_pruning.set_defaults(function=pruning)
+
+    parser_result_cache = subparsers.add_parser('result-cache', help='Compare repeated queries with and without the result cache')
+    parser_result_cache.add_argument('collection', type=str, help='Name of the collection')
+    parser_result_cache.add_argument('weighting_scheme', type=collection_object.Collection.weighting_scheme, help='Weighting scheme of the documents')
+    parser_result_cache.add_argument('tokenization', choices=['l', 's'], help='Index to query: l for lemmatization, s for stemming')
+    parser_result_cache.add_argument('--k', type=collection_object.Collection.positive_int, nargs='+', default=[10, 20, 50, 100], help='Numbers of answers the requests ask for')
+    parser_result_cache.add_argument('--requests', type=collection_object.Collection.positive_int, default=2000, help='Number of queries in the stream')
+    parser_result_cache.add_argument('--zipf', type=float, default=1.0, help='Exponent of the Zipfian popularity of the queries')
+    parser_result_cache.add_argument('--cache-sizes', type=int, nargs='+', default=[16, 64, 1024], help='Numbers of answers kept by the caches')
+    parser_result_cache.add_argument('--seed', type=int, default=361, help='Seed of the query stream')
+    parser_result_cache.add_argument('--format', choices=['json', 'binary', 'compressed'], default='json', help='On-disk format of the index')
+    parser_result_cache.set_defaults(function=result_cache_suite)
+
+    parser_batch = subparsers.add_parser('batch', help='Compare one query at a time with sparse matrix batch retrieval')
+    parser_batch.add_argument('collection', type=str, help='Name of the collection')
+    parser_batch.add_argument('tokenization', choices=['l', 's'], help='Index to query: l for lemmatization, s for stemming')
+    parser_batch.add_argument('--weighting-schemes', type=collection_object.Collection.weighting_scheme, nargs='+',
+                              default=["nnn", "nnc", "ntn", "ntc", "lnn", "lnc", "ltn", "ltc"], help='Weighting schemes to evaluate')
+    parser_batch.add_argument('--k', type=collection_object.Collection.positive_int, default=100, help='Number of answers to retrieve')
+    parser_batch.add_argument('--queries', type=collection_object.Collection.positive_int, default=2000, help='Number of queries in the batch')
+    parser_batch.add_argument('--query-length', type=collection_object.Collection.positive_int, default=8, help='Number of terms per query')
+    parser_batch.add_argument('--seed', type=int, default=361, help='Seed of the random queries')
+    parser_batch.add_argument('--format', choices=['json', 'binary', 'compressed'], default='json', help='On-disk format of the index')
+    parser_batch.set_defaults(function=batch)
+
+    parser_evaluation = subparsers.add_parser('evaluation', help='Time the metrics and significance tests of many configurations')
+    parser_evaluation.add_argument('collection', type=str, help='Name of the collection whose judgements are used')
+    parser_evaluation.add_argument('--configurations', type=collection_object.Collection.positive_int, default=2000, help='Number of random runs')
+    parser_evaluation.add_argument('--k', type=collection_object.Collection.positive_int, default=100, help='Number of documents ranked per query')
+    parser_evaluation.add_argument('--samples', type=collection_object.Collection.positive_int, default=10000, help='Number of samples of the significance tests')
+    parser_evaluation.add_argument('--seed', type=int, default=361, help='Seed of the random runs and tests')
+    parser_evaluation.set_defaults(function=evaluation_suite)
+
+    parser_impacts = subparsers.add_parser('impacts', help='Compare the size and query speed of precomputed impacts')
+    parser_impacts.add_argument('collection', type=str, help='Name of the collection (its JSON indexes must exist)')
+    parser_impacts.add_argument('tokenization', choices=['l', 's'], help='Index to compare: l for lemmatization, s for stemming')
+    parser_impacts.add_argument('--weighting-schemes', type=collection_object.Collection.weighting_scheme, nargs='+',
+                                default=["nnn", "nnc", "ntn", "ntc", "lnn", "lnc", "ltn", "ltc"], help='Weighting schemes to evaluate')
+    parser_impacts.add_argument('--k', type=collection_object.Collection.positive_int, default=100, help='Number of answers to retrieve')
+    parser_impacts.add_argument('--queries', type=collection_object.Collection.positive_int, default=500, help='Number of random queries')
+    parser_impacts.add_argument('--query-length', type=collection_object.Collection.positive_int, default=8, help='Number of terms per query')
+    parser_impacts.add_argument('--seed', type=int, default=361, help='Seed of the random queries')
+    parser_impacts.set_defaults(function=impact_weights)
+
+    parser_build = subparsers.add_parser('build', help='Compare index build times by number of workers')
+    parser_build.add_argument('collection', type=str, help='Name of the collection')
+    parser_build.add_argument('--tokenizations', choices=['l', 's'], nargs='+', default=['l', 's'], help='Indexes to build')
+    parser_build.add_argument('--workers', type=collection_object.Collection.positive_int, nargs='+', default=[1, 2, 4, 8], help='Numbers of worker processes, the first one is the reference')
+    parser_build.set_defaults(function=build)
+
+    parser_cache = subparsers.add_parser('normalization-cache', help='Compare index build times with and without the normalization cache')
+    parser_cache.add_argument('collection', type=str, help='Name of the collection')
+    parser_cache.add_argument('--tokenizations', choices=['l', 's'], nargs='+', default=['l', 's'], help='Indexes to build')
+    parser_cache.add_argument('--cache-size', type=int, default=2 ** 18, help='Number of normalized tokens kept in memory')
+    parser_cache.add_argument('--synthetic-documents', type=collection_object.Collection.positive_int, default=10000, help='Number of documents in the resampled corpus')
+    parser_cache.add_argument('--synthetic-length', type=collection_object.Collection.positive_int, default=150, help='Number of words per resampled document')
+    parser_cache.add_argument('--seed', type=int, default=361, help='Seed of the resampled corpus')
+    parser_cache.set_defaults(function=normalization_cache)
+
+    parser_compression = subparsers.add_parser('compression', help='Compare the size, decode speed and query latency of the index formats')
+    parser_compression.add_argument('collection', type=str, help='Name of the collection (its JSON indexes must exist)')
+    parser_compression.add_argument('tokenization', choices=['l', 's'], help='Index to compare: l for lemmatization, s for stemming')
+    parser_compression.add_argument('--weighting-scheme', type=collection_object.Collection.weighting_scheme, default='ltc', help='Weighting scheme of the queries')
+    parser_compression.add_argument('--k', type=collection_object.Collection.positive_int, default=100, help='Number of answers to retrieve')
+    parser_compression.add_argument('--queries', type=collection_object.Collection.positive_int, default=200, help='Number of random queries')
+    parser_compression.add_argument('--query-length', type=collection_object.Collection.positive_int, default=8, help='Number of terms per query')
+    parser_compression.add_argument('--seed', type=int, default=361, help='Seed of the random queries')
+    parser_compression.set_defaults(function=compression)
+
+    parser_update = subparsers.add_parser('update', help='Compare an incremental update with a full rebuild')
+    parser_update.add_argument('collection', type=str, help='Name of the collection')
+    parser_update.add_argument('--weighting-scheme', type=collection_object.Collection.weighting_scheme, default='ltc', help='Weighting scheme of the queries')
+    parser_update.add_argument('--tokenizations', choices=['l', 's'], nargs='+', default=['l', 's'], help='Indexes to build')
+    parser_update.add_argument('--added', type=collection_object.Collection.positive_int, default=20, help='Number of documents held out and added by the update')
+    parser_update.add_argument('--replaced', type=int, default=10, help='Number of documents replaced by the update')
+    parser_update.add_argument('--deleted', type=int, default=10, help='Number of documents deleted by the update')
+    parser_update.add_argument('--k', type=collection_object.Collection.positive_int, default=100, help='Number of answers to retrieve')
+    parser_update.add_argument('--queries', type=collection_object.Collection.positive_int, default=200, help='Number of random queries')
+    parser_update.add_argument('--query-length', type=collection_object.Collection.positive_int, default=8, help='Number of terms per query')
+    parser_update.add_argument('--seed', type=int, default=361, help='Seed of the update and the queries')
+    parser_update.set_defaults(function=update)
+
+    parser_streaming = subparsers.add_parser('streaming', help='Compare in-memory and streaming builds')
+    parser_streaming.add_argument('collection', type=str, help='Name of the collection the corpus is resampled from')
+    parser_streaming.add_argument('--memory-limits', type=collection_object.Collection.positive_int, nargs='+', default=[256, 64, 16], help='Memory limits of the streaming builds in MB')
+    parser_streaming.add_argument('--synthetic-documents', type=collection_object.Collection.positive_int, default=20000, help='Number of documents in the resampled corpus')
+    parser_streaming.add_argument('--synthetic-length', type=collection_object.Collection.positive_int, default=150, help='Number of words per resampled document')
+    parser_streaming.add_argument('--cache-size', type=int, default=2 ** 18, help='Number of normalized tokens kept in memory')
+    parser_streaming.add_argument('--seed', type=int, default=361, help='Seed of the resampled corpus')
+    parser_streaming.set_defaults(function=streaming)
+
+    parser_sharding = subparsers.add_parser('sharding', help='Time queries answered by shard worker processes by number of shards')
+    parser_sharding.add_argument('collection', type=str, help='Name of the collection (its JSON indexes must exist)')
+    parser_sharding.add_argument('tokenization', choices=['l', 's'], help='Index to shard: l for lemmatization, s for stemming')
+    parser_sharding.add_argument('--shards', type=collection_object.Collection.positive_int, nargs='+', default=[1, 2, 4, 8], help='Numbers of shards')
+    parser_sharding.add_argument('--weighting-scheme', type=collection_object.Collection.weighting_scheme, default='ltc', help='Weighting scheme of the queries')
+    parser_sharding.add_argument('--k', type=collection_object.Collection.positive_int, default=10, help='Number of answers to retrieve')
+    parser_sharding.add_argument('--queries', type=collection_object.Collection.positive_int, default=200, help='Number of random queries')
+    parser_sharding.add_argument('--query-length', type=collection_object.Collection.positive_int, default=5, help='Number of terms per query')
+    parser_sharding.add_argument('--clients', type=collection_object.Collection.positive_int, default=8, help='Number of queries sent at once for the throughput')
+    parser_sharding.add_argument('--seed', type=int, default=361, help='Seed of the random queries')
+    parser_sharding.add_argument('--output', type=str, default=None, help='JSON file the results are written to')
+    parser_sharding.set_defaults(function=sharded_queries)
+
+    parser_phrases = subparsers.add_parser('phrases', help='Time phrase and proximity queries by number of words')
+    parser_phrases.add_argument('collection', type=str, help='Name of the collection (its index must be built with --positions)')
+    parser_phrases.add_argument('tokenization', choices=['l', 's'], help='Index to query: l for lemmatization, s for stemming')
+    parser_phrases.add_argument('--phrase-lengths', type=collection_object.Collection.positive_int, nargs='+', default=[2, 3, 4, 5], help='Numbers of words per phrase')
+    parser_phrases.add_argument('--distance', type=collection_object.Collection.positive_int, default=5, help='k of the NEAR/k queries')
+    parser_phrases.add_argument('--weighting-scheme', type=collection_object.Collection.weighting_scheme, default='ltc', help='Weighting scheme of the queries')
+    parser_phrases.add_argument('--k', type=collection_object.Collection.positive_int, default=10, help='Number of answers to retrieve')
+    parser_phrases.add_argument('--queries', type=collection_object.Collection.positive_int, default=200, help='Number of phrases per length')
+    parser_phrases.add_argument('--seed', type=int, default=361, help='Seed of the random phrases')
+    parser_phrases.add_argument('--format', choices=['json', 'binary', 'compressed'], default='json', help='On-disk format of the index')
+    parser_phrases.set_defaults(function=phrase_queries)
+
+    parser_boolean = subparsers.add_parser('boolean', help='Time Boolean AND queries by number of words against ranked queries')
+    parser_boolean.add_argument('collection', type=str, help='Name of the collection')
+    parser_boolean.add_argument('tokenization', choices=['l', 's'], help='Index to query: l for lemmatization, s for stemming')
+    parser_boolean.add_argument('--query-lengths', type=collection_object.Collection.positive_int, nargs='+', default=[2, 3, 4, 5], help='Numbers of words per query')
+    parser_boolean.add_argument('--weighting-scheme', type=collection_object.Collection.weighting_scheme, default='ltc', help='Weighting scheme of the ranked queries')
+    parser_boolean.add_argument('--k', type=collection_object.Collection.positive_int, default=10, help='Number of answers to retrieve')
+    parser_boolean.add_argument('--queries', type=collection_object.Collection.positive_int, default=200, help='Number of queries per length')
+    parser_boolean.add_argument('--seed', type=int, default=361, help='Seed of the random queries')
+    parser_boolean.add_argument('--format', choices=['json', 'binary', 'compressed'], default='json', help='On-disk format of the index')
+    parser_boolean.set_defaults(function=boolean_queries)
+
+    parser_lexicon = subparsers.add_parser('lexicon', help='Time prefix, wildcard and fuzzy term expansion against a scan of the vocabulary')
+    parser_lexicon.add_argument('collection', type=str, help='Name of the collection')
+    parser_lexicon.add_argument('tokenization', choices=['l', 's'], help='Index whose vocabulary is expanded: l for lemmatization, s for stemming')
+    parser_lexicon.add_argument('--queries', type=collection_object.Collection.positive_int, default=200, help='Number of expansions per kind')
+    parser_lexicon.add_argument('--seed', type=int, default=361, help='Seed of the random terms')
+    parser_lexicon.add_argument('--format', choices=['json', 'binary', 'compressed'], default='json', help='On-disk format of the index')
+    parser_lexicon.set_defaults(function=lexicon_expansion)
+
+    parser_scaling = subparsers.add_parser('scaling', help='Time indexing and querying synthetic collections of increasing size')
+    parser_scaling.add_argument('--sizes', type=collection_object.Collection.positive_int, nargs='+', default=[10000, 100000], help='Numbers of documents of the synthetic collections (up to 1000000)')
+    parser_scaling.add_argument('--vocabulary', type=collection_object.Collection.positive_int, default=50000, help='Number of distinct words')
+    parser_scaling.add_argument('--length', type=collection_object.Collection.positive_int, default=100, help='Average number of words per document')
+    parser_scaling.add_argument('--zipf', type=float, default=1.1, help='Exponent of the Zipfian word frequencies')
+    parser_scaling.add_argument('--queries', type=collection_object.Collection.positive_int, default=100, help='Number of queries timed per weighting scheme and k')
+    parser_scaling.add_argument('--query-length', type=collection_object.Collection.positive_int, default=5, help='Number of words per query')
+    parser_scaling.add_argument('--tokenizations', choices=['l', 's'], nargs='+', default=['l', 's'], help='Indexes to build')
+    parser_scaling.add_argument('--formats', choices=['json', 'binary', 'compressed'], nargs='+', default=['json', 'binary', 'compressed'], help='Index formats to write and load')
+    parser_scaling.add_argument('--weighting-schemes', type=collection_object.Collection.weighting_scheme, nargs='+',
+                                default=["nnn", "nnc", "ntn", "ntc", "lnn", "lnc", "ltn", "ltc"], help='Weighting schemes of the queries')
+    parser_scaling.add_argument('--k', type=collection_object.Collection.positive_int, nargs='+', default=[10, 100, 1000], help='Numbers of answers to retrieve')
+    parser_scaling.add_argument('--workers', type=collection_object.Collection.positive_int, default=1, help='Number of processes that build each index')
+    parser_scaling.add_argument('--seed', type=int, default=361, help='Seed of the synthetic collections')
+    parser_scaling.add_argument('--output', type=str, default='results/benchmark_scaling.json', help='JSON file the results are written to')
+    parser_scaling.add_argument('--compare', type=str, default=None, help='JSON file of an earlier run to compare with, exits with an error on regressions')
+    parser_scaling.add_argument('--tolerance', type=float, default=0.2, help='Relative change below which measurements are not reported (latencies under a millisecond are noisy)')
+    parser_scaling.set_defaults(function=scaling)
+
+    parser_startup = subparsers.add_parser('startup', help='Check the import time of the query CLI against its budget')
+    parser_startup.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS, help='Maximum import time of query.py')
+    parser_startup.add_argument('--repeat', type=collection_object.Collection.positive_int, default=5, help='Number of runs, the fastest is reported')
+    parser_startup.add_argument('--top', type=collection_object.Collection.positive_int, default=10, help='Number of slowest imports to list')
+    parser_startup.set_defaults(function=startup)
+
+    # Internal: runs inside the fresh process started by index-load
+    parser_worker = subparsers.add_parser('_index-load-worker')
+    parser_worker.add_argument('path', type=str)
+    parser_worker.add_argument('--term-stride', type=int, default=100)
+    parser_worker.set_defaults(function=index_load_worker)
+
+    # Internal: runs inside the fresh processes started by compact-index
+    parser_compact_worker = subparsers.add_parser('_compact-index-worker')
+    parser_compact_worker.add_argument('collection', type=str)
+    parser_compact_worker.add_argument('tokenization', choices=['l', 's'])
+    parser_compact_worker.add_argument('representation', choices=['dict', 'compact'])
+    parser_compact_worker.add_argument('--mode', choices=['load', 'build'], default='load')
+    parser_compact_worker.add_argument('--weighting-scheme', type=collection_object.Collection.weighting_scheme, default='ltc')
+    parser_compact_worker.add_argument('--k', type=int, default=100)
+    parser_compact_worker.add_argument('--queries', type=int, default=200)
+    parser_compact_worker.add_argument('--query-length', type=int, default=8)
+    parser_compact_worker.add_argument('--seed', type=int, default=361)
+    parser_compact_worker.set_defaults(function=compact_index_worker)
+
+    # Internal: runs inside the fresh processes started by streaming
+    parser_streaming_worker = subparsers.add_parser('_streaming-worker')
+    parser_streaming_worker.add_argument('corpus', type=str)
+    parser_streaming_worker.add_argument('output', type=str)
+    parser_streaming_worker.add_argument('--memory-limit-mb', type=int, default=0)
+    parser_streaming_worker.add_argument('--cache-size', type=int, default=2 ** 18)
+    parser_streaming_worker.set_defaults(function=streaming_worker)
+
+    # Internal: runs inside the fresh processes started by scaling
+    parser_scaling_worker = subparsers.add_parser('_scaling-worker')
+    parser_scaling_worker.add_argument('output', type=str)
+    parser_scaling_worker.add_argument('documents', type=int)
+    parser_scaling_worker.add_argument('--vocabulary', type=int, default=50000)
+    parser_scaling_worker.add_argument('--length', type=int, default=100)
+    parser_scaling_worker.add_argument('--zipf', type=float, default=1.1)
+    parser_scaling_worker.add_argument('--queries', type=int, default=100)
+    parser_scaling_worker.add_argument('--query-length', type=int, default=5)
+    parser_scaling_worker.add_argument('--workers', type=int, default=1)
+    parser_scaling_worker.add_argument('--seed', type=int, default=361)
+    parser_scaling_worker.add_argument('--tokenizations', nargs='+', default=['l', 's'])
+    parser_scaling_worker.add_argument('--formats', nargs='+', default=['json'])
+    parser_scaling_worker.add_argument('--weighting-schemes', nargs='+', default=['ltc'])
+    parser_scaling_worker.add_argument('--k', type=int, nargs='+', default=[10])
+    parser_scaling_worker.set_defaults(function=scaling_worker)
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    args.function(args)
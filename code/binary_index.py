@@ -0,0 +1,164 @@
+'''
+
+Compact binary on-disk format for the inverted index, used by collection_object.py
+
+An index is stored in two files:
+    <name>.terms        JSON term dictionary: term -> [DF, byte offset], the document table (_D_) and metadata (_M_, ...)
+    <name>.postings     postings of every term, stored back to back. Each postings list is a block of
+                        document numbers followed by a block of term frequencies (little endian uint32)
+
+The postings file is memory-mapped, so a query only decodes the postings lists of its own terms.
+
+'''
+
+import array
+import json
+import mmap
+import os
+import sys
+from collections.abc import Mapping
+
+FORMAT_VERSION = 1
+TERMS_EXTENSION = '.terms'
+POSTINGS_EXTENSION = '.postings'
+
+# Typecode of a 4 byte unsigned integer array
+UINT32 = 'I' if array.array('I').itemsize == 4 else 'L'
+
+
+def get_postings_path(terms_path):
+    '''
+    Return the path of the postings file that belongs to a term dictionary.
+    '''
+    return os.path.splitext(terms_path)[0] + POSTINGS_EXTENSION
+
+def _to_bytes(values):
+    '''
+    Encode a uint32 array as little endian bytes.
+    '''
+    if sys.byteorder != 'little':
+        values = array.array(UINT32, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_bytes(data):
+    '''
+    Decode little endian bytes into a uint32 array.
+    '''
+    values = array.array(UINT32)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+def write_binary_index(index, output_path):
+    '''
+    Writes an index (term: [DF, [[tf, docID], ...]], '_M_': document count)
+    to a term dictionary at output_path and a postings file next to it.
+    '''
+    write_binary_items(index.items(), output_path, index['_D_'] if '_D_' in index else [])
+
+def write_binary_items(items, output_path, documents):
+    '''
+    Writes the (key, value) items of an index, which can be generated one at a time,
+    with the document table of the index (the '_D_' item is ignored).
+    '''
+    metadata = {}
+    terms = {}
+    documents = list(documents)     # document number -> docID
+    document_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(documents)}
+    offset = 0
+
+    with open(get_postings_path(output_path), 'wb') as postings_file:
+        for term, value in items:
+            # The document table is stored on its own
+            if term == '_D_':
+                continue
+            # Keys starting with an underscore hold collection statistics, not postings
+            if term.startswith('_'):
+                metadata[term] = value
+                continue
+
+            document_frequency, postings = value
+            doc_block = array.array(UINT32)
+            tf_block = array.array(UINT32)
+            for term_frequency, doc_id in postings:
+                if doc_id not in document_numbers:
+                    document_numbers[doc_id] = len(documents)
+                    documents.append(doc_id)
+                doc_block.append(document_numbers[doc_id])
+                tf_block.append(term_frequency)
+
+            postings_file.write(_to_bytes(doc_block))
+            postings_file.write(_to_bytes(tf_block))
+            terms[term] = [document_frequency, offset]
+            offset += (len(doc_block) + len(tf_block)) * doc_block.itemsize
+
+    header = {
+        "format": FORMAT_VERSION,
+        "metadata": metadata,
+        "documents": documents,
+        "terms": terms
+    }
+    with open(output_path, 'w') as file:
+        json.dump(header, file)
+
+class BinaryIndex(Mapping):
+    '''
+    Read-only view of a binary index which behaves like the dictionary read from a JSON index.
+    index[term] returns [DF, [[tf, docID], ...]], index['_M_'] the document count and index['_D_'] the document table,
+    but postings are only decoded from the memory-mapped file when a term is looked up.
+    '''
+    format_version = FORMAT_VERSION
+    postings_extension = POSTINGS_EXTENSION
+
+    def __init__(self, terms_path):
+        with open(terms_path, 'r') as file:
+            header = json.load(file)
+        if header.get("format") != self.format_version:
+            raise ValueError(f'{terms_path} is not a version {self.format_version} binary index')
+
+        self.metadata = header["metadata"]
+        self.documents = header["documents"]
+        self.terms = header["terms"]
+        self.metadata['_D_'] = self.documents
+
+        self._file = open(os.path.splitext(terms_path)[0] + self.postings_extension, 'rb')
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._postings = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # Empty files cannot be memory-mapped
+            self._postings = b''
+
+    def postings_arrays(self, term):
+        '''
+        Return the document numbers and term frequencies of a term as two parallel uint32 arrays.
+        '''
+        document_frequency, offset = self.terms[term]
+        block_size = document_frequency * array.array(UINT32).itemsize
+        doc_numbers = _from_bytes(self._postings[offset:offset + block_size])
+        term_frequencies = _from_bytes(self._postings[offset + block_size:offset + 2 * block_size])
+        return doc_numbers, term_frequencies
+
+    def __getitem__(self, key):
+        if key in self.metadata:
+            return self.metadata[key]
+        doc_numbers, term_frequencies = self.postings_arrays(key)
+        documents = self.documents
+        postings = [[term_frequency, documents[doc_number]] for doc_number, term_frequency in zip(doc_numbers.tolist(), term_frequencies.tolist())]
+        return [len(postings), postings]
+
+    def __contains__(self, key):
+        return key in self.terms or key in self.metadata
+
+    def __iter__(self):
+        yield from self.terms
+        yield from self.metadata
+
+    def __len__(self):
+        return len(self.terms) + len(self.metadata)
+
+    def close(self):
+        if isinstance(self._postings, mmap.mmap):
+            self._postings.close()
+        self._file.close()
@@ -0,0 +1,234 @@
+'''
+
+Boolean queries of query.py --mode boolean
+
+Query syntax:
+    information AND (retrieval OR search) NOT library
+Operators are written in capitals: AND, OR and NOT, with parentheses to group them. NOT binds
+tighter than AND, which binds tighter than OR, and words next to each other are joined with AND.
+Words are normalized like the documents, a word missing from the vocabulary matches no document.
+
+A query is parsed into a tree of tuples:
+    ("term", term), ("and", (child, ...)), ("or", (child, ...)), ("not", child)
+and evaluated on the sorted document numbers of the postings (see scoring.py). A conjunction does
+not read the postings of all its terms: the child expected to match the fewest documents, e.g. the
+rarest term, gives the candidates, and the other children only look the candidates up, the most
+selective first. A term looks a candidate up in the skip pointers of its postings, every step-th
+document number with a step of about the square root of its DF, then by binary search in the
+block of postings between two pointers. When there are about as many candidates as postings, the
+two lists are merged instead.
+
+The matching documents can then be ranked with a weighting scheme, using the terms that are not
+under a NOT, with the scores of ranked queries.
+
+'''
+
+import re
+
+import numpy as np
+
+import instrumentation
+from preprocessing import normalize
+from preprocessing import tokenize
+
+OPERATORS = ("AND", "OR", "NOT")
+# Parentheses and the words between them
+QUERY_PATTERN = re.compile(r'[()]|[^\s()]+')
+
+
+def parse_query(keyword_query, preprocessing_method):
+    '''
+    Parses a Boolean query into a tree of tuples (see above), or None when it has no words.
+    Raises a ValueError if the query is malformed.
+    '''
+    items = QUERY_PATTERN.findall(keyword_query)
+
+    # Normalize the words of the query together, like the words of a ranked query
+    word_tokens = [tokenize(item) for item in items if item not in OPERATORS and item not in "()"]
+    terms = iter(normalize([token for tokens in word_tokens for token in tokens], preprocessing_method))
+    words = iter([tuple(next(terms) for _ in tokens) for tokens in word_tokens])
+    items = [item if item in OPERATORS or item in "()" else next(words) for item in items]
+
+    position = 0
+
+    def peek():
+        return items[position] if position < len(items) else None
+
+    def parse_or():
+        nonlocal position
+        children = [parse_and()]
+        while peek() == "OR":
+            position += 1
+            children.append(parse_and())
+        return combine("or", children)
+
+    def parse_and():
+        nonlocal position
+        children = [parse_not()]
+        while peek() is not None and peek() not in ("OR", ")"):
+            if peek() == "AND":
+                position += 1
+            children.append(parse_not())
+        return combine("and", children)
+
+    def parse_not():
+        nonlocal position
+        item = peek()
+        if item == "NOT":
+            position += 1
+            child = parse_not()
+            return None if child is None else ("not", child)
+        if item == "(":
+            position += 1
+            child = parse_or()
+            if peek() != ")":
+                raise ValueError("Unbalanced parentheses in the Boolean query")
+            position += 1
+            return child
+        if item is None or item in OPERATORS or item == ")":
+            raise ValueError(f'Expected a word or "(" at {"the end" if item is None else repr(item)} of the Boolean query')
+        position += 1
+        # A word can give several terms, e.g. "data-base" gives "database" but "U.S.A" may not
+        return combine("and", [("term", term) for term in item])
+
+    tree = parse_or()
+    if position < len(items):
+        raise ValueError("Unbalanced parentheses in the Boolean query")
+    return tree
+
+def combine(operator, children):
+    '''
+    Joins the children of an AND or OR node, dropping the words without terms (None).
+    '''
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+    return (operator, tuple(children))
+
+def positive_terms(tree):
+    '''
+    Return the terms of a query that are not under a NOT, in query order, used to rank the matching documents.
+    '''
+    if tree is None:
+        return []
+    operator, value = tree
+    if operator == "term":
+        return [value]
+    if operator == "not":
+        return []
+    return [term for child in value for term in positive_terms(child)]
+
+def skip_lookup(doc_numbers, skips, step, doc_candidates):
+    '''
+    Finds sorted candidate documents in the sorted document numbers of a postings list with its skip pointers.
+    Returns a mask of the candidates that are in it and the number of document numbers compared.
+    '''
+    if len(doc_numbers) == 0 or len(doc_candidates) == 0:
+        return np.zeros(len(doc_candidates), dtype=bool), 0
+
+    rounds = step.bit_length()
+    compared = len(doc_candidates) * (len(skips).bit_length() + rounds)
+    if compared >= len(doc_numbers):
+        # Almost as many candidates as postings: merging the two lists compares fewer document numbers
+        return np.isin(doc_candidates, doc_numbers, assume_unique=True), len(doc_numbers)
+
+    # Block of every candidate: the last skip pointer not after it
+    blocks = np.searchsorted(skips, doc_candidates, side='right') - 1
+    low = np.maximum(blocks, 0) * step
+    high = np.minimum(low + step, len(doc_numbers))
+    # Binary search of all the blocks at once
+    for _ in range(rounds):
+        middle = (low + high) // 2
+        after = (low < high) & (doc_numbers[np.minimum(middle, len(doc_numbers) - 1)] < doc_candidates)
+        high = np.where((low < high) & ~after, middle, high)
+        low = np.where(after, middle + 1, low)
+    found = (blocks >= 0) & (doc_numbers[np.minimum(low, len(doc_numbers) - 1)] == doc_candidates)
+    return found, compared
+
+class BooleanMatcher:
+    '''
+    Evaluates Boolean queries with the postings and skip pointers of a scorer (see scoring.py).
+    Counts the document numbers it reads and compares.
+    '''
+    def __init__(self, scorer):
+        self.scorer = scorer
+        self.document_count = len(scorer.documents)
+        self.postings_read = 0
+
+    def estimate(self, tree):
+        '''
+        Return an upper bound of the number of documents a query matches, without reading postings.
+        '''
+        operator, value = tree
+        if operator == "term":
+            return self.scorer.document_frequency(value)
+        if operator == "not":
+            return self.document_count
+        estimates = [self.estimate(child) for child in value]
+        return min(estimates) if operator == "and" else min(sum(estimates), self.document_count)
+
+    def evaluate(self, tree):
+        '''
+        Return the sorted document numbers of the documents that match a query.
+        '''
+        operator, value = tree
+        if operator == "term":
+            doc_numbers, _ = self.scorer.term_postings(value)
+            self.postings_read += len(doc_numbers)
+            return doc_numbers
+        if operator == "not":
+            return self.filter(tree, np.arange(self.document_count))
+        if operator == "or":
+            doc_numbers = self.evaluate(value[0])
+            for child in value[1:]:
+                doc_numbers = np.union1d(doc_numbers, self.evaluate(child))
+            return doc_numbers
+
+        # The most selective child that is not a NOT gives the candidates, the others filter them
+        children = sorted(value, key=lambda child: self.document_count if child[0] == "not" else self.estimate(child))
+        if children[0][0] == "not":
+            return self.filter(tree, np.arange(self.document_count))
+        return self.filter(("and", tuple(children[1:])), self.evaluate(children[0]))
+
+    def filter(self, tree, doc_candidates):
+        '''
+        Return the candidate documents (sorted document numbers) that match a query.
+        '''
+        operator, value = tree
+        if operator == "term":
+            doc_numbers, _ = self.scorer.term_postings(value)
+            skips, step = self.scorer.term_skips(value)
+            found, compared = skip_lookup(doc_numbers, skips, step, doc_candidates)
+            self.postings_read += compared
+            return doc_candidates[found]
+        if operator == "not":
+            return doc_candidates[~np.isin(doc_candidates, self.filter(value, doc_candidates), assume_unique=True)]
+        if operator == "or":
+            matches = self.filter(value[0], doc_candidates)
+            for child in value[1:]:
+                # Documents already matched need not be looked up again
+                rest = doc_candidates[~np.isin(doc_candidates, matches, assume_unique=True)]
+                matches = np.union1d(matches, self.filter(child, rest))
+            return matches
+
+        # The most selective children first, so the next ones look fewer candidates up
+        for child in sorted(value, key=lambda child: self.document_count if child[0] == "not" else self.estimate(child)):
+            if len(doc_candidates) == 0:
+                break
+            doc_candidates = self.filter(child, doc_candidates)
+        return doc_candidates
+
+    def match(self, tree):
+        '''
+        Return the sorted document numbers of the documents that match a query (none for an empty query).
+        '''
+        if tree is None:
+            return np.zeros(0, dtype=np.int64)
+        before = self.postings_read
+        with instrumentation.stage("boolean_match"):
+            doc_numbers = self.evaluate(tree)
+        instrumentation.count("postings_scanned", self.postings_read - before)
+        instrumentation.count("candidate_documents", len(doc_numbers))
+        return doc_numbers
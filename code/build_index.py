@@ -7,128 +7,299 @@ The program will be run from the root of the repository.
 
 '''
 
+import os
 import sys
+import math
+import resource
+from concurrent.futures import ProcessPoolExecutor
+import preprocessing
 from preprocessing import tokenize
-from preprocessing import normalize
+from preprocessing import normalize_all
+from weighting import compute_document_norms
+from weighting import compute_term_bounds
 import collection_object
+from compact_index import CompactIndex
+import impacts
+import instrumentation
+import lexicon
+import positional_index
+import segments
+import sharding
 
+# Number of shards given to each worker by a parallel build
+SHARDS_PER_WORKER = 4
 
-def read_documents(input_path):
+def iter_documents(input_path):
     '''
-    Reads the documents in the collection (inside the 'collections' folder).
+    Reads the documents in the collection (inside the 'collections' folder) one at a time.
+    Yields (docID, text) in file order.
     '''
-    documents = {}
-
     with open(input_path, 'r') as file:
-        documents = {}
         current_id = None
         capture_text = False
-        text_buffer = ""
+        text_lines = []
 
         for line in file:
             if line.startswith('.I'):
                 # Submit the text for the previous document (if not reading the first document)
                 if current_id:
-                    documents[current_id] = text_buffer.strip()
+                    yield current_id, ''.join(text_lines).strip()
                 # Prepare to encounter the text for the new document
                 current_id = line.split()[1]
                 capture_text = False
-                text_buffer = ""
+                text_lines = []
             elif line.startswith('.W'):
                 # New document's text has been encountered, begin capturing its contents
                 capture_text = True
             elif line.startswith('.X'):
                  capture_text = False
             elif capture_text:
-                # Append the new text line
-                text_buffer += line
-        
+                # Collect the lines and join them once, appending to a string copies it every time
+                text_lines.append(line)
+
         # Submit the last document
         if current_id:
-            documents[current_id] = text_buffer.strip()
+            yield current_id, ''.join(text_lines).strip()
 
-        print(f'{len(documents)} documents read in total')
-        return documents
+def read_documents(input_path):
+    '''
+    Reads the documents in the collection (inside the 'collections' folder) into a dictionary of docID: text.
+    '''
+    with instrumentation.stage("read_documents"):
+        documents = dict(iter_documents(input_path))
 
-def build_index(documents, normalization):
+    print(f'{len(documents)} documents read in total')
+    return documents
+
+def add_document(index, docID, document_tokens):
     '''
-    Builds inverted index.
+    Adds the postings of one normalized document to an inverted index (with DF left at 0).
     '''
+    tfs = {}                        # tf: [term, tf] (for a given docID)
 
-    assert type(documents) == dict
+    # Calculate term frequencies for the document and initialize index
+    for term in document_tokens:
+        # Initialize the term in the inverted index if it hasn't been encountered yet
+        if term not in index:       
+            index[term] = [0, []]   # Term: [DF=0, [postings list]]
+        # Calculate term frequencies for all terms in document
+        
+        if term in tfs:
+            # If term is a duplicate, increment its tf for this document
+            term_frequency = tfs[term]
+            tfs[term] = term_frequency + 1
+        else:
+            # If term is new for this document, initialize the tf
+            tfs[term] = 1
 
-    index = {}
-    normalized = {}
+    # Sort postings by term frequency and insert into index
+    sorted_postings = sorted(tfs.items(), key=lambda x:x[1], reverse=True)
     
-    # Tokenize and normalize all terms inside each document
-    for docID in documents:
-        original_text = documents[docID]
-        normalized[docID] = normalize(tokenize(original_text), normalization)
-
-    for docID in normalized:
-        document_tokens = normalized[docID]
-        tfs = {}                        # tf: [term, tf] (for a given docID)
-
-        # Calculate term frequencies for the document and initialize index
-        for term in document_tokens:
-            # Initialize the term in the inverted index if it hasn't been encountered yet
-            if term not in index:       
-                index[term] = [0, []]   # Term: [DF=0, [postings list]]
-            # Calculate term frequencies for all terms in document
-            
-            if term in tfs:
-                # If term is a duplicate, increment its tf for this document
-                term_frequency = tfs[term]
-                tfs[term] = term_frequency + 1
+    for posting in sorted_postings:
+        term = posting[0]
+        term_frequency = tfs[term]
+        index[term][1].append([term_frequency, docID])   # index[term][DF/postings][tf/docID]
+
+def index_shard(shard, normalizations, compact=True, positions=False):
+    '''
+    Tokenizes a shard of documents, a list of (docID, text), once and normalizes the tokens
+    with every normalization. Returns the inverted index of the shard for each normalization,
+    a CompactIndex (see compact_index.py), which records the positions of the terms with positions,
+    or, without compact, a dictionary of postings lists.
+    '''
+    indexes = {normalization: CompactIndex(positions=positions) if compact else {} for normalization in normalizations}
+
+    for docID, original_text in shard:
+        # Tokenize and normalize all terms inside the document
+        normalized = normalize_all(tokenize(original_text), normalizations)
+        for normalization in normalizations:
+            if compact:
+                indexes[normalization].add_document(docID, normalized[normalization])
             else:
-                # If term is new for this document, initialize the tf
-                tfs[term] = 1
-    
-        # Sort postings by term frequency and insert into index
-        sorted_postings = sorted(tfs.items(), key=lambda x:x[1], reverse=True)
-        
-        for posting in sorted_postings:
-            term = posting[0]
-            term_frequency = tfs[term]
-            index[term][1].append([term_frequency, docID])   # index[term][DF/postings][tf/docID]
+                add_document(indexes[normalization], docID, normalized[normalization])
+
+    # Store the tokens this process normalized for the first time
+    preprocessing.cache.flush()
 
-    # Calculate document frequency and tf for each term
-    for term in index:
-        document_frequency = len(index[term][1])
-        index[term][0] = document_frequency
+    return indexes
+
+def merge_shards(partial_indexes):
+    '''
+    Merges the indexes of consecutive shards in document order,
+    which keeps the term and postings order of a single shard.
+    '''
+    index = partial_indexes[0] if partial_indexes else {}
+    for partial_index in partial_indexes[1:]:
+        if isinstance(index, CompactIndex):
+            index.extend(partial_index)
+            continue
+        for term, value in partial_index.items():
+            if term in index:
+                index[term][1].extend(value[1])
+            else:
+                index[term] = value
+    return index
+
+def finish_index(index, documents):
+    '''
+    Fills in the document frequencies and the collection statistics of an index.
+    '''
+    if isinstance(index, CompactIndex):
+        # The document frequencies of a compact index are counted while its postings are added
+        postings = index.posting_count()
+    else:
+        # Calculate document frequency and tf for each term
+        postings = 0
+        for term in index:
+            document_frequency = len(index[term][1])
+            index[term][0] = document_frequency
+            postings += document_frequency
+    instrumentation.count("postings", postings)
 
     index['_M_'] = len(documents)
+
+    # Document table, the position of a docID is its document number in the binary index and scoring arrays
+    index['_D_'] = list(documents.keys())
+
+    # Store the length of every document vector for cosine normalization
+    with instrumentation.stage("document_norms"):
+        index['_N_'] = compute_document_norms(index)
+
+    # Store the largest weight of every term for pruned top-k retrieval
+    with instrumentation.stage("term_bounds"):
+        index['_U_'] = compute_term_bounds(index, index['_N_'])
     
     return index
 
+def build_indexes(documents, normalizations, workers=1, compact=True, positions=False):
+    '''
+    Builds one inverted index per normalization in a single pass over the documents:
+    each document is tokenized once and its tokens are normalized with every normalization.
+    With more than one worker, contiguous shards of the documents are indexed by a pool of
+    processes and merged into the same indexes a single process would build.
+    The indexes are CompactIndex objects, or dictionaries of postings lists without compact.
+    With positions, compact indexes also record the positions of their terms (see positional_index.py).
+    Returns a dictionary of normalization: index
+    '''
+
+    assert type(documents) == dict
+
+    items = list(documents.items())
+    with instrumentation.stage("index_documents"):
+        if workers > 1 and len(items) > 1:
+            # Several shards per worker balance the load when some documents are slower to normalize
+            shard_count = min(len(items), workers * SHARDS_PER_WORKER)
+            shard_size = math.ceil(len(items) / shard_count)
+            shards = [items[start:start + shard_size] for start in range(0, len(items), shard_size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                shard_indexes = list(executor.map(index_shard, shards, [normalizations] * len(shards), [compact] * len(shards), [positions] * len(shards)))
+        else:
+            shard_indexes = [index_shard(items, normalizations, compact, positions)]
+
+    indexes = {}
+    for normalization in normalizations:
+        with instrumentation.stage("merge_shards"):
+            index = merge_shards([shard_index[normalization] for shard_index in shard_indexes])
+        indexes[normalization] = finish_index(index, documents)
+
+    return indexes
+
+def build_index(documents, normalization, workers=1):
+    '''
+    Builds inverted index.
+    '''
+    return build_indexes(documents, [normalization], workers)[normalization]
+
 if __name__ == "__main__":
     '''
     main() function
     '''
     # Validate inputs and initialize paths
     collection = collection_object.Collection()
-    collection_name = collection.parse_read_inputs().collection
+    args = collection.parse_read_inputs()
+    collection_name = args.collection
     input_path = collection.get_input_path(collection_name,
                                             file_type='corpus')
-    output_path_lemmas = collection.get_output_path(collection_name,
-                                            file_type='corpus_lemmas',
-                                            # Set this to True if you want to throw an error when the output proccessed index file already exists
-                                            throw_file_exists_error=False)
-    output_path_stems = collection.get_output_path(collection_name,
-                                            file_type='corpus_stems',
+    output_paths = {normalization: collection.get_output_path(collection_name,
+                                            file_type=file_type,
                                             # Set this to True if you want to throw an error when the output proccessed index file already exists
-                                            throw_file_exists_error=False)
+                                            throw_file_exists_error=False,
+                                            index_format=args.format)
+                    for normalization, file_type in collection.index_file_types.items()}
     
-    # Read the corpus data into a dictionary
-    data = read_documents(input_path)
+    preprocessing.configure_cache(args.cache_size, args.cache_path)
+    if args.trace is not None:
+        instrumentation.configure(args.trace)
+
+    # Fail fast, without touching the network, when the NLTK data is missing
+    try:
+        preprocessing.check_resources(list(output_paths.keys()))
+    except LookupError as error:
+        print(error, file=sys.stderr)
+        exit(1)
+
+    if args.shards is not None and args.memory_limit is not None:
+        print('--shards splits the index in memory, it cannot be combined with --memory-limit', file=sys.stderr)
+        exit(1)
+    if args.positions and args.memory_limit is not None:
+        print('--positions records the positions in memory, it cannot be combined with --memory-limit', file=sys.stderr)
+        exit(1)
+    if args.lexicon and args.memory_limit is not None:
+        print('--lexicon sorts the vocabulary of the index in memory, it cannot be combined with --memory-limit', file=sys.stderr)
+        exit(1)
+
+    if args.memory_limit is None:
+        # Read the corpus data into a dictionary
+        data = read_documents(input_path)
+
+        # Create the index of every normalization, tokenizing each document once
+        indexes = build_indexes(data, list(output_paths.keys()), args.workers, positions=args.positions)
+
+        # Write data to output files
+        for normalization, index in indexes.items():
+            with instrumentation.stage("write_index"):
+                collection.write_data(index, output_paths[normalization])
+            if args.impacts is not None:
+                with instrumentation.stage("write_impacts"):
+                    impacts.write_impacts(index, output_paths[normalization], args.impacts)
+            if args.positions:
+                with instrumentation.stage("write_positions"):
+                    positional_index.write_positions(index, output_paths[normalization])
+            if args.lexicon:
+                with instrumentation.stage("write_lexicon"):
+                    lexicon.write_lexicon(index, output_paths[normalization])
+            if args.shards is not None:
+                with instrumentation.stage("write_shards"):
+                    sharding.write_shards(collection, index, output_paths[normalization], args.shards, args.format)
+    else:
+        from streaming_index import write_indexes_streaming
+
+        # Stream the corpus and write every index while its spilled postings are merged
+        spill_directory = args.spill_directory or os.path.dirname(next(iter(output_paths.values())))
+        document_count, runs = write_indexes_streaming(collection, iter_documents(input_path), output_paths,
+                                                       args.memory_limit * 1024 * 1024, args.workers, spill_directory, args.impacts)
+        print(f'{document_count} documents read in total, {max(runs.values())} runs spilled to disk')
+
+    # Updates made since the last build are either in the corpus file now or lost with it
+    for output_path in output_paths.values():
+        segments.remove_segments(output_path)
+        # Impacts of a previous build would not match the new index
+        if args.impacts is None:
+            impacts.remove_impacts(output_path)
+        if args.shards is None:
+            sharding.remove_shards(collection, output_path)
+        if not args.positions:
+            positional_index.remove_positions(output_path)
+        if not args.lexicon:
+            lexicon.remove_lexicon(output_path)
 
-    # Create index output files
-    lemmatized_index = build_index(data, 'lemmatization')
-    stemmed_index = build_index(data, 'stemming')
+    if args.workers == 1:
+        statistics = preprocessing.cache.statistics()
+        print(f'Normalization cache: {statistics["hit_rate"]:.1%} hit rate ({statistics["hits"]} hits, {statistics["disk_hits"]} disk hits, {statistics["misses"]} misses)')
 
-    # Write data to output file
-    collection.write_data(lemmatized_index, output_path_lemmas)
-    collection.write_data(stemmed_index, output_path_stems)
+    # ru_maxrss is in kilobytes on Linux
+    print(f'Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB')
+    instrumentation.write_summary()
 
     print("SUCCESS")
 
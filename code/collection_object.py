@@ -9,6 +9,11 @@ import sys
 import os
 import argparse
 import json
+import binary_index
+import compact_index
+import compressed_index
+import normalization_cache
+import result_cache
 
 class Collection:
     def __init__(self):
@@ -23,6 +28,16 @@ class Collection:
             "corpus_stems": "corpus_stems",
             "queries": ".QRY"
         }
+        # Index file written by build_index.py for each normalization method
+        self.index_file_types = {
+            "lemmatization": "corpus_lemmas",
+            "stemming": "corpus_stems"
+        }
+        self.index_formats = {
+            "json": ".json",
+            "binary": binary_index.TERMS_EXTENSION,
+            "compressed": compressed_index.TERMS_EXTENSION
+        }
 
     # ----------------------------------------------------------------------------------------------------
     # Data types used to validate inputs
@@ -62,6 +77,16 @@ class Collection:
         
         return valid_types[string]
     
+    @staticmethod
+    def query_mode(string):
+        '''Custom type used to validate if an input is a query mode of query.py'''
+        valid_types = ["ranked", "phrase", "boolean"]
+
+        if string not in valid_types:
+            raise argparse.ArgumentTypeError("Query mode invalid, must be 'ranked', 'phrase' or 'boolean'")
+
+        return string
+
     @staticmethod
     def positive_int(value):
         '''Custom type used to validate if an input is a positive integer'''
@@ -94,12 +119,134 @@ class Collection:
         parser.add_argument("collection",
                                 type=str,
                                 help="Name of the collection to process")
+        parser.add_argument("--format",
+                                choices=self.index_formats.keys(),
+                                default="json",
+                                help="On-disk format of the index files")
+        parser.add_argument("--workers",
+                                type=Collection.positive_int,
+                                default=1,
+                                help="Number of processes that normalize and index documents in parallel")
+        parser.add_argument("--memory-limit",
+                                type=Collection.positive_int,
+                                default=None,
+                                help="Stream the corpus and spill postings to disk to keep them under this many MB")
+        parser.add_argument("--spill-directory",
+                                type=str,
+                                default=None,
+                                help="Folder of the postings spilled to disk (default: the processed folder)")
+        parser.add_argument("--impacts",
+                                choices=["float", "quantized"],
+                                default=None,
+                                help="Also store the weight of every posting for each weighting scheme, so queries do not compute them")
+        parser.add_argument("--shards",
+                                type=Collection.positive_int,
+                                default=None,
+                                help="Also split every index into this many shards of consecutive documents, queried by query.py --sharded")
+        parser.add_argument("--positions",
+                                action="store_true",
+                                help="Also store the positions of the terms in every document, used by query.py --mode phrase")
+        parser.add_argument("--lexicon",
+                                action="store_true",
+                                help="Also store the sorted vocabulary and its character n-gram index, used by query.py --expand")
+        self.add_cache_arguments(parser)
+        self.add_trace_arguments(parser)
+        args = parser.parse_args()
+        return args
+
+    def parse_update_inputs(self):
+        ''' Grab input terminal parameters, used for update_index.py '''
+        parser = argparse.ArgumentParser()
+        parser.add_argument("collection",
+                                type=str,
+                                help="Name of the collection whose indexes are updated")
+        parser.add_argument("--format",
+                                choices=self.index_formats.keys(),
+                                default="json",
+                                help="On-disk format of the index files")
+        parser.add_argument("--workers",
+                                type=Collection.positive_int,
+                                default=1,
+                                help="Number of processes that normalize and index documents in parallel")
+        parser.add_argument("--merge-threshold",
+                                type=int,
+                                default=8,
+                                help="Merge the segments into the index in the background once there are this many (0 never merges)")
+        self.add_cache_arguments(parser)
+        updates = parser.add_subparsers(dest="update", required=True)
+        parser_add = updates.add_parser("add", help="Add the documents of a file in the .ALL format, replacing documents with the same .I id")
+        parser_add.add_argument("path",
+                                type=str,
+                                help="File holding the new or changed documents")
+        parser_delete = updates.add_parser("delete", help="Delete documents by .I id")
+        parser_delete.add_argument("doc_ids",
+                                type=str,
+                                nargs="+",
+                                help="IDs of the documents to delete")
+        updates.add_parser("merge", help="Merge the segments into the index")
+        args = parser.parse_args()
+        return args
+
+    def parse_convert_inputs(self):
+        ''' Grab input terminal parameters, used for convert_index.py '''
+        parser = argparse.ArgumentParser()
+        parser.add_argument("collection",
+                                type=str,
+                                help="Name of the collection whose indexes are converted")
+        parser.add_argument("--source",
+                                choices=self.index_formats.keys(),
+                                default="json",
+                                help="Format of the existing index files")
+        parser.add_argument("--target",
+                                choices=self.index_formats.keys(),
+                                default="binary",
+                                help="Format to convert the index files to")
         args = parser.parse_args()
         return args
     
-    def parse_query_inputs(self):
-        ''' Grab input terminal parameters, used for query.py '''
+    def parse_synthetic_inputs(self):
+        ''' Grab input terminal parameters, used for synthetic_collection.py '''
         parser = argparse.ArgumentParser()
+        parser.add_argument("collection",
+                                type=str,
+                                help="Name of the collection to generate")
+        parser.add_argument("--documents",
+                                type=Collection.positive_int,
+                                default=10000,
+                                help="Number of documents")
+        parser.add_argument("--vocabulary",
+                                type=Collection.positive_int,
+                                default=50000,
+                                help="Number of distinct words")
+        parser.add_argument("--length",
+                                type=Collection.positive_int,
+                                default=100,
+                                help="Average number of words per document")
+        parser.add_argument("--zipf",
+                                type=float,
+                                default=1.1,
+                                help="Exponent of the Zipfian word frequencies")
+        parser.add_argument("--queries",
+                                type=Collection.positive_int,
+                                default=100,
+                                help="Number of queries")
+        parser.add_argument("--query-length",
+                                type=Collection.positive_int,
+                                default=5,
+                                help="Number of words per query")
+        parser.add_argument("--relevant",
+                                type=Collection.positive_int,
+                                default=20,
+                                help="Number of relevant documents per query")
+        parser.add_argument("--seed",
+                                type=int,
+                                default=361,
+                                help="Seed of the random collection")
+        args = parser.parse_args()
+        return args
+
+    def add_query_arguments(self, parser):
+        ''' Add the arguments that describe a single query to a parser '''
         parser.add_argument("collection",
                             type=str,
                             help="Name of the collection to process")
@@ -114,6 +261,124 @@ class Collection:
         parser.add_argument("query",
                             type=str,
                             help="The query to run")
+        parser.add_argument("--mode",
+                            type=Collection.query_mode,
+                            default="ranked",
+                            help="'ranked' scores every document with a query word, 'phrase' only the ones that match its quoted phrases and NEAR/k clauses, "
+                                 "'boolean' only the ones that match its AND, OR and NOT operators")
+        parser.add_argument("--expand",
+                            action="store_true",
+                            help="Expand wildcard patterns (retriev*), fuzzy words (retreival~) and words missing from the vocabulary into the terms of the index")
+
+    def add_cache_arguments(self, parser):
+        ''' Add the arguments that configure the normalization cache to a parser '''
+        parser.add_argument("--cache-path",
+                            type=str,
+                            default=None,
+                            help="sqlite file that stores normalized tokens across runs")
+        parser.add_argument("--cache-size",
+                            type=int,
+                            default=normalization_cache.DEFAULT_SIZE,
+                            help="Number of normalized tokens kept in memory (0 disables the cache)")
+
+    def add_trace_arguments(self, parser):
+        ''' Add the argument that enables the instrumentation to a parser '''
+        parser.add_argument("--trace",
+                            type=str,
+                            default=None,
+                            help="Time every stage and write the traces to this file as JSON lines, with histograms in FILE.summary.json (see instrumentation.py)")
+
+    def parse_query_inputs(self):
+        ''' Grab input terminal parameters, used for query.py '''
+        parser = argparse.ArgumentParser()
+        self.add_query_arguments(parser)
+        self.add_cache_arguments(parser)
+        parser.add_argument("--format",
+                            choices=self.index_formats.keys(),
+                            default="json",
+                            help="On-disk format of the index to query")
+        parser.add_argument("--pruning",
+                            action="store_true",
+                            help="Skip the postings that cannot reach the top k (same answers, faster on long queries)")
+        parser.add_argument("--unranked",
+                            action="store_true",
+                            help="With --mode boolean, return the first k matching documents in collection order without scoring them")
+        parser.add_argument("--sharded",
+                            action="store_true",
+                            help="Answer from the shards written by build_index.py --shards, one worker process per shard")
+        parser.add_argument("--shard-urls",
+                            type=str,
+                            nargs="+",
+                            default=None,
+                            help="With --sharded, query the shard servers at these URLs (in shard order) instead of worker processes")
+        self.add_trace_arguments(parser)
+        args = parser.parse_args()
+        return args
+
+    def parse_shard_server_inputs(self):
+        ''' Grab input terminal parameters, used for sharding.py '''
+        parser = argparse.ArgumentParser()
+        parser.add_argument("collection",
+                            type=str,
+                            help="Name of the collection whose shard is served")
+        parser.add_argument("tokenization",
+                            type=Collection.tokenization)
+        parser.add_argument("shard",
+                            type=int,
+                            help="Number of the shard to serve, from 0")
+        parser.add_argument("--format",
+                            choices=self.index_formats.keys(),
+                            default="json",
+                            help="On-disk format of the shard")
+        parser.add_argument("--host",
+                            type=str,
+                            default="127.0.0.1",
+                            help="Address to listen on")
+        parser.add_argument("--port",
+                            type=Collection.positive_int,
+                            default=8400,
+                            help="Port to listen on")
+        args = parser.parse_args()
+        return args
+
+    def parse_server_inputs(self):
+        ''' Grab input terminal parameters, used for query_server.py '''
+        parser = argparse.ArgumentParser()
+        parser.add_argument("collections",
+                            type=str,
+                            nargs="+",
+                            help="Names of the collections to serve")
+        parser.add_argument("--host",
+                            type=str,
+                            default="127.0.0.1",
+                            help="Address to listen on")
+        parser.add_argument("--port",
+                            type=Collection.positive_int,
+                            default=8361,
+                            help="Port to listen on")
+        parser.add_argument("--format",
+                            choices=self.index_formats.keys(),
+                            default="json",
+                            help="On-disk format of the indexes to serve")
+        parser.add_argument("--result-cache-size",
+                            type=int,
+                            default=result_cache.DEFAULT_SIZE,
+                            help="Number of answers cached per index (0 disables the cache)")
+        args = parser.parse_args()
+        return args
+
+    def parse_client_inputs(self):
+        ''' Grab input terminal parameters, used for query_client.py '''
+        parser = argparse.ArgumentParser()
+        self.add_query_arguments(parser)
+        parser.add_argument("--host",
+                            type=str,
+                            default="127.0.0.1",
+                            help="Address of the query server")
+        parser.add_argument("--port",
+                            type=Collection.positive_int,
+                            default=8361,
+                            help="Port of the query server")
         args = parser.parse_args()
         return args
     
@@ -159,7 +424,7 @@ class Collection:
             raise FileNotFoundError(f'There is no valid collection "{name}" at {collection_path}')
         return collection_path
 
-    def get_output_path(self, name, file_type, throw_file_exists_error=True):
+    def get_output_path(self, name, file_type, throw_file_exists_error=True, index_format="json"):
         '''
         Return output path if it exists.
         '''
@@ -167,20 +432,88 @@ class Collection:
         if not file_type in self.output_extensions.keys():
             raise ValueError(f'Valid file types are: ["answers", "corpus", "queries"]')
         extension = self.output_extensions[file_type]
+        if not index_format in self.index_formats.keys():
+            raise ValueError(f'Valid index formats are: {list(self.index_formats.keys())}')
 
         # Construct and validate path
-        output_path = f'./processed/{name}_{extension}.json'
+        output_path = f'./processed/{name}_{extension}{self.index_formats[index_format]}'
         if (throw_file_exists_error == True):
             if os.path.exists(output_path):
                 raise FileExistsError(f'The output collection at {output_path} already exists')
         return output_path
     
-    def write_data(self, data, output_path):
-        '''Writes the input dictionary to the specified JSON file location'''
+    def get_index_format(self, output_path):
+        '''Return the index format of a file, based on its extension'''
+        for index_format in ["binary", "compressed"]:
+            if output_path.endswith(self.index_formats[index_format]):
+                return index_format
+        return "json"
+
+    def get_index_files(self, output_path, index_format=None):
+        '''Return every file written for an index, the postings file of the binary formats first'''
+        if index_format is None:
+            index_format = self.get_index_format(output_path)
+
+        if index_format == "binary":
+            return [binary_index.get_postings_path(output_path), output_path]
+        if index_format == "compressed":
+            return [compressed_index.get_postings_path(output_path), output_path]
+        return [output_path]
+
+    def write_data(self, data, output_path, index_format=None):
+        '''Writes the input dictionary to the specified file location, as JSON unless a binary index format is used'''
+        if index_format is None:
+            index_format = self.get_index_format(output_path)
+
+        if index_format == "binary":
+            binary_index.write_binary_index(data, output_path)
+        elif index_format == "compressed":
+            compressed_index.write_compressed_index(data, output_path)
+        elif isinstance(data, dict):
+            with open(output_path, 'w') as file:
+                json.dump(data, file, indent=4)
+        else:
+            # Compact indexes give the file of their dictionary
+            self.write_index_items(data.items(), [], output_path, index_format)
+
+    def write_index_items(self, items, documents, output_path, index_format=None):
+        '''
+        Writes an index given as (key, value) items, which can be generated one at a time, and its document table.
+        Gives the same file as write_data with the dictionary of the items.
+        '''
+        if index_format is None:
+            index_format = self.get_index_format(output_path)
+
+        if index_format == "binary":
+            binary_index.write_binary_items(items, output_path, documents)
+            return
+        if index_format == "compressed":
+            compressed_index.write_compressed_items(items, output_path, documents)
+            return
+
         with open(output_path, 'w') as file:
-            json.dump(data, file, indent=4)
+            separator = '{\n'
+            for key, value in items:
+                # Strip the braces of a one item object, its indentation is the one of the full object
+                item = json.dumps({key: value}, indent=4)[2:-2]
+                file.write(separator + item)
+                separator = ',\n'
+            file.write('{}' if separator == '{\n' else '\n}')
+
+    def read_data(self, output_path, index_format=None, compact=False):
+        '''
+        Reads a file written by write_data. Binary and compressed indexes are memory-mapped instead of loaded,
+        JSON indexes are converted to a CompactIndex (see compact_index.py) with compact.
+        '''
+        if index_format is None:
+            index_format = self.get_index_format(output_path)
 
-    def read_data(self, output_path):
+        if index_format == "binary":
+            return binary_index.BinaryIndex(output_path)
+        if index_format == "compressed":
+            return compressed_index.CompressedIndex(output_path)
+        if compact:
+            return compact_index.read_json_index(output_path)
         with open(output_path, 'r') as file:
             content = json.load(file)
         return content
@@ -0,0 +1,234 @@
+'''
+
+Compact in-memory representation of an inverted index, used by build_index.py and query.py
+
+The index read from a JSON file is a dictionary of term: [DF, [[tf, docID], ...]], where every posting
+costs a list, an int and a reference to a docID string (about 100 bytes). CompactIndex keeps each term
+in a TermEntry with __slots__: its DF and two parallel uint32 arrays of document numbers and term
+frequencies, 8 bytes per posting. Every docID is stored once in the document table of the index
+(the '_D_' item), and postings refer to it by its position, as in the binary index format.
+
+CompactIndex behaves like the dictionary it replaces: index[term] still returns [DF, [[tf, docID], ...]],
+built on demand, and metadata ('_M_', '_D_', '_N_', ...) is stored as is. Code that reads many postings
+goes through the accessors instead, which do not build Python lists:
+    postings_arrays(term)       document numbers and term frequencies (see scoring.py)
+    document_frequency(index, term)
+    postings(index, term)       (tf, docID) pairs of any index
+
+'''
+
+import array
+import json
+import re
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from binary_index import UINT32
+
+# Whitespace between the items of a JSON object
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class TermEntry:
+    '''
+    DF and postings of one term: parallel arrays of document numbers and term frequencies, in document order.
+    When positions are recorded, position_gaps holds the positions of the term in each document in turn,
+    as gaps (the first one as is).
+    '''
+    __slots__ = ("document_frequency", "doc_numbers", "term_frequencies", "position_gaps")
+
+    def __init__(self, document_frequency=0, doc_numbers=None, term_frequencies=None, position_gaps=None):
+        self.document_frequency = document_frequency
+        self.doc_numbers = array.array(UINT32) if doc_numbers is None else doc_numbers
+        self.term_frequencies = array.array(UINT32) if term_frequencies is None else term_frequencies
+        self.position_gaps = position_gaps
+
+class CompactIndex(MutableMapping):
+    '''
+    Inverted index of TermEntry objects with a document table, which behaves like the dictionary of a JSON index.
+    Terms keep their order of first appearance and are iterated before the metadata, like in the files.
+    With positions, the documents added also record the positions of their terms (see positional_index.py).
+    '''
+    def __init__(self, documents=(), positions=False):
+        self.entries = {}               # term -> TermEntry
+        self.documents = []             # document number -> docID
+        self.document_numbers = {}      # docID -> document number
+        self.metadata = {}              # '_M_', '_D_', '_N_', ... in insertion order
+        self.positions = positions
+        for doc_id in documents:
+            self.document_number(doc_id)
+
+    def document_number(self, doc_id):
+        '''
+        Return the number of a docID, adding it to the end of the document table the first time it is seen.
+        '''
+        doc_number = self.document_numbers.get(doc_id)
+        if doc_number is None:
+            doc_number = len(self.documents)
+            self.document_numbers[doc_id] = doc_number
+            self.documents.append(doc_id)
+        return doc_number
+
+    def add_document(self, doc_id, document_tokens):
+        '''
+        Adds the postings of one normalized document, the DF of its terms is kept up to date.
+        The document takes the next number of the document table, even when it has no tokens.
+        '''
+        doc_number = self.document_number(doc_id)
+        tfs = {}
+        for term in document_tokens:
+            tfs[term] = tfs.get(term, 0) + 1
+
+        entries = self.entries
+        for term, term_frequency in tfs.items():
+            entry = entries.get(term)
+            if entry is None:
+                entry = entries[term] = TermEntry()
+            entry.document_frequency += 1
+            entry.doc_numbers.append(doc_number)
+            entry.term_frequencies.append(term_frequency)
+
+        if self.positions:
+            previous = {}
+            for position, term in enumerate(document_tokens):
+                entry = entries[term]
+                if entry.position_gaps is None:
+                    entry.position_gaps = array.array(UINT32)
+                entry.position_gaps.append(position - previous.get(term, 0))
+                previous[term] = position
+
+    def extend(self, other):
+        '''
+        Appends the postings of a compact index of later documents, e.g. the next shard of a parallel build.
+        '''
+        # Document numbers of the other index in this one
+        renumbering = np.fromiter((self.document_number(doc_id) for doc_id in other.documents), dtype=np.uint32, count=len(other.documents))
+        for term, other_entry in other.entries.items():
+            doc_numbers = renumbering[np.frombuffer(other_entry.doc_numbers, dtype=np.uint32)]
+            entry = self.entries.get(term)
+            if entry is None:
+                self.entries[term] = TermEntry(other_entry.document_frequency, array.array(UINT32, doc_numbers.tobytes()),
+                                               other_entry.term_frequencies, other_entry.position_gaps)
+                continue
+            entry.document_frequency += other_entry.document_frequency
+            entry.doc_numbers.frombytes(doc_numbers.tobytes())
+            entry.term_frequencies.extend(other_entry.term_frequencies)
+            if entry.position_gaps is not None:
+                entry.position_gaps.extend(other_entry.position_gaps)
+
+    def set_documents(self, documents):
+        '''
+        Replaces the document table, renumbering the postings when the order of the documents changes.
+        '''
+        documents = list(documents)
+        if documents != self.documents:
+            previous = self.documents
+            self.documents = []
+            self.document_numbers = {}
+            for doc_id in documents + previous:
+                self.document_number(doc_id)
+            renumbering = np.fromiter((self.document_numbers[doc_id] for doc_id in previous), dtype=np.uint32, count=len(previous))
+            for entry in self.entries.values():
+                entry.doc_numbers = array.array(UINT32, renumbering[np.frombuffer(entry.doc_numbers, dtype=np.uint32)].tobytes())
+        self.metadata['_D_'] = self.documents
+
+    def postings_arrays(self, term):
+        '''
+        Return the document numbers and term frequencies of a term as two parallel uint32 arrays.
+        '''
+        entry = self.entries[term]
+        return entry.doc_numbers, entry.term_frequencies
+
+    def posting_count(self):
+        '''
+        Return the number of postings of the index.
+        '''
+        return sum(entry.document_frequency for entry in self.entries.values())
+
+    def __getstate__(self):
+        # The scorer, positions and lexicon of a loaded index (see scoring.index_state) stay in its process
+        state = dict(self.__dict__)
+        state.pop('_loaded', None)
+        return state
+
+    def __getitem__(self, key):
+        if key in self.metadata:
+            return self.metadata[key]
+        entry = self.entries[key]
+        documents = self.documents
+        postings = [[term_frequency, documents[doc_number]] for doc_number, term_frequency in zip(entry.doc_numbers, entry.term_frequencies)]
+        return [entry.document_frequency, postings]
+
+    def __setitem__(self, key, value):
+        if key == '_D_':
+            self.set_documents(value)
+        elif key.startswith('_'):
+            # Keys starting with an underscore hold collection statistics, not postings
+            self.metadata[key] = value
+        else:
+            document_frequency, postings = value
+            doc_numbers = [self.document_number(doc_id) for _, doc_id in postings]
+            term_frequencies = [term_frequency for term_frequency, _ in postings]
+            self.entries[key] = TermEntry(document_frequency, array.array(UINT32, doc_numbers), array.array(UINT32, term_frequencies))
+
+    def __delitem__(self, key):
+        if key in self.metadata:
+            del self.metadata[key]
+        else:
+            del self.entries[key]
+
+    def __contains__(self, key):
+        return key in self.entries or key in self.metadata
+
+    def __iter__(self):
+        yield from self.entries
+        yield from self.metadata
+
+    def __len__(self):
+        return len(self.entries) + len(self.metadata)
+
+def read_json_index(path):
+    '''
+    Reads a JSON index (see collection_object.write_data) into a CompactIndex one item at a time,
+    so the postings lists of the whole index never exist as Python lists at once.
+    '''
+    with open(path, 'r') as file:
+        text = file.read()
+    decoder = json.JSONDecoder()
+    index = CompactIndex()
+
+    position = WHITESPACE.match(text, 0).end()
+    if text[position] != '{':
+        raise ValueError(f'{path} is not a JSON index')
+    position = WHITESPACE.match(text, position + 1).end()
+    while text[position] != '}':
+        key, position = decoder.raw_decode(text, position)
+        position = WHITESPACE.match(text, position).end()
+        if text[position] != ':':
+            raise ValueError(f'{path} is not a JSON index')
+        position = WHITESPACE.match(text, position + 1).end()
+        value, position = decoder.raw_decode(text, position)
+        index[key] = value
+        position = WHITESPACE.match(text, position).end()
+        if text[position] == ',':
+            position = WHITESPACE.match(text, position + 1).end()
+    return index
+
+def document_frequency(index, term):
+    '''
+    Return the DF of a term of any index, without building its postings list when the index can avoid it.
+    '''
+    if isinstance(index, CompactIndex):
+        return index.entries[term].document_frequency
+    return index[term][0]
+
+def postings(index, term):
+    '''
+    Return the postings of a term of any index as (tf, docID) pairs, in document order.
+    '''
+    if isinstance(index, CompactIndex):
+        doc_numbers, term_frequencies = index.postings_arrays(term)
+        documents = index.documents
+        return [(term_frequency, documents[doc_number]) for doc_number, term_frequency in zip(doc_numbers, term_frequencies)]
+    return index[term][1]
@@ -0,0 +1,185 @@
+'''
+
+Compressed on-disk format for the inverted index, used by collection_object.py
+
+Like the binary format (see binary_index.py), an index is stored in two files:
+    <name>.vterms       JSON term dictionary: term -> [DF, byte offset, byte size], the document table (_D_) and metadata (_M_, ...)
+    <name>.vpostings    postings of every term, stored back to back. Each postings list is the DF gaps between
+                        consecutive document numbers followed by the DF term frequencies, all variable-byte encoded
+
+Variable-byte encoding stores an integer 7 bits per byte, least significant bits first, with the high bit
+set on every byte but the last. Gaps and term frequencies are small, so most postings take two bytes
+instead of the eight of the binary format. Postings are decoded with NumPy straight into the arrays
+that scoring.py accumulates, without going through Python lists.
+
+'''
+
+import json
+import os
+
+import numpy as np
+
+from binary_index import BinaryIndex
+
+FORMAT_VERSION = 2
+TERMS_EXTENSION = '.vterms'
+POSTINGS_EXTENSION = '.vpostings'
+
+# Largest number of bytes of a variable-byte encoded 64 bit integer
+MAX_VARINT_BYTES = 10
+# Blocks shorter than this are decoded by a Python loop instead of NumPy
+SMALL_BLOCK_BYTES = 128
+
+
+def get_postings_path(terms_path):
+    '''
+    Return the path of the postings file that belongs to a term dictionary.
+    '''
+    return os.path.splitext(terms_path)[0] + POSTINGS_EXTENSION
+
+def encode_varints(values):
+    '''
+    Encode an array of non-negative integers with variable-byte encoding.
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for byte_count in range(1, MAX_VARINT_BYTES):
+        lengths += values >= np.uint64(1 << (7 * byte_count))
+    starts = np.cumsum(lengths) - lengths
+
+    encoded = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for position in range(int(lengths.max()) if len(values) else 0):
+        # Byte number position of every value that is long enough
+        mask = lengths > position
+        low_bits = (values[mask] >> np.uint64(7 * position)) & np.uint64(0x7f)
+        continues = (lengths[mask] > position + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[mask] + position] = low_bits | continues
+    return encoded.tobytes()
+
+def decode_small_varints(data):
+    '''
+    Decode a few variable-byte encoded integers (bytes) one byte at a time into an int64 array.
+    '''
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            values.append(value)
+            value = 0
+            shift = 0
+        else:
+            shift += 7
+    return np.array(values, dtype=np.int64)
+
+def decode_varints(data):
+    '''
+    Decode variable-byte encoded integers (bytes or a uint8 array) into an int64 array.
+    '''
+    if len(data) < SMALL_BLOCK_BYTES:
+        # The dozen NumPy calls below cost more than a loop over a short block
+        return decode_small_varints(bytes(data))
+
+    data = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    last_bytes = data < 0x80
+    if last_bytes.all():
+        # Every value fits in one byte
+        return data.astype(np.int64)
+
+    ends = np.flatnonzero(last_bytes)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # Shift of every byte: 7 bits times its position inside its value
+    first_byte = np.repeat(starts, ends - starts + 1)
+    shifts = (np.arange(len(data), dtype=np.int64) - first_byte) * 7
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+def write_compressed_index(index, output_path):
+    '''
+    Writes an index (term: [DF, [[tf, docID], ...]], '_M_': document count)
+    to a term dictionary at output_path and a compressed postings file next to it.
+    '''
+    write_compressed_items(index.items(), output_path, index['_D_'] if '_D_' in index else [])
+
+def write_compressed_items(items, output_path, documents):
+    '''
+    Writes the (key, value) items of an index, which can be generated one at a time,
+    with the document table of the index (the '_D_' item is ignored).
+    '''
+    metadata = {}
+    terms = {}
+    documents = list(documents)     # document number -> docID
+    document_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(documents)}
+    offset = 0
+
+    with open(get_postings_path(output_path), 'wb') as postings_file:
+        for term, value in items:
+            # The document table is stored on its own
+            if term == '_D_':
+                continue
+            # Keys starting with an underscore hold collection statistics, not postings
+            if term.startswith('_'):
+                metadata[term] = value
+                continue
+
+            document_frequency, postings = value
+            for _, doc_id in postings:
+                if doc_id not in document_numbers:
+                    document_numbers[doc_id] = len(documents)
+                    documents.append(doc_id)
+            doc_numbers = np.fromiter((document_numbers[doc_id] for _, doc_id in postings), dtype=np.int64, count=len(postings))
+            term_frequencies = np.fromiter((term_frequency for term_frequency, _ in postings), dtype=np.int64, count=len(postings))
+
+            # Gaps need increasing document numbers, postings are in document order unless the index was edited
+            if np.any(doc_numbers[1:] < doc_numbers[:-1]):
+                order = np.argsort(doc_numbers, kind='stable')
+                doc_numbers = doc_numbers[order]
+                term_frequencies = term_frequencies[order]
+
+            block = encode_varints(np.concatenate((np.diff(doc_numbers, prepend=0), term_frequencies)))
+            postings_file.write(block)
+            terms[term] = [document_frequency, offset, len(block)]
+            offset += len(block)
+
+    header = {
+        "format": FORMAT_VERSION,
+        "metadata": metadata,
+        "documents": documents,
+        "terms": terms
+    }
+    with open(output_path, 'w') as file:
+        json.dump(header, file)
+
+class CompressedIndex(BinaryIndex):
+    '''
+    Read-only view of a compressed index which behaves like the dictionary read from a JSON index,
+    postings are only decoded from the memory-mapped file when a term is looked up.
+    '''
+    format_version = FORMAT_VERSION
+    postings_extension = POSTINGS_EXTENSION
+
+    def __init__(self, terms_path):
+        super().__init__(terms_path)
+        # One view of the whole file, slicing it is cheaper than a new buffer per term
+        self._bytes = np.frombuffer(self._postings, dtype=np.uint8)
+
+    def postings_arrays(self, term):
+        '''
+        Return the document numbers and term frequencies of a term as two parallel int64 arrays.
+        '''
+        document_frequency, offset, size = self.terms[term]
+        block = self._bytes[offset:offset + size]
+        if size == 2 * document_frequency:
+            # Every gap and term frequency fits in one byte, which is true of most terms
+            values = block.astype(np.int64)
+        else:
+            # Gaps and term frequencies are decoded in one pass
+            values = decode_varints(block)
+        return np.cumsum(values[:document_frequency]), values[document_frequency:]
+
+    def close(self):
+        # The memory map cannot be closed while the view exists
+        self._bytes = None
+        super().close()
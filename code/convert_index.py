@@ -0,0 +1,63 @@
+'''
+
+Converts the indexes of a collection in the processed folder from one on-disk format to another
+(by default from the JSON files written by build_index.py to the binary index format,
+the compressed format is chosen with --target compressed).
+
+The program will be run from the root of the repository.
+
+'''
+
+import shutil
+import collection_object
+import impacts
+import lexicon
+import positional_index
+from weighting import compute_document_norms
+from weighting import compute_term_bounds
+
+
+if __name__ == "__main__":
+    '''
+    main() function
+    '''
+    # Validate inputs
+    collection = collection_object.Collection()
+    args = collection.parse_convert_inputs()
+
+    for file_type in collection.index_file_types.values():
+        input_path = collection.get_output_path(args.collection, file_type,
+                                            throw_file_exists_error=False,
+                                            index_format=args.source)
+        output_path = collection.get_output_path(args.collection, file_type,
+                                            throw_file_exists_error=False,
+                                            index_format=args.target)
+
+        index = dict(collection.read_data(input_path, args.source).items())
+        # Indexes written before document norms were stored
+        if '_N_' not in index:
+            index['_N_'] = compute_document_norms(index)
+        # Indexes written before term bounds were stored
+        if '_U_' not in index:
+            index['_U_'] = compute_term_bounds(index, index['_N_'])
+        collection.write_data(index, output_path, args.target)
+        # Impacts are stored next to the index file, the converted index gets its own
+        stored_impacts = impacts.open_impacts(input_path, index)
+        if stored_impacts is not None and output_path != input_path:
+            impacts.write_impacts(index, output_path, stored_impacts.quantization)
+        # Positions follow the document table, which every format keeps, so they are copied as they are
+        stored_positions = positional_index.open_positions(input_path, index)
+        if stored_positions is not None:
+            stored_positions.close()
+            if output_path != input_path:
+                for source, target in zip(positional_index.get_position_paths(input_path), positional_index.get_position_paths(output_path)):
+                    shutil.copyfile(source, target)
+        # So does the lexicon, which only holds the vocabulary
+        if lexicon.open_lexicon(input_path, index) is not None and output_path != input_path:
+            for source, target in zip(lexicon.get_lexicon_paths(input_path), lexicon.get_lexicon_paths(output_path)):
+                shutil.copyfile(source, target)
+        print(f'{input_path} -> {output_path}')
+
+    print("SUCCESS")
+
+    exit(0)
@@ -0,0 +1,133 @@
+'''
+
+Retrieval quality metrics and significance tests, used by test_scheme.py and test_all_schemes.py
+
+A run is the ranked docIDs retrieved for each query: a dictionary of query ID: [docID, ...]
+or a list of (query ID, [docID, ...]). The relevance judgements (qrels, read by utils.read_answers)
+are turned into one set of relevant docIDs per query once, and a run into a boolean matrix
+of queries x ranks that tells whether each retrieved document is relevant. Every metric of
+every query and cutoff is then computed from that matrix at once with NumPy:
+    map         average precision: sum of the precision at each relevant document / number of relevant documents
+    mrr         reciprocal rank of the first relevant document
+    P@k         precision of the first k documents
+    recall@k    share of the relevant documents in the first k documents
+    ndcg@k      normalized discounted cumulative gain of the first k documents, with binary gains
+
+Metrics are returned per query, so two schemes can be compared on the same queries with the paired
+randomization and bootstrap tests below, which test thousands of schemes against a baseline at once.
+
+'''
+
+import numpy as np
+
+# Cutoffs of P@k, recall@k and ndcg@k
+DEFAULT_CUTOFFS = (5, 10, 20, 100)
+# Number of random samples of the significance tests
+DEFAULT_SAMPLES = 10000
+
+
+class Qrels:
+    '''
+    Relevance judgements indexed for lookups: the set of relevant docIDs and their number for each query.
+    '''
+    def __init__(self, answers):
+        self.relevant = {query_id: set(doc_ids) for query_id, doc_ids in answers.items()}
+
+    def relevant_count(self, query_id):
+        return len(self.relevant.get(query_id, ()))
+
+def run_items(run):
+    '''
+    Return the (query ID, ranked docIDs) of a run given as a dictionary or a list of pairs.
+    '''
+    return list(run.items()) if isinstance(run, dict) else list(run)
+
+def relevance_matrix(run, qrels, depth):
+    '''
+    Return a boolean matrix of queries x ranks (up to depth) of the retrieved documents that are relevant.
+    Rankings shorter than depth are padded with non-relevant ranks.
+    '''
+    items = run_items(run)
+    relevant = np.zeros((len(items), depth), dtype=bool)
+    for row, (query_id, ranking) in enumerate(items):
+        relevant_docs = qrels.relevant.get(query_id, ())
+        hits = [rank for rank, doc_id in enumerate(ranking[:depth]) if doc_id in relevant_docs]
+        relevant[row, hits] = True
+    return relevant
+
+def evaluate(run, qrels, cutoffs=DEFAULT_CUTOFFS):
+    '''
+    Computes every metric of every query of a run. qrels is a Qrels or the dictionary of utils.read_answers.
+    Returns a dictionary of metric name: array of the scores of the queries in run order.
+    Queries without relevance judgements score 0.
+    '''
+    if not isinstance(qrels, Qrels):
+        qrels = Qrels(qrels)
+    items = run_items(run)
+    depth = max([len(ranking) for _, ranking in items] + list(cutoffs) + [1])
+
+    relevant = relevance_matrix(items, qrels, depth)
+    relevant_counts = np.array([qrels.relevant_count(query_id) for query_id, _ in items], dtype=np.float64)
+    hits = np.cumsum(relevant, axis=1)
+    ranks = np.arange(1, depth + 1)
+    # Prevent division by zero, queries without relevant documents score 0
+    judged = relevant_counts > 0
+    denominators = np.where(judged, relevant_counts, 1)
+
+    metrics = {}
+    metrics["map"] = np.where(judged, (relevant * (hits / ranks)).sum(axis=1) / denominators, 0.0)
+    first_hits = relevant.argmax(axis=1)
+    metrics["mrr"] = np.where(relevant.any(axis=1), 1 / (first_hits + 1), 0.0)
+
+    discounts = 1 / np.log2(ranks + 1)
+    # Ideal DCG of every number of relevant documents up to depth
+    ideal = np.concatenate(([0.0], np.cumsum(discounts)))
+    gains = np.cumsum(relevant * discounts, axis=1)
+    for cutoff in cutoffs:
+        metrics[f"P@{cutoff}"] = hits[:, cutoff - 1] / cutoff
+        metrics[f"recall@{cutoff}"] = np.where(judged, hits[:, cutoff - 1] / denominators, 0.0)
+        ideal_gains = ideal[np.minimum(relevant_counts, cutoff).astype(np.int64)]
+        metrics[f"ndcg@{cutoff}"] = np.where(ideal_gains > 0, gains[:, cutoff - 1] / np.where(ideal_gains > 0, ideal_gains, 1), 0.0)
+    return metrics
+
+def summarize(metrics):
+    '''
+    Return the mean of every metric over the queries (0 for an empty run).
+    '''
+    return {name: float(scores.mean()) if len(scores) else 0.0 for name, scores in metrics.items()}
+
+def randomization_test(scores_a, scores_b, samples=DEFAULT_SAMPLES, seed=0):
+    '''
+    Paired randomization test of the mean difference between the per-query scores of scheme a
+    and of one or more schemes b (an array of queries, or of schemes x queries).
+    Every sample swaps the scores of a random half of the queries, which flips the sign of their difference.
+    Returns the two-sided p-value of every scheme b.
+    '''
+    differences = np.atleast_2d(np.asarray(scores_b, dtype=np.float64) - np.asarray(scores_a, dtype=np.float64))
+    query_count = differences.shape[1]
+    observed = np.abs(differences.mean(axis=1))
+
+    signs = np.random.default_rng(seed).choice(np.array([-1.0, 1.0]), size=(query_count, samples))
+    # Mean difference of every scheme under every sample with one matrix product
+    sampled = np.abs(differences @ signs / query_count)
+    p_values = ((sampled >= observed[:, None] - 1e-12).sum(axis=1) + 1) / (samples + 1)
+    return p_values if np.ndim(scores_b) > 1 else float(p_values[0])
+
+def bootstrap_test(scores_a, scores_b, samples=DEFAULT_SAMPLES, seed=0):
+    '''
+    Paired bootstrap test of the mean difference between the per-query scores of scheme a
+    and of one or more schemes b (an array of queries, or of schemes x queries).
+    Every sample draws the queries with replacement, the mean differences are centered on the observed one.
+    Returns the two-sided p-value of every scheme b.
+    '''
+    differences = np.atleast_2d(np.asarray(scores_b, dtype=np.float64) - np.asarray(scores_a, dtype=np.float64))
+    query_count = differences.shape[1]
+    observed = differences.mean(axis=1)
+
+    # Number of times every query is drawn in every sample
+    draws = np.random.default_rng(seed).integers(0, query_count, size=(samples, query_count))
+    draws += np.arange(samples)[:, None] * query_count
+    counts = np.bincount(draws.ravel(), minlength=samples * query_count).reshape(samples, query_count).astype(np.float64)
+    sampled = differences @ counts.T / query_count
+    p_values = ((np.abs(sampled - observed[:, None]) >= np.abs(observed)[:, None] - 1e-12).sum(axis=1) + 1) / (samples + 1)
+    return p_values if np.ndim(scores_b) > 1 else float(p_values[0])
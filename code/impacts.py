@@ -0,0 +1,202 @@
+'''
+
+Precomputed impact weights of an index, written by build_index.py --impacts and used by scoring.py
+
+The weight of a term in a document (tf weight * df weight, before cosine normalization) only depends
+on the index, so it can be computed once at build time for every document scheme (nn, nt, ln, lt)
+instead of with log10 for every posting of every query. The weights of an index file are stored
+next to it in two files:
+    <index file>.impacts    JSON header: the quantization, the document count, and for every term the
+                            offset of its weights (and their scales when quantized)
+    <index file>.weights    weights of every term, stored back to back: the DF weights of each scheme in
+                            turn, in increasing document number (the order of the scoring arrays)
+
+'float' stores float64 weights, which give exactly the scores computed at query time.
+'quantized' stores each weight in one byte, as a multiple of 1/255 of the largest weight of the term
+for the scheme, which makes the file 8 times smaller but the scores approximate.
+
+'''
+
+import json
+import mmap
+import os
+
+import numpy as np
+
+from weighting import DOCUMENT_SCHEMES
+from weighting import df_weight
+
+FORMAT_VERSION = 1
+HEADER_EXTENSION = '.impacts'
+WEIGHTS_EXTENSION = '.weights'
+
+QUANTIZATIONS = {
+    "float": np.float64,
+    "quantized": np.uint8
+}
+# Largest quantized weight
+QUANTIZED_LEVELS = 255
+
+
+def get_impact_paths(index_path):
+    '''
+    Return the paths of the header and the weights file of the impacts of an index file.
+    '''
+    return index_path + HEADER_EXTENSION, index_path + WEIGHTS_EXTENSION
+
+def remove_impacts(index_path):
+    '''
+    Removes the impacts of an index file, which are wrong once the index is rebuilt or merged without them.
+    '''
+    for path in get_impact_paths(index_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+def posting_impacts(term_frequencies, doc_count, document_frequency, scheme):
+    '''
+    Return the weights of an array of term frequencies for a document scheme, computed like scoring.py does.
+    '''
+    if scheme[0] == "l":
+        weights = np.log10(term_frequencies) + 1
+    else:
+        weights = term_frequencies
+    return weights * df_weight(doc_count, document_frequency, scheme[1])
+
+class ImpactWriter:
+    '''
+    Writes the impacts of an index one term at a time, so they can be written while the index is streamed.
+    '''
+    def __init__(self, index_path, documents, quantization):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f'Valid quantizations are: {list(QUANTIZATIONS.keys())}')
+        self.header_path, weights_path = get_impact_paths(index_path)
+        self.quantization = quantization
+        self.dtype = np.dtype(QUANTIZATIONS[quantization]).newbyteorder('<')
+        self.documents = list(documents)
+        self.document_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(self.documents)}
+        self.terms = {}         # term -> offset of its weights, in number of weights
+        self.scales = {}        # term -> weight of a quantization step for each scheme
+        self.offset = 0
+        self.file = open(weights_path, 'wb')
+
+    def add(self, term, postings):
+        '''
+        Writes the weights of the postings ([[tf, docID], ...]) of the next term.
+        '''
+        doc_numbers = np.fromiter((self.document_numbers[doc_id] for _, doc_id in postings), dtype=np.int64, count=len(postings))
+        term_frequencies = np.fromiter((term_frequency for term_frequency, _ in postings), dtype=np.float64, count=len(postings))
+        # Postings are in document order unless the index was edited
+        if np.any(doc_numbers[1:] < doc_numbers[:-1]):
+            term_frequencies = term_frequencies[np.argsort(doc_numbers, kind='stable')]
+
+        scales = []
+        for scheme in DOCUMENT_SCHEMES:
+            weights = posting_impacts(term_frequencies, len(self.documents), len(postings), scheme)
+            if self.quantization == "quantized":
+                largest = float(weights.max()) if len(weights) else 0.0
+                scale = largest / QUANTIZED_LEVELS if largest > 0 else 0.0
+                weights = np.rint(weights / scale) if scale > 0 else np.zeros_like(weights)
+                scales.append(scale)
+            self.file.write(np.asarray(weights, dtype=self.dtype).tobytes())
+
+        self.terms[term] = self.offset
+        if scales:
+            self.scales[term] = scales
+        self.offset += len(postings) * len(DOCUMENT_SCHEMES)
+
+    def close(self):
+        '''
+        Writes the header once the weights of every term are written.
+        '''
+        self.file.close()
+        header = {
+            "format": FORMAT_VERSION,
+            "quantization": self.quantization,
+            "doc_count": len(self.documents),
+            "schemes": DOCUMENT_SCHEMES,
+            "terms": self.terms,
+            "scales": self.scales
+        }
+        with open(self.header_path, 'w') as file:
+            json.dump(header, file)
+
+def write_impacts(index, index_path, quantization):
+    '''
+    Writes the impacts of an index (term: [DF, [[tf, docID], ...]], '_D_': document table) next to its index file.
+    '''
+    writer = ImpactWriter(index_path, index['_D_'], quantization)
+    for term, value in index.items():
+        # Skip collection statistics such as '_M_'
+        if term.startswith('_'):
+            continue
+        writer.add(term, value[1])
+    writer.close()
+
+def impact_items(items, writer):
+    '''
+    Yields the (key, value) items of an index, generated one at a time, and writes the impacts of its terms on the way.
+    '''
+    for term, value in items:
+        if not term.startswith('_'):
+            writer.add(term, value[1])
+        yield term, value
+    writer.close()
+
+def open_impacts(index_path, index):
+    '''
+    Return the impacts of an index file, or None if it has none or they were written for another version of it.
+    '''
+    header_path, _ = get_impact_paths(index_path)
+    if not os.path.exists(header_path):
+        return None
+    impacts = ImpactIndex(index_path)
+    if '_D_' not in index or impacts.doc_count != len(index['_D_']) or impacts.doc_count != index['_M_']:
+        return None
+    return impacts
+
+class ImpactIndex:
+    '''
+    Read-only view of the impacts of an index, the weights file is memory-mapped.
+    '''
+    def __init__(self, index_path):
+        header_path, weights_path = get_impact_paths(index_path)
+        with open(header_path, 'r') as file:
+            header = json.load(file)
+        if header.get("format") != FORMAT_VERSION:
+            raise ValueError(f'{header_path} is not a version {FORMAT_VERSION} impacts file')
+
+        self.quantization = header["quantization"]
+        self.doc_count = header["doc_count"]
+        self.schemes = {scheme: position for position, scheme in enumerate(header["schemes"])}
+        self.terms = header["terms"]
+        self.scales = header["scales"]
+        dtype = np.dtype(QUANTIZATIONS[self.quantization]).newbyteorder('<')
+        self._file = open(weights_path, 'rb')
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._weights = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # Empty files cannot be memory-mapped
+            self._weights = b''
+        # A plain array over the memory map, slicing it is cheaper than slicing a numpy.memmap
+        self.weights = np.frombuffer(self._weights, dtype=dtype)
+
+    def __contains__(self, term):
+        return term in self.terms
+
+    def term_impacts(self, term, document_frequency, scheme):
+        '''
+        Return the weights of a term for a document scheme (e.g. 'lt') in increasing document number, as float64.
+        '''
+        position = self.schemes[scheme]
+        start = self.terms[term] + position * document_frequency
+        weights = self.weights[start:start + document_frequency]
+        if self.quantization == "quantized":
+            return weights * self.scales[term][position]
+        return np.asarray(weights, dtype=np.float64)
+
+    def close(self):
+        # The memory map cannot be closed while the array exists
+        self.weights = None
+        if isinstance(self._weights, mmap.mmap):
+            self._weights.close()
+        self._file.close()
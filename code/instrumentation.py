@@ -0,0 +1,241 @@
+'''
+
+Timing and counters of the stages of indexing and querying, off by default
+
+Enable it with the environment variable IR_TRACE (1, or the path of a trace file) or with the --trace
+option of query.py, build_index.py and test_scheme.py. The code marks its stages with
+    with instrumentation.stage("tokenize"):
+and counts work with instrumentation.count("postings_scanned", n). When it is disabled, stage() returns
+a shared context manager that does nothing and count() returns at once, so the hooks cost next to nothing.
+
+While a trace is open (query.tokenize_and_answer opens one per query), the time of every stage and
+every counter are added up in it. Stages nest, e.g. "query_vector" includes "tokenize". A finished
+trace is written to the trace file as one line of JSON:
+    {"labels": {"query": ..., "scheme": ..., "k": ...}, "seconds": total, "stages": {...}, "counters": {...}}
+Every trace, and every stage timed outside of a trace (e.g. each document of a build), is also added to
+histograms with power of two buckets: stage times in microseconds, counters in units. summary() returns
+them with their count, total and approximate percentiles, and write_summary() writes them next to the trace file.
+
+Stages that run in worker processes (build_index.py --workers) are not recorded.
+
+'''
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextlib import nullcontext
+
+ENVIRONMENT_VARIABLE = "IR_TRACE"
+SUMMARY_EXTENSION = ".summary.json"
+
+# Set by configure(), or by IR_TRACE when the module is imported
+enabled = False
+trace_path = None
+
+# Open trace of each thread, the query server answers queries in parallel threads
+_local = threading.local()
+_lock = threading.Lock()
+_trace_file = None
+_null_stage = nullcontext()
+
+
+class Histogram:
+    '''
+    Counts values in power of two buckets: bucket b holds the values in [2^(b-1), 2^b), bucket 0 the values under 1.
+    Keeps the exact count, total, minimum and maximum.
+    '''
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        bucket = int(value).bit_length() if value >= 1 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def percentile(self, fraction):
+        '''
+        Return the upper bound of the bucket of the value at a fraction of the sorted values, capped by the maximum.
+        '''
+        target = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return min(float(2 ** bucket), self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0,
+            "min": self.minimum,
+            "max": self.maximum,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            # Upper bound of each bucket: number of values
+            "buckets": {str(2 ** bucket if bucket else 1): count for bucket, count in sorted(self.buckets.items())}
+        }
+
+# Histograms of the process: stage name -> Histogram of microseconds, counter name -> Histogram of counts
+stage_histograms = {}
+counter_histograms = {}
+
+class Trace:
+    '''
+    Time of every stage and value of every counter during one query (or any other unit of work).
+    '''
+    def __init__(self, labels):
+        self.labels = labels
+        self.stages = {}
+        self.counters = {}
+        self.start_time = time.perf_counter()
+        self.seconds = None
+
+    def to_dict(self):
+        return {"labels": self.labels, "seconds": self.seconds, "stages": self.stages, "counters": self.counters}
+
+class Stage:
+    '''
+    Context manager that adds the time spent in it to the open trace, or to the histograms without one.
+    '''
+    __slots__ = ("name", "start_time")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        seconds = time.perf_counter() - self.start_time
+        trace = getattr(_local, "trace", None)
+        if trace is not None:
+            trace.stages[self.name] = trace.stages.get(self.name, 0.0) + seconds
+        else:
+            record(stage_histograms, self.name, seconds * 1e6)
+        return False
+
+def record(histograms, name, value):
+    '''
+    Adds a value to the histogram of a name.
+    '''
+    with _lock:
+        if name not in histograms:
+            histograms[name] = Histogram()
+        histograms[name].add(value)
+
+def configure(path=None):
+    '''
+    Enables the instrumentation. Finished traces are appended to the file at path, if one is given.
+    '''
+    global enabled, trace_path, _trace_file
+    enabled = True
+    if path != trace_path and _trace_file is not None:
+        _trace_file.close()
+        _trace_file = None
+    trace_path = path
+
+def disable():
+    '''
+    Disables the instrumentation and closes the trace file, the histograms are kept.
+    '''
+    global enabled, _trace_file
+    enabled = False
+    if _trace_file is not None:
+        _trace_file.close()
+        _trace_file = None
+
+def stage(name):
+    '''
+    Return a context manager that times a stage, it does nothing when the instrumentation is disabled.
+    '''
+    if not enabled:
+        return _null_stage
+    return Stage(name)
+
+def count(name, value=1):
+    '''
+    Adds value to a counter of the open trace, or to the histogram of the counter without one.
+    '''
+    if not enabled:
+        return
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + value
+    else:
+        record(counter_histograms, name, value)
+
+@contextmanager
+def trace(**labels):
+    '''
+    Opens a trace for the stages and counters of the code run inside it, yields it (None when disabled).
+    Once finished, the trace is added to the histograms and written to the trace file.
+    '''
+    if not enabled:
+        yield None
+        return
+
+    global _trace_file
+    previous = getattr(_local, "trace", None)
+    current = Trace(labels)
+    _local.trace = current
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - current.start_time
+        _local.trace = previous
+        record(stage_histograms, "total", current.seconds * 1e6)
+        for name, seconds in current.stages.items():
+            record(stage_histograms, name, seconds * 1e6)
+        for name, value in current.counters.items():
+            record(counter_histograms, name, value)
+        if trace_path is not None:
+            line = json.dumps(current.to_dict())
+            with _lock:
+                if _trace_file is None:
+                    _trace_file = open(trace_path, 'a')
+                _trace_file.write(line + '\n')
+                _trace_file.flush()
+
+def summary():
+    '''
+    Return the histograms of every stage (in microseconds) and counter.
+    '''
+    with _lock:
+        return {
+            "stages_us": {name: histogram.summary() for name, histogram in stage_histograms.items()},
+            "counters": {name: histogram.summary() for name, histogram in counter_histograms.items()}
+        }
+
+def write_summary(extra=None):
+    '''
+    Writes the histograms, with extra results such as MAP and MRR, to <trace file>.summary.json
+    or to stderr without a trace file. Does nothing when the instrumentation is disabled.
+    '''
+    if not enabled:
+        return
+    content = dict(extra or {})
+    content.update(summary())
+    if trace_path is None:
+        import sys
+        print(json.dumps(content, indent=2), file=sys.stderr)
+    else:
+        with open(trace_path + SUMMARY_EXTENSION, 'w') as file:
+            json.dump(content, file, indent=2)
+
+# IR_TRACE=1 enables the instrumentation, any other value is the path of the trace file
+_environment = os.environ.get(ENVIRONMENT_VARIABLE, "")
+if _environment not in ("", "0"):
+    configure(None if _environment == "1" else _environment)
@@ -0,0 +1,364 @@
+'''
+
+Lexicon of the vocabulary of an index, used by query.py --expand to expand wildcard patterns and
+misspelled words into the terms of the index
+
+The lexicon holds the terms in sorted order and a character n-gram index: for every gram of
+GRAM_LENGTH characters, the sorted numbers of the terms that contain it. Terms are padded with
+BOUNDARY, so "$re" is only in the terms that start with "re". The lexicon of an index file can be
+written next to it by build_index.py --lexicon, in two files:
+    <index file>.lexicon    JSON header: the document count, the sorted terms, and for every gram the offset
+                            and count of its term numbers
+    <index file>.grams      term numbers of every gram, stored back to back as uint32
+Without them, or for an index with segments, the lexicon is built from the vocabulary the first time
+a query is expanded.
+
+Query syntax (with --expand):
+    retriev*        every term starting with "retriev", found by binary search in the sorted terms
+    c?mput*r        * stands for any characters and ? for one, the terms are found through the grams of the pattern
+    retreival~      the terms at most 1 or 2 edits (Levenshtein distance) away, depending on the length of the word
+    retreival~1     the terms at most 1 edit away
+Patterns are matched against the terms as they are in the index (stems with stemming), fuzzy words
+are normalized first. A word that is not in the vocabulary is replaced by its closest terms, and
+dropped if there are none. The terms of an expansion, at most MAX_EXPANSIONS of them, the most
+frequent or the closest first, share the weight of the word in the query vector.
+
+No lookup scans the vocabulary: a pattern only reads the terms of its prefix or of its rarest gram,
+and a fuzzy word the terms that share enough grams with it, since an edit changes at most
+GRAM_LENGTH grams. Words with too few grams for that bound (up to 3 characters for 1 edit, 6 for 2)
+are compared with every term of about their length instead, found through the terms sorted by length.
+
+'''
+
+import array
+import bisect
+import json
+import os
+import re
+import string
+
+import numpy as np
+
+import instrumentation
+from binary_index import UINT32
+from compact_index import CompactIndex
+from compact_index import document_frequency
+from preprocessing import normalize
+from preprocessing import tokenize
+from scoring import index_state
+
+FORMAT_VERSION = 1
+HEADER_EXTENSION = '.lexicon'
+GRAMS_EXTENSION = '.grams'
+
+GRAM_LENGTH = 3
+BOUNDARY = '$'
+WILDCARDS = '*?'
+# Largest number of terms a pattern or a misspelled word is expanded into
+MAX_EXPANSIONS = 50
+# Word~ and word~2: fuzzy words with an optional number of edits
+FUZZY_PATTERN = re.compile(r'(.+)~(\d*)')
+# Punctuation removed from patterns, like the tokenizer removes it from the documents
+PATTERN_PUNCTUATION = str.maketrans('', '', ''.join(character for character in string.punctuation if character not in WILDCARDS))
+
+
+def get_lexicon_paths(index_path):
+    '''
+    Return the paths of the header and the grams file of the lexicon of an index file.
+    '''
+    return index_path + HEADER_EXTENSION, index_path + GRAMS_EXTENSION
+
+def remove_lexicon(index_path):
+    '''
+    Removes the lexicon of an index file, which is wrong once the index is rebuilt without it.
+    '''
+    for path in get_lexicon_paths(index_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+def vocabulary(inverted_index):
+    '''
+    Return the terms of any index.
+    '''
+    if isinstance(inverted_index, CompactIndex):
+        return list(inverted_index.entries)
+    return [term for term in inverted_index if not term.startswith('_')]
+
+def term_grams(term):
+    '''
+    Return the distinct grams of a term padded with BOUNDARY, in order of first appearance.
+    '''
+    padded = BOUNDARY + term + BOUNDARY
+    return list(dict.fromkeys(padded[start:start + GRAM_LENGTH] for start in range(max(1, len(padded) - GRAM_LENGTH + 1))))
+
+def edit_distances(word, terms, max_distance):
+    '''
+    Return the Levenshtein distances of a word to a list of terms, those larger than max_distance as max_distance + 1.
+    The rows of the dynamic program are computed for all the terms at once, one character of the word at a time.
+    '''
+    if not terms:
+        return np.zeros(0, dtype=np.int64)
+    width = max(map(len, terms))
+    # Code points of the terms, padded with zeros, which never match a character of the word
+    characters = np.frombuffer(''.join(term.ljust(width, '\0') for term in terms).encode('utf-32-le'), dtype=np.uint32).reshape(len(terms), width)
+    columns = np.arange(width + 1)
+    previous = np.tile(columns, (len(terms), 1))
+    for row, character in enumerate(word, 1):
+        # Deletion or substitution, then insertions as a running minimum along the row
+        current = np.empty_like(previous)
+        current[:, 0] = row
+        current[:, 1:] = np.minimum(previous[:, 1:] + 1, previous[:, :-1] + (characters != ord(character)))
+        previous = np.minimum.accumulate(current - columns, axis=1) + columns
+    distances = previous[np.arange(len(terms)), np.fromiter(map(len, terms), dtype=np.int64, count=len(terms))]
+    return np.minimum(distances, max_distance + 1)
+
+def automatic_distance(word):
+    '''
+    Return the number of edits allowed for a word: none up to 2 characters, 1 up to 5, then 2.
+    '''
+    if len(word) <= 2:
+        return 0
+    return 1 if len(word) <= 5 else 2
+
+class Lexicon:
+    '''
+    Sorted terms of an index with their n-gram index. Counts the term numbers it reads from the
+    n-gram index and the terms it compares with a pattern or a word.
+    '''
+    def __init__(self, terms, grams, term_numbers):
+        self.terms = terms                  # sorted
+        self.grams = grams                  # gram -> (offset, count) of its term numbers
+        self.term_numbers = term_numbers    # uint32 term numbers of every gram, back to back
+        self.lengths = np.fromiter(map(len, terms), dtype=np.int64, count=len(terms))
+        self.by_length = np.argsort(self.lengths, kind='stable')   # term numbers sorted by length
+        self.grams_read = 0
+        self.terms_compared = 0
+
+    def __contains__(self, term):
+        position = bisect.bisect_left(self.terms, term)
+        return position < len(self.terms) and self.terms[position] == term
+
+    def __len__(self):
+        return len(self.terms)
+
+    def prefix_range(self, prefix):
+        '''
+        Return the range [start, end) of the numbers of the terms that start with a prefix.
+        '''
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + chr(0x10FFFF), start)
+        return start, end
+
+    def gram_terms(self, gram):
+        '''
+        Return the sorted numbers of the terms that contain a gram.
+        '''
+        offset, count = self.grams.get(gram, (0, 0))
+        self.grams_read += count
+        return self.term_numbers[offset:offset + count]
+
+    def expand_pattern(self, pattern):
+        '''
+        Return the terms that match a pattern, where * stands for any characters and ? for exactly one, in sorted order.
+        The candidates are the terms of its prefix or of its rarest gram, whichever has fewer.
+        '''
+        prefix = re.split(r'[*?]', pattern, maxsplit=1)[0]
+        start, end = self.prefix_range(prefix)
+        if '?' not in pattern and pattern.index('*') == len(pattern) - 1:
+            # A prefix needs no other check
+            return self.terms[start:end]
+
+        # Characters between the wildcards, padded like the terms, are in the terms that match
+        pieces = [piece for piece in re.split(r'[*?]+', BOUNDARY + pattern + BOUNDARY) if piece != BOUNDARY]
+        grams = [piece[offset:offset + GRAM_LENGTH] for piece in pieces for offset in range(len(piece) - GRAM_LENGTH + 1)]
+        rarest = min(grams, key=lambda gram: self.grams.get(gram, (0, 0))[1], default=None)
+        if rarest is not None and (not prefix or self.grams.get(rarest, (0, 0))[1] < end - start):
+            candidates = self.gram_terms(rarest).tolist()
+        elif prefix or not pieces:
+            candidates = range(start, end)
+        else:
+            # Pieces shorter than a gram: the terms of every gram that contains the longest one
+            piece = max(pieces, key=len)
+            gram_lists = [self.gram_terms(gram) for gram in self.grams if piece in gram]
+            candidates = np.unique(np.concatenate(gram_lists)).tolist() if gram_lists else []
+
+        expression = re.compile(''.join('.*' if character == '*' else '.' if character == '?' else re.escape(character) for character in pattern))
+        self.terms_compared += len(candidates)
+        return [self.terms[number] for number in candidates if expression.fullmatch(self.terms[number])]
+
+    def length_range(self, low, high):
+        '''
+        Return the sorted numbers of the terms of low to high characters.
+        '''
+        lengths = self.lengths[self.by_length]
+        start, end = np.searchsorted(lengths, [low, high + 1])
+        return np.sort(self.by_length[start:end])
+
+    def expand_fuzzy(self, word, max_distance):
+        '''
+        Return the terms at most max_distance edits away from a word as (term, distance) pairs, in sorted order.
+        The candidates are the terms of about the same length that share enough grams with it,
+        or all of them for a word too short to share any gram with some of the terms within reach.
+        '''
+        if max_distance == 0:
+            return [(word, 0)] if word in self else []
+        grams = term_grams(word)
+        # Every edit removes at most GRAM_LENGTH grams of the word
+        shared = len(grams) - GRAM_LENGTH * max_distance
+        if shared > 0:
+            candidates, counts = np.unique(np.concatenate([self.gram_terms(gram) for gram in grams]), return_counts=True)
+            candidates = candidates[counts >= shared]
+            candidates = candidates[np.abs(self.lengths[candidates] - len(word)) <= max_distance]
+        else:
+            candidates = self.length_range(len(word) - max_distance, len(word) + max_distance)
+
+        self.terms_compared += len(candidates)
+        terms = [self.terms[number] for number in candidates.tolist()]
+        distances = edit_distances(word, terms, max_distance)
+        return [(term, distance) for term, distance in zip(terms, distances.tolist()) if distance <= max_distance]
+
+def build_lexicon(terms):
+    '''
+    Return the lexicon of a vocabulary.
+    '''
+    terms = sorted(terms)
+    gram_lists = {}
+    for number, term in enumerate(terms):
+        for gram in term_grams(term):
+            gram_lists.setdefault(gram, []).append(number)
+
+    grams = {}
+    term_numbers = array.array(UINT32)
+    for gram in sorted(gram_lists):
+        grams[gram] = (len(term_numbers), len(gram_lists[gram]))
+        term_numbers.extend(gram_lists[gram])
+    return Lexicon(terms, grams, np.frombuffer(term_numbers, dtype=np.uint32))
+
+def write_lexicon(index, index_path):
+    '''
+    Writes the lexicon of an index next to its index file.
+    '''
+    header_path, grams_path = get_lexicon_paths(index_path)
+    lexicon = build_lexicon(vocabulary(index))
+    with open(grams_path, 'wb') as file:
+        file.write(lexicon.term_numbers.tobytes())
+
+    header = {
+        "format": FORMAT_VERSION,
+        "doc_count": index['_M_'],
+        "gram_length": GRAM_LENGTH,
+        "terms": lexicon.terms,
+        "grams": {gram: list(location) for gram, location in lexicon.grams.items()}
+    }
+    with open(header_path, 'w') as file:
+        json.dump(header, file)
+
+def open_lexicon(index_path, index):
+    '''
+    Return the lexicon of an index file, or None if it has none or it was written for another version of it.
+    '''
+    header_path, grams_path = get_lexicon_paths(index_path)
+    if not os.path.exists(header_path):
+        return None
+    with open(header_path, 'r') as file:
+        header = json.load(file)
+    if header.get("format") != FORMAT_VERSION:
+        raise ValueError(f'{header_path} is not a version {FORMAT_VERSION} lexicon file')
+    if header["doc_count"] != index['_M_'] or header["gram_length"] != GRAM_LENGTH or len(header["terms"]) != len(vocabulary(index)):
+        return None
+    term_numbers = np.fromfile(grams_path, dtype=np.uint32)
+    return Lexicon(header["terms"], {gram: tuple(location) for gram, location in header["grams"].items()}, term_numbers)
+
+def attach_lexicon(inverted_index, index_path):
+    '''
+    Makes the lexicon written next to an index file, if any, the lexicon of the loaded index. It is read when first needed.
+    '''
+    state = index_state(inverted_index)
+    state['lexicon_path'] = index_path
+    state.pop('lexicon', None)
+
+def get_lexicon(inverted_index):
+    '''
+    Return the lexicon of an index: the one written next to its index file, or else one built from its vocabulary.
+    '''
+    state = index_state(inverted_index)
+    if 'lexicon' in state:
+        return state['lexicon']
+
+    with instrumentation.stage("load_lexicon"):
+        lexicon = None
+        if 'lexicon_path' in state:
+            lexicon = open_lexicon(state['lexicon_path'], inverted_index)
+        if lexicon is None:
+            lexicon = build_lexicon(vocabulary(inverted_index))
+    state['lexicon'] = lexicon
+    return lexicon
+
+def parse_query(keyword_query, preprocessing_method):
+    '''
+    Splits a query into its words, patterns and fuzzy words (see above).
+    Returns a list of ("word", term), ("pattern", pattern) and ("fuzzy", term, distance or None) items,
+    words and fuzzy words normalized together like the words of a ranked query.
+    '''
+    kinds = []
+    word_tokens = []
+    for item in keyword_query.split():
+        if any(character in item for character in WILDCARDS):
+            kinds.append(("pattern", item.lower().translate(PATTERN_PUNCTUATION)))
+            word_tokens.append([])
+            continue
+        match = FUZZY_PATTERN.fullmatch(item)
+        if match:
+            kinds.append(("fuzzy", int(match.group(2)) if match.group(2) else None))
+            word_tokens.append(tokenize(match.group(1)))
+        else:
+            kinds.append(("word", None))
+            word_tokens.append(tokenize(item))
+
+    terms = iter(normalize([token for tokens in word_tokens for token in tokens], preprocessing_method))
+    items = []
+    for (kind, value), tokens in zip(kinds, word_tokens):
+        if kind == "pattern":
+            items.append((kind, value))
+        for _ in tokens:
+            items.append(("word", next(terms)) if kind == "word" else ("fuzzy", next(terms), value))
+    return items
+
+def expand_query(keyword_query, preprocessing_method, inverted_index, max_expansions=MAX_EXPANSIONS):
+    '''
+    Builds the query vector of a query with its patterns, fuzzy words and unknown words expanded into the terms of an index.
+    A word of the vocabulary weighs 1 like in an 'nnn' query vector, the terms of an expansion share a weight of 1:
+    the most frequent terms of a pattern, the closest terms of a fuzzy word (then the most frequent),
+    and the terms at the smallest distance of an unknown word.
+    '''
+    lexicon = get_lexicon(inverted_index)
+    grams_read, terms_compared = lexicon.grams_read, lexicon.terms_compared
+    query_vector = {}
+    expanded_terms = 0
+    with instrumentation.stage("expand_terms"):
+        for item in parse_query(keyword_query, preprocessing_method):
+            if item[0] == "word" and item[1] in lexicon:
+                query_vector[item[1]] = query_vector.get(item[1], 0) + 1
+                continue
+
+            if item[0] == "pattern":
+                terms = sorted(lexicon.expand_pattern(item[1]), key=lambda term: -document_frequency(inverted_index, term))
+            else:
+                term, distance = item[1], item[2] if item[0] == "fuzzy" else None
+                matches = lexicon.expand_fuzzy(term, automatic_distance(term) if distance is None else distance)
+                if item[0] == "word" and matches:
+                    # An unknown word is replaced by its closest terms only
+                    closest = min(distance for _, distance in matches)
+                    matches = [match for match in matches if match[1] == closest]
+                matches.sort(key=lambda match: (match[1], -document_frequency(inverted_index, match[0])))
+                terms = [term for term, _ in matches]
+
+            terms = terms[:max_expansions]
+            expanded_terms += len(terms)
+            for term in terms:
+                query_vector[term] = query_vector.get(term, 0) + 1 / len(terms)
+
+    instrumentation.count("lexicon_grams_read", lexicon.grams_read - grams_read)
+    instrumentation.count("lexicon_terms_compared", lexicon.terms_compared - terms_compared)
+    instrumentation.count("expanded_terms", expanded_terms)
+    return query_vector
@@ -0,0 +1,125 @@
+'''
+
+Cache of normalized tokens used by preprocessing.py
+
+Stemming and lemmatization give the same result every time they see the same token (and POS tag),
+and natural language repeats the same tokens endlessly, so their results are kept in a bounded
+least recently used cache keyed on (method, token, wordnet POS). The cache can also be backed by a
+sqlite file, which is reused by later runs of build_index.py and query.py.
+
+'''
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Number of normalized tokens kept in memory by default
+DEFAULT_SIZE = 2 ** 18
+
+
+class NormalizationCache:
+    '''
+    Bounded LRU cache of normalized tokens with an optional on-disk store.
+    Counts hits (in memory), disk hits, misses (normalized again) and evictions.
+    It can be shared by the threads of the query server, tokens are normalized outside of its lock.
+    '''
+    def __init__(self, max_size=DEFAULT_SIZE, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.entries = OrderedDict()    # (method, token, pos) -> normalized token
+        self.pending = []               # entries not written to the store yet
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._connection = None
+        self._pid = None
+        self.lock = threading.Lock()
+
+    def connection(self):
+        '''
+        Return the connection to the store, opening it in every process that uses the cache
+        (sqlite connections cannot be shared with the worker processes of a parallel build).
+        '''
+        if self._connection is None or self._pid != os.getpid():
+            import nltk
+            # The connection is only used under the lock of the cache
+            self._connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._pid = os.getpid()
+            self._connection.execute('CREATE TABLE IF NOT EXISTS normalized (method TEXT, token TEXT, pos TEXT, normalized TEXT, PRIMARY KEY (method, token, pos)) WITHOUT ROWID')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)')
+            # Another nltk version could normalize differently, start over
+            row = self._connection.execute("SELECT value FROM settings WHERE name = 'nltk_version'").fetchone()
+            if row is None or row[0] != nltk.__version__:
+                self._connection.execute('DELETE FROM normalized')
+                self._connection.execute("INSERT OR REPLACE INTO settings VALUES ('nltk_version', ?)", (nltk.__version__,))
+            self._connection.commit()
+        return self._connection
+
+    def get(self, method, token, pos, function, *args):
+        '''
+        Return the normalized token, calling function(*args) only if it is neither in memory nor on disk.
+        '''
+        if self.max_size == 0 and self.path is None:
+            return function(*args)
+
+        key = (method, token, pos)
+        with self.lock:
+            normalized = self.entries.get(key)
+            if normalized is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return normalized
+
+            if self.path is not None:
+                row = self.connection().execute('SELECT normalized FROM normalized WHERE method = ? AND token = ? AND pos = ?', key).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    self.put(key, row[0])
+                    return row[0]
+            self.misses += 1
+
+        normalized = function(*args)
+        with self.lock:
+            if self.path is not None:
+                self.pending.append(key + (normalized,))
+            self.put(key, normalized)
+        return normalized
+
+    def put(self, key, normalized):
+        '''
+        Keeps a normalized token in memory, evicting the least recently used one when full. Called under the lock.
+        '''
+        if self.max_size > 0:
+            self.entries[key] = normalized
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def flush(self):
+        '''
+        Writes the newly normalized tokens to the store.
+        '''
+        with self.lock:
+            if self.path is not None and self.pending:
+                connection = self.connection()
+                connection.executemany('INSERT OR IGNORE INTO normalized VALUES (?, ?, ?, ?)', self.pending)
+                connection.commit()
+                self.pending = []
+
+    def statistics(self):
+        '''
+        Return the counters of the cache and its hit rate (memory and disk hits over all lookups).
+        '''
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0
+            }
@@ -0,0 +1,353 @@
+'''
+
+Positions of the terms in the documents, written by build_index.py --positions and used by the
+phrase and proximity queries of query.py --mode phrase
+
+The position of a token is its place among the normalized tokens of its document, from 0. The
+positions of an index file are stored next to it in two files:
+    <index file>.positions  JSON header: the document count, and for every term the byte offset and size of its positions
+    <index file>.gaps       positions of every term, stored back to back: for each document of its postings, in increasing
+                            document number, the positions of the term as gaps (the first one as is), variable-byte
+                            encoded like the compressed index (see compressed_index.py)
+The term frequencies of the postings split the positions of a term between its documents, so the
+positions are only read along with the index they were built with.
+
+Query syntax:
+    "information retrieval"                 the words next to each other, in this order
+    information NEAR/3 retrieval            the words (or quoted phrases) at most 3 positions apart, in any order
+    "query expansion" NEAR/5 thesaurus      operands can be phrases, a NEAR chain spans from its first to its last match
+Every clause must match, words outside of the clauses only add to the score. The documents that
+match are ranked with the weighting schemes of ranked queries (see scoring.py).
+
+Documents are matched in two steps. The postings of the terms are intersected first, rarest term
+first, so the longer lists are only looked up for the documents left. The positions of each term
+are then read for those documents only, keyed by document and position, and intersected the same way.
+
+'''
+
+import json
+import mmap
+import os
+import re
+import weakref
+
+import numpy as np
+
+import instrumentation
+from compressed_index import decode_varints
+from compressed_index import encode_varints
+from preprocessing import normalize
+from preprocessing import tokenize
+from scoring import index_state
+from scoring import lookup
+
+FORMAT_VERSION = 1
+HEADER_EXTENSION = '.positions'
+GAPS_EXTENSION = '.gaps'
+
+# Keys of the positions of a document: document number * POSITION_RANGE + position
+POSITION_RANGE = 1 << 32
+# Quoted phrases, NEAR/k operators and the words between them
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(?<!\S)NEAR/(\d+)(?!\S)|([^\s"]+)')
+
+
+def get_position_paths(index_path):
+    '''
+    Return the paths of the header and the gaps file of the positions of an index file.
+    '''
+    return index_path + HEADER_EXTENSION, index_path + GAPS_EXTENSION
+
+def remove_positions(index_path):
+    '''
+    Removes the positions of an index file, which are wrong once the index is rebuilt or merged without them.
+    '''
+    for path in get_position_paths(index_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+def segment_ranges(starts, lengths):
+    '''
+    Return the indexes of the ranges [start, start + length) of an array, one range after the other.
+    '''
+    ends = np.cumsum(lengths)
+    total = int(ends[-1]) if len(ends) else 0
+    return np.arange(total, dtype=np.int64) + np.repeat(starts - (ends - lengths), lengths)
+
+def write_positions(index, index_path):
+    '''
+    Writes the positions recorded by a CompactIndex built with positions (see compact_index.py) next to its index file.
+    '''
+    header_path, gaps_path = get_position_paths(index_path)
+    terms = {}
+    offset = 0
+    with open(gaps_path, 'wb') as file:
+        for term, entry in index.entries.items():
+            gaps = np.frombuffer(entry.position_gaps, dtype=np.uint32)
+            doc_numbers = np.frombuffer(entry.doc_numbers, dtype=np.uint32)
+            # Postings are in document order unless the document table was reordered
+            if np.any(doc_numbers[1:] < doc_numbers[:-1]):
+                term_frequencies = np.frombuffer(entry.term_frequencies, dtype=np.uint32).astype(np.int64)
+                order = np.argsort(doc_numbers, kind='stable')
+                starts = np.cumsum(term_frequencies) - term_frequencies
+                gaps = gaps[segment_ranges(starts[order], term_frequencies[order])]
+            block = encode_varints(gaps)
+            file.write(block)
+            terms[term] = [offset, len(block)]
+            offset += len(block)
+
+    header = {
+        "format": FORMAT_VERSION,
+        "doc_count": index['_M_'],
+        "terms": terms
+    }
+    with open(header_path, 'w') as file:
+        json.dump(header, file)
+
+def open_positions(index_path, index):
+    '''
+    Return the positions of an index file, or None if it has none or they were written for another version of it.
+    '''
+    header_path, _ = get_position_paths(index_path)
+    if not os.path.exists(header_path):
+        return None
+    positions = PositionIndex(index_path)
+    if positions.doc_count != index['_M_']:
+        positions.close()
+        return None
+    return positions
+
+class PositionIndex:
+    '''
+    Read-only view of the positions of an index, the gaps file is memory-mapped.
+    The positions of every term that has been queried are kept decoded.
+    '''
+    def __init__(self, index_path):
+        header_path, gaps_path = get_position_paths(index_path)
+        with open(header_path, 'r') as file:
+            header = json.load(file)
+        if header.get("format") != FORMAT_VERSION:
+            raise ValueError(f'{header_path} is not a version {FORMAT_VERSION} positions file')
+
+        self.doc_count = header["doc_count"]
+        self.terms = header["terms"]
+        self.positions = {}     # term -> positions of the term in its postings, one document after the other
+        self._file = open(gaps_path, 'rb')
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._gaps = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # Empty files cannot be memory-mapped
+            self._gaps = b''
+        self.gaps = np.frombuffer(self._gaps, dtype=np.uint8)
+
+    def __contains__(self, term):
+        return term in self.terms
+
+    def term_positions(self, term, term_frequencies):
+        '''
+        Return the positions of a term in every document of its postings, one document after the other,
+        given the term frequencies of its postings in increasing document number.
+        '''
+        if term not in self.positions:
+            offset, size = self.terms[term]
+            gaps = decode_varints(self.gaps[offset:offset + size])
+            # Positions within each document are the running sums of its gaps
+            totals = np.cumsum(gaps)
+            starts = np.cumsum(term_frequencies) - term_frequencies
+            bases = np.zeros(len(starts), dtype=np.int64)
+            bases[1:] = totals[starts[1:] - 1]
+            self.positions[term] = totals - np.repeat(bases, term_frequencies)
+        return self.positions[term]
+
+    def close(self):
+        # The memory map cannot be closed while the array exists
+        self.gaps = None
+        self.positions = {}
+        if isinstance(self._gaps, mmap.mmap):
+            self._gaps.close()
+        self._file.close()
+
+def attach_positions(inverted_index, positions):
+    '''
+    Makes the positions of an index file available to the phrase queries on the loaded index.
+    They are closed once the index is collected, or when other positions are attached to it.
+    '''
+    state = index_state(inverted_index)
+    previous = state.get('positions')
+    if previous is not None and previous is not positions:
+        previous.close()
+    state['positions'] = positions
+    # A reloaded index is collected once the queries still running on it are answered
+    if hasattr(type(inverted_index), '__weakref__'):
+        weakref.finalize(inverted_index, positions.close)
+
+def get_positions(inverted_index):
+    '''
+    Return the positions attached to an index, or raise a LookupError if it was built without them.
+    '''
+    positions = index_state(inverted_index).get('positions')
+    if positions is None:
+        raise LookupError("The index has no positions, rebuild it with build_index.py --positions")
+    return positions
+
+def parse_query(keyword_query, preprocessing_method):
+    '''
+    Splits a phrase query into its clauses and normalizes their words like the documents.
+    Returns a tuple of clauses, each a tuple of (operands, distances) where every operand is a tuple of terms
+    and distances[i] is the NEAR distance between operands i and i + 1, and the terms of the whole query.
+    '''
+    items = []
+    for phrase, distance, word in QUERY_PATTERN.findall(keyword_query):
+        if distance:
+            items.append(("near", int(distance)))
+        else:
+            items.append(("phrase" if phrase or not word else "word", phrase or word))
+
+    clauses = []
+    free_words = []
+    position = 0
+    while position < len(items):
+        kind, text = items[position]
+        if kind == "near":
+            raise ValueError("NEAR/k needs a word or a quoted phrase on each side")
+        operands = [text]
+        distances = []
+        while position + 1 < len(items) and items[position + 1][0] == "near":
+            if position + 2 == len(items) or items[position + 2][0] == "near":
+                raise ValueError("NEAR/k needs a word or a quoted phrase on each side")
+            distances.append(items[position + 1][1])
+            operands.append(items[position + 2][1])
+            position += 2
+        position += 1
+        if kind == "word" and not distances:
+            free_words.append(text)
+            continue
+        operands = [tuple(normalize(tokenize(operand), preprocessing_method)) for operand in operands]
+        if not all(operands):
+            # A phrase of punctuation only matches nothing, it would match every document
+            if distances:
+                raise ValueError("NEAR/k needs a word or a quoted phrase on each side")
+            continue
+        clauses.append((tuple(operands), tuple(distances)))
+
+    terms = [term for operands, _ in clauses for operand in operands for term in operand]
+    if free_words:
+        terms += normalize(tokenize(' '.join(free_words)), preprocessing_method)
+    return tuple(clauses), terms
+
+def intersect(doc_lists):
+    '''
+    Intersects sorted arrays of distinct integers, shortest first: every later array is only
+    searched, by binary search, for the values left. Stops as soon as nothing is left.
+    '''
+    doc_lists = sorted(doc_lists, key=len)
+    survivors = doc_lists[0]
+    for doc_list in doc_lists[1:]:
+        if len(survivors) == 0:
+            break
+        _, found = lookup(doc_list, survivors)
+        survivors = survivors[found]
+    return survivors
+
+class PhraseMatcher:
+    '''
+    Finds the documents that match the clauses of a phrase query, with the postings of a scorer
+    (see scoring.py) and the positions of its index.
+    '''
+    def __init__(self, scorer, positions):
+        self.scorer = scorer
+        self.positions = positions
+        self.positions_scanned = 0
+
+    def term_keys(self, term, doc_candidates):
+        '''
+        Return the positions of a term in the candidate documents, keyed by document:
+        document number * POSITION_RANGE + position, in increasing order.
+        '''
+        doc_numbers, term_frequencies = self.scorer.term_postings(term)
+        term_frequencies = term_frequencies.astype(np.int64)
+        term_positions = self.positions.term_positions(term, term_frequencies)
+        postings, found = lookup(doc_numbers, doc_candidates)
+        postings = postings[found]
+        starts = np.cumsum(term_frequencies) - term_frequencies
+        lengths = term_frequencies[postings]
+        self.positions_scanned += int(lengths.sum())
+        return np.repeat(doc_numbers[postings].astype(np.int64) * POSITION_RANGE, lengths) + term_positions[segment_ranges(starts[postings], lengths)]
+
+    def phrase_spans(self, terms, doc_candidates):
+        '''
+        Return the start and end keys of the matches of a phrase in the candidate documents.
+        The positions of each term are shifted back by its place in the phrase, so the matches are
+        the keys every term has. Terms are intersected rarest first, each one in the documents left.
+        '''
+        order = sorted(range(len(terms)), key=lambda offset: self.scorer.document_frequency(terms[offset]))
+        starts = None
+        for offset in order:
+            keys = self.term_keys(terms[offset], doc_candidates)
+            # A phrase cannot start before the first position of its document
+            keys = keys[keys % POSITION_RANGE >= offset] - offset
+            starts = keys if starts is None else intersect([starts, keys])
+            if len(starts) == 0:
+                break
+            doc_candidates = np.unique(starts // POSITION_RANGE)
+        return starts, starts + len(terms) - 1
+
+    @staticmethod
+    def near_spans(first, second, distance):
+        '''
+        Return the spans of the matches of a span of first at most distance positions from a span of second,
+        sorted and without duplicates. Every pair of close spans gives a match spanning both: keeping only
+        one partner per span of second would lose the matches of a later NEAR that only a closer partner reaches.
+        '''
+        first_starts, first_ends = first
+        second_starts, second_ends = second
+        if len(first_starts) == 0 or len(second_starts) == 0:
+            return first_starts[:0], first_ends[:0]
+
+        # The matching spans of first end at most distance positions before each span of second, in the same
+        # document, and start at most distance positions after its end: they start in a range of first
+        earliest_end = np.maximum(second_starts - distance, second_starts // POSITION_RANGE * POSITION_RANGE)
+        longest = int((first_ends - first_starts).max())
+        low = np.searchsorted(first_starts, earliest_end - longest, side='left')
+        high = np.searchsorted(first_starts, second_ends + distance, side='right')
+        counts = np.maximum(high - low, 0)
+        partners = segment_ranges(low, counts)
+        seconds = np.repeat(np.arange(len(second_starts)), counts)
+        close = first_ends[partners] >= earliest_end[seconds]
+        partners, seconds = partners[close], seconds[close]
+
+        starts = np.minimum(first_starts[partners], second_starts[seconds])
+        ends = np.maximum(first_ends[partners], second_ends[seconds])
+        spans = np.unique(np.stack([starts, ends], axis=1), axis=0)
+        return spans[:, 0], spans[:, 1]
+
+    def clause_documents(self, clause, doc_candidates):
+        '''
+        Return the candidate documents that match a clause: a phrase, or phrases joined by NEAR/k.
+        '''
+        operands, distances = clause
+        spans = self.phrase_spans(operands[0], doc_candidates)
+        for operand, distance in zip(operands[1:], distances):
+            if len(spans[0]) == 0:
+                break
+            doc_candidates = np.unique(spans[0] // POSITION_RANGE)
+            spans = self.near_spans(spans, self.phrase_spans(operand, doc_candidates), distance)
+        return np.unique(spans[0] // POSITION_RANGE)
+
+    def match(self, clauses):
+        '''
+        Return the sorted document numbers of the documents that match every clause.
+        '''
+        terms = {term for operands, _ in clauses for operand in operands for term in operand}
+        with instrumentation.stage("intersect_postings"):
+            doc_lists = [self.scorer.term_postings(term)[0] for term in terms]
+            instrumentation.count("postings_scanned", sum(len(doc_numbers) for doc_numbers in doc_lists))
+            doc_candidates = intersect(doc_lists)
+
+        before = self.positions_scanned
+        with instrumentation.stage("match_positions"):
+            for clause in clauses:
+                if len(doc_candidates) == 0:
+                    break
+                doc_candidates = self.clause_documents(clause, doc_candidates)
+        instrumentation.count("positions_scanned", self.positions_scanned - before)
+        return doc_candidates
@@ -1,6 +1,8 @@
 '''
 
 Preprocessing methods used by build_index.py
+
+Run it directly to download the NLTK data it needs: python3 ./code/preprocessing.py
 Sources: 
     https://stackoverflow.com/questions/15586721/wordnet-lemmatization-and-pos-tagging-in-python
     https://www.nltk.org/api/nltk.tag.pos_tag.html
@@ -9,23 +11,28 @@ Sources:
 
 '''
 
-import nltk
-
-from nltk.tokenize import word_tokenize
-from nltk.stem import PorterStemmer
-from nltk.stem import WordNetLemmatizer
-
-from nltk.tag import pos_tag
-from nltk.corpus import wordnet
-
-nltk.download('punkt')
-nltk.download('averaged_perceptron_tagger')
-nltk.download('wordnet')
-
-stemmer = PorterStemmer()
-lemmatizer = WordNetLemmatizer()
-
+import itertools
 import string
+import instrumentation
+from normalization_cache import NormalizationCache
+
+# nltk is only imported when a step needs it, and nothing is downloaded at import.
+# The models are loaded on first use, so stemming never loads the tagger or WordNet.
+stemmer = None
+lemmatizer = None
+tagger = None   # nltk's pos_tag() would reload the model on every call
+
+# Results of stemming and lemmatization, see configure_cache()
+cache = NormalizationCache()
+
+# Location of every NLTK resource inside the nltk_data folder
+RESOURCE_PATHS = {
+    "punkt": "tokenizers/punkt",
+    "punkt_tab": "tokenizers/punkt_tab",
+    "averaged_perceptron_tagger": "taggers/averaged_perceptron_tagger",
+    "averaged_perceptron_tagger_eng": "taggers/averaged_perceptron_tagger_eng",
+    "wordnet": "corpora/wordnet"
+}
 
 def get_wordnet_pos(treebank_tag):
     '''
@@ -35,21 +42,109 @@ def get_wordnet_pos(treebank_tag):
         "a" for adjectives,
         "r" for adverbs,
         "s" for satellite adjectives (not available with treebank tags, so mapped to nouns instead)
+    These are the values of wordnet.NOUN, wordnet.VERB, ... which would load WordNet just to be read.
     Sources: 
         https://stackoverflow.com/questions/15586721/wordnet-lemmatization-and-pos-tagging-in-python
         https://www.cs.upc.edu/~nlp/SVMTool/PennTreebank.html
     '''
     if treebank_tag.startswith('N'):
-        return wordnet.NOUN
+        return "n"
     elif treebank_tag.startswith('V'):
-        return wordnet.VERB
+        return "v"
     elif treebank_tag.startswith('J'):
-        return wordnet.ADJ
+        return "a"
     elif treebank_tag.startswith('R'):
-        return wordnet.ADV
+        return "r"
     else:
         # Default type in is Noun
-        return wordnet.NOUN
+        return "n"
+
+def get_stemmer():
+    '''
+    Return the Porter stemmer, creating it the first time.
+    '''
+    global stemmer
+    if stemmer is None:
+        from nltk.stem import PorterStemmer
+        stemmer = PorterStemmer()
+    return stemmer
+
+def get_lemmatizer():
+    '''
+    Return the WordNet lemmatizer, creating it the first time (WordNet itself loads on the first lemma).
+    '''
+    global lemmatizer
+    if lemmatizer is None:
+        from nltk.stem import WordNetLemmatizer
+        lemmatizer = WordNetLemmatizer()
+    return lemmatizer
+
+def get_tagger():
+    '''
+    Return the POS tagger used for lemmatization, loading its model the first time.
+    Gives the same tags as nltk.tag.pos_tag.
+    '''
+    global tagger
+    if tagger is None:
+        from nltk.tag import PerceptronTagger
+        tagger = PerceptronTagger()
+    return tagger
+
+def nltk_version():
+    '''
+    Return the installed nltk version as a tuple of integers, e.g. (3, 8, 1).
+    '''
+    import nltk
+    version = []
+    for part in nltk.__version__.split('.')[:3]:
+        digits = ''.join(itertools.takewhile(str.isdigit, part))
+        version.append(int(digits or 0))
+    return tuple(version)
+
+def required_resources(methods):
+    '''
+    Return the names of the NLTK resources needed to tokenize and normalize with the given methods.
+    Newer nltk versions renamed the tokenizer and tagger data.
+    '''
+    version = nltk_version()
+    resources = ["punkt_tab" if version >= (3, 8, 2) else "punkt"]
+    if "lemmatization" in methods:
+        resources.append("averaged_perceptron_tagger_eng" if version >= (3, 9) else "averaged_perceptron_tagger")
+        resources.append("wordnet")
+    return resources
+
+def check_resources(methods):
+    '''
+    Raise a LookupError naming every missing NLTK resource for the given methods.
+    Only looks at the local nltk_data folders, never at the network.
+    '''
+    import nltk.data
+    missing = []
+    for resource in required_resources(methods):
+        try:
+            nltk.data.find(RESOURCE_PATHS[resource])
+        except LookupError:
+            missing.append(resource)
+    if missing:
+        raise LookupError(f'Missing NLTK data: {", ".join(missing)}. Download it with: python3 ./code/preprocessing.py')
+
+def download_resources(methods):
+    '''
+    Download the NLTK resources needed by the given methods.
+    '''
+    import nltk
+    for resource in required_resources(methods):
+        nltk.download(resource)
+
+def configure_cache(max_size, path=None):
+    '''
+    Replace the normalization cache: keep up to max_size normalized tokens in memory (0 disables it)
+    and optionally store them in a sqlite file that later runs reuse.
+    '''
+    global cache
+    cache.flush()
+    cache = NormalizationCache(max_size, path)
+    return cache
 
 def tokenize(text):
     '''
@@ -58,31 +153,78 @@ def tokenize(text):
     '''
     assert type(text) == str
 
-    # remove punctuation
-    new_text = text.translate(str.maketrans('', '', string.punctuation))
-    tokens = word_tokenize(new_text)
+    from nltk.tokenize import word_tokenize
+
+    with instrumentation.stage("tokenize"):
+        # remove punctuation
+        new_text = text.translate(str.maketrans('', '', string.punctuation))
+        tokens = word_tokenize(new_text)
 
     return tokens
 
-def normalize(tokens, method):
+def stem(l_cased):
     '''
-    Normalize a list of tokens by lowercasing and applying 
-    stemming or lemmatization.
+    Stem a list of lowercased tokens with the Porter stemmer.
+    '''
+    stem_token = get_stemmer().stem
+    with instrumentation.stage("stem"):
+        return [cache.get("stemming", token, "", stem_token, token) for token in l_cased]
+
+def lemmatize(l_cased):
+    '''
+    Lemmatize a list of lowercased tokens using their POS tags.
     Sources:
         https://www.nltk.org/api/nltk.tag.pos_tag.html
         https://stackoverflow.com/questions/33157847/lemmatizing-words-after-pos-tagging-produces-unexpected-results
     '''
+    # Find pos tags of words in a sentence, ie (token, tag)
+    with instrumentation.stage("pos_tag"):
+        pos_tagged_tokens = get_tagger().tag(l_cased)
+
+    # Lemmatize tokens using their pos_tags converted into a usable format
+    lemmatize_token = get_lemmatizer().lemmatize
+    lemmas = []
+    with instrumentation.stage("lemmatize"):
+        for token, pos_tag in pos_tagged_tokens:
+            pos = get_wordnet_pos(pos_tag)
+            lemmas.append(cache.get("lemmatization", token, pos, lemmatize_token, token, pos))
+    return lemmas
+
+# Normalization methods: function applied to the lowercased tokens.
+# A new method only needs an entry here (and an index file type in collection_object.py)
+normalizers = {
+    "lemmatization": lemmatize,
+    "stemming": stem
+}
+
+def normalize(tokens, method):
+    '''
+    Normalize a list of tokens by lowercasing and applying 
+    stemming or lemmatization.
+    '''
     assert type(tokens) == list
 
     l_cased = [token.lower() for token in tokens]
 
-    if method == 'stemming':
-        normalized = [stemmer.stem(token) for token in l_cased]
-    else:
-        # Find pos tags of words in a sentence, ie (token, tag)
-        pos_tagged_tokens = pos_tag(l_cased)
-        
-        # Lemmatize tokens using their pos_tags converted into a usable format
-        normalized = [lemmatizer.lemmatize(token, pos=get_wordnet_pos(pos_tag)) for token, pos_tag in pos_tagged_tokens]
+    # Lemmatization is the default method
+    normalizer = normalizers.get(method, lemmatize)
+    return normalizer(l_cased)
+
+def normalize_all(tokens, methods):
+    '''
+    Normalize a list of tokens with several methods, lowercasing them only once.
+    Returns a dictionary of method: normalized tokens.
+    '''
+    assert type(tokens) == list
+
+    l_cased = [token.lower() for token in tokens]
+
+    return {method: normalizers.get(method, lemmatize)(l_cased) for method in methods}
+
+if __name__ == "__main__":
+    '''
+    Downloads the NLTK data used by every normalization method
+    '''
+    download_resources(list(normalizers.keys()))
 
-    return normalized
+    exit(0)
@@ -9,20 +9,34 @@ The program will be run from the root of the repository.
 '''
 
 import sys
+import preprocessing
 from preprocessing import tokenize
 from preprocessing import normalize
 import collection_object
 import math
 import heapq
+from weighting import tf_weight
+from weighting import df_weight
+from scoring import get_scorer
+import boolean_query
+import compact_index
+import impacts
+import instrumentation
+import lexicon
+import positional_index
+import result_cache
+import segments
+import sharding
 
-def compute_cosine_similarity(query_vector, doc_vector, normalization):
-    """Compute the cosine similarity between two vectors."""
-    dot_product = sum(query_vector.get(key, 0) * doc_vector.get(key, 0) for key in set(query_vector.keys()).union(doc_vector.keys()))
+def compute_cosine_similarity(query_vector, doc_vector, normalization, query_norm=0, doc_norm=0):
+    """
+    Compute the cosine similarity between the query vector and a document vector
+    holding the weights of the query terms, using the stored length of the full document vector.
+    """
+    dot_product = sum(query_vector[term] * weight for term, weight in doc_vector.items())
 
     if normalization == "c":
         # Normalize
-        query_norm = math.sqrt(sum(value * value for value in query_vector.values()))
-        doc_norm = math.sqrt(sum(value * value for value in doc_vector.values()))
         if query_norm * doc_norm == 0:  # Prevent division by zero
             return 0
         return dot_product / (query_norm * doc_norm)
@@ -30,16 +44,29 @@ def compute_cosine_similarity(query_vector, doc_vector, normalization):
         # Don't normalize
         return dot_product
 
-def build_query_vector(keyword_query, preprocessing_method):
+def build_query_vector(keyword_query, preprocessing_method, inverted_index=None, expand=False):
     '''
     Takes a query, tokenizes and normalizes it, builds a query vector
     using the 'nnn' weighting scheme.
+    With expand, wildcard patterns, fuzzy words and words missing from the vocabulary
+    are expanded into the terms of the index (see lexicon.py).
     '''
+    if inverted_index is None:
+        inverted_index = index
+
+    with instrumentation.stage("query_vector"):
+        if expand:
+            return lexicon.expand_query(keyword_query, preprocessing_method, inverted_index)
+        terms = normalize(tokenize(keyword_query), preprocessing_method)
+        return terms_query_vector(terms, inverted_index)
 
-    terms = normalize(tokenize(keyword_query), preprocessing_method)
+def terms_query_vector(terms, inverted_index):
+    '''
+    Builds the 'nnn' query vector of normalized query terms.
+    '''
     query_vector = {}
     for term in terms:
-        if term in index:
+        if term in inverted_index:
             df = 1
             tf = terms.count(term)
             query_vector[term] = tf * df
@@ -49,62 +76,216 @@ def build_query_vector(keyword_query, preprocessing_method):
     return query_vector
 
 
-def tokenize_and_answer(keyword_query, tf_scheme, df_scheme, normalization, k, preprocessing_method):
+def rank_with_document_vectors(query_vector, tf_scheme, df_scheme, normalization, k, inverted_index):
     '''
-    Takes a query, tokenizes and normalizes it, builds a query vector, 
-    and scores the documents using the dot product algorithm discussed in class,
+    Scores the documents by building a vector for every candidate document and ranks them with a heap.
+    This is the reference implementation of the accumulator scoring in scoring.py,
     returns the k highest ranked documents in order.
     '''
-    assert type(keyword_query) == str
-
-    query_vector = build_query_vector(keyword_query, preprocessing_method)
     min_heap = []           # Uses the heapq library
     document_vectors = {}   # document_vectors[docID][term][tf-idf]
-    answer = None # TODO: use the right data structure
-
-    for term in query_vector.keys():
-        if term in index:
-            # Calculate df according to scheme
-            if df_scheme == "t":
-                # Use idf
-                doc_count = index["_M_"]
-                doc_frequency = index[term][0]
-                if doc_frequency == 0 or doc_count == 0:
-                    df = 0
-                else:
-                    df = math.log10((doc_count) / (doc_frequency))
-            else:
-                # Use regular df
-                df = 1
-
-            # Grab all postings for the current term
-            for term_frequency, doc_id in index[term][1]:
-                # Calculate tf according to scheme
-                if tf_scheme == "l":
-                    tf = math.log10(term_frequency) + 1
-                else:
-                    tf = term_frequency
-                    
-                tf_idf = tf * df
-
-                # Build document vectors to calculate cosine similarities with
-                if doc_id not in document_vectors:
-                    document_vectors[doc_id] = {}           # Initialize docID if it doesn't exist
-                document_vectors[doc_id][term] = tf_idf
-    
+
+    with instrumentation.stage("document_vectors"):
+        for term in query_vector.keys():
+            if term in inverted_index:
+                # Calculate df according to scheme
+                df = df_weight(inverted_index["_M_"], compact_index.document_frequency(inverted_index, term), df_scheme)
+
+                # Grab all postings for the current term
+                postings = compact_index.postings(inverted_index, term)
+                for term_frequency, doc_id in postings:
+                    # Calculate tf according to scheme
+                    tf = tf_weight(term_frequency, tf_scheme)
+                    tf_idf = tf * df
+
+                    # Build document vectors to calculate cosine similarities with
+                    if doc_id not in document_vectors:
+                        document_vectors[doc_id] = {}           # Initialize docID if it doesn't exist
+                    document_vectors[doc_id][term] = tf_idf
+                instrumentation.count("postings_scanned", len(postings))
+    instrumentation.count("candidate_documents", len(document_vectors))
+
+    # Lengths of the full document vectors are computed by build_index.py
+    query_norm = 0
+    document_norms = {}
+    if normalization == "c":
+        if "_N_" not in inverted_index:
+            raise LookupError("The index has no document norms, rebuild it with build_index.py or convert_index.py")
+        query_norm = math.sqrt(sum(value * value for value in query_vector.values()))
+        document_norms = inverted_index["_N_"][tf_scheme + df_scheme]
+
     # Compute cosine similarity for each document
-    for doc_id, doc_vector in document_vectors.items():
-        cosine_sim = compute_cosine_similarity(query_vector, doc_vector, normalization)
-        if len(min_heap) <= k:
-            heapq.heappush(min_heap, (cosine_sim, doc_id))
-        else:
-            heapq.heappushpop(min_heap, (cosine_sim, doc_id))
-    
-    top_k = heapq.nlargest(k, min_heap)
+    with instrumentation.stage("cosine_similarity"):
+        similarities = [(compute_cosine_similarity(query_vector, doc_vector, normalization, query_norm, document_norms.get(doc_id, 0)), doc_id)
+                        for doc_id, doc_vector in document_vectors.items()]
+    with instrumentation.stage("heap"):
+        for cosine_sim, doc_id in similarities:
+            if len(min_heap) <= k:
+                heapq.heappush(min_heap, (cosine_sim, doc_id))
+            else:
+                heapq.heappushpop(min_heap, (cosine_sim, doc_id))
+
+        top_k = heapq.nlargest(k, min_heap)
     answer = [(doc_id, score) for score, doc_id in top_k]
 
     return answer
 
+def answer_phrase_query(keyword_query, tf_scheme, df_scheme, normalization, k, preprocessing_method, inverted_index, cache=None):
+    '''
+    Answers a query of quoted phrases and NEAR/k clauses (see positional_index.py) with the positions
+    stored with the index: only the documents that match every clause are scored,
+    like tokenize_and_answer scores them. Returns the k highest ranked documents in order.
+    '''
+    with instrumentation.stage("query_vector"):
+        clauses, terms = positional_index.parse_query(keyword_query, preprocessing_method)
+        query_vector = terms_query_vector(terms, inverted_index)
+    instrumentation.count("query_terms", len(query_vector))
+    if cache is not None:
+        # Queries with the same words but other clauses have other answers
+        key = result_cache.query_key(query_vector, tf_scheme, df_scheme, normalization, preprocessing_method) + (clauses,)
+        answer = cache.get(key, k)
+        if answer is not None:
+            instrumentation.count("result_cache_hits")
+            return answer
+
+    positions = positional_index.get_positions(inverted_index)
+    scorer = get_scorer(inverted_index)
+    if clauses:
+        doc_candidates = positional_index.PhraseMatcher(scorer, positions).match(clauses)
+        answer = scorer.top_k_of(query_vector, tf_scheme, df_scheme, normalization, k, doc_candidates)
+    else:
+        # Without a phrase or NEAR clause, every document with a query word matches
+        answer = scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, k)
+
+    if cache is not None:
+        cache.put(key, k, answer)
+    return answer
+
+def answer_boolean_query(keyword_query, tf_scheme, df_scheme, normalization, k, preprocessing_method, inverted_index, cache=None, rank=True):
+    '''
+    Answers a query of AND, OR and NOT operators (see boolean_query.py). A word missing from the vocabulary
+    matches no document instead of failing the query. The matching documents are ranked like
+    tokenize_and_answer ranks them, with the words that are not under a NOT, or without rank,
+    the first k of them in collection order are returned with a score of 1.
+    '''
+    with instrumentation.stage("query_vector"):
+        tree = boolean_query.parse_query(keyword_query, preprocessing_method)
+        terms = [term for term in boolean_query.positive_terms(tree) if term in inverted_index]
+        query_vector = terms_query_vector(terms, inverted_index)
+    instrumentation.count("query_terms", len(query_vector))
+    if cache is not None:
+        # Queries with the same words but other operators have other answers
+        key = result_cache.query_key(query_vector, tf_scheme, df_scheme, normalization, preprocessing_method) + (tree, rank)
+        answer = cache.get(key, k)
+        if answer is not None:
+            instrumentation.count("result_cache_hits")
+            return answer
+
+    scorer = get_scorer(inverted_index)
+    doc_candidates = boolean_query.BooleanMatcher(scorer).match(tree)
+    if rank:
+        answer = scorer.top_k_of(query_vector, tf_scheme, df_scheme, normalization, k, doc_candidates)
+    else:
+        answer = [(scorer.documents[doc_number], 1.0) for doc_number in doc_candidates[:k].tolist()]
+
+    if cache is not None:
+        cache.put(key, k, answer)
+    return answer
+
+def tokenize_and_answer(keyword_query, tf_scheme, df_scheme, normalization, k, preprocessing_method, inverted_index=None, pruning=False, cache=None, mode="ranked", rank=True, expand=False):
+    '''
+    Takes a query, tokenizes and normalizes it, builds a query vector, 
+    and scores the documents using the dot product algorithm discussed in class,
+    returns the k highest ranked documents in order.
+    The module level index is used unless an already loaded index is passed in.
+    With pruning, postings that cannot reach the top k are skipped, the answer is the same.
+    With a result cache of the index (see result_cache.py), queries already answered are not scored again.
+    When the instrumentation is enabled, the stages and counters of the query go into one trace (see instrumentation.py).
+    In the 'phrase' and 'boolean' modes, the query is answered by answer_phrase_query and answer_boolean_query.
+    With expand, the terms of the query are expanded with the lexicon of the index (see lexicon.py).
+    '''
+    assert type(keyword_query) == str
+    if expand and mode != "ranked":
+        raise ValueError("Only ranked queries can be expanded")
+
+    if inverted_index is None:
+        inverted_index = index
+
+    with instrumentation.trace(query=keyword_query, scheme=tf_scheme + df_scheme + normalization, tokenization=preprocessing_method, k=k, pruning=pruning, mode=mode, expand=expand):
+        if mode == "phrase":
+            return answer_phrase_query(keyword_query, tf_scheme, df_scheme, normalization, k, preprocessing_method, inverted_index, cache)
+        if mode == "boolean":
+            return answer_boolean_query(keyword_query, tf_scheme, df_scheme, normalization, k, preprocessing_method, inverted_index, cache, rank)
+        query_vector = build_query_vector(keyword_query, preprocessing_method, inverted_index, expand)
+        instrumentation.count("query_terms", len(query_vector))
+        if cache is not None:
+            key = result_cache.query_key(query_vector, tf_scheme, df_scheme, normalization, preprocessing_method)
+            answer = cache.get(key, k)
+            if answer is not None:
+                instrumentation.count("result_cache_hits")
+                return answer
+
+        # Scores are accumulated term by term into an array indexed by document number,
+        # a sharded index scatters the query to its shards instead (see sharding.py)
+        scorer = inverted_index if isinstance(inverted_index, sharding.ShardCoordinator) else get_scorer(inverted_index)
+        if pruning:
+            answer = scorer.top_k_pruned(query_vector, tf_scheme, df_scheme, normalization, k)
+        else:
+            answer = scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, k)
+
+        if cache is not None:
+            cache.put(key, k, answer)
+        return answer
+
+def get_index_path(collection, collection_name, preprocessing_method, index_format="json"):
+    '''
+    Return the path of the processed index of a collection for the given preprocessing method.
+    '''
+    file_type = collection.index_file_types[preprocessing_method]
+    return collection.get_output_path(collection_name, file_type, throw_file_exists_error=False, index_format=index_format)
+
+def get_watched_files(collection, index_path):
+    '''
+    Return every file a loaded index is read from: the index files, its segment manifest, its impacts, its positions and its lexicon.
+    '''
+    return collection.get_index_files(index_path) + [segments.get_manifest_path(index_path), impacts.get_impact_paths(index_path)[0],
+                                                     positional_index.get_position_paths(index_path)[0], lexicon.get_lexicon_paths(index_path)[0]]
+
+def load_index(collection, collection_name, preprocessing_method, index_format="json", compact=True):
+    '''
+    Reads the processed index of a collection for the given preprocessing method,
+    merged with the segments written by update_index.py since it was built.
+    A JSON index is held as a CompactIndex (see compact_index.py) unless compact is False.
+    The impacts stored with the index, if any, are used by its scorer, its positions by phrase queries
+    and its lexicon by expanded queries.
+    '''
+    output_path = get_index_path(collection, collection_name, preprocessing_method, index_format)
+
+    with instrumentation.stage("load_index"):
+        index = segments.open_index(collection, output_path, compact)
+        # Impacts written by build_index.py --impacts do not account for the segments
+        if not isinstance(index, segments.SegmentedIndex):
+            stored_impacts = impacts.open_impacts(output_path, index)
+            if stored_impacts is not None:
+                get_scorer(index, stored_impacts)
+            # Positions written by build_index.py --positions do not account for the segments either
+            stored_positions = positional_index.open_positions(output_path, index)
+            if stored_positions is not None:
+                positional_index.attach_positions(index, stored_positions)
+            # The lexicon is only read once a query is expanded
+            lexicon.attach_lexicon(index, output_path)
+    return index
+
+def load_sharded_index(collection, collection_name, preprocessing_method, index_format="json", urls=None):
+    '''
+    Return the coordinator of the shards of the processed index of a collection, written by build_index.py --shards.
+    The shards are loaded by worker processes, or served by the shard servers at the given URLs.
+    '''
+    output_path = get_index_path(collection, collection_name, preprocessing_method, index_format)
+    with instrumentation.stage("load_index"):
+        transport = "process" if urls is None else "remote"
+        return sharding.open_coordinator(collection, output_path, transport, urls, index_format)
+
 
 index = {}
 
@@ -117,30 +298,55 @@ if __name__ == "__main__":
     collection = collection_object.Collection()
     args = collection.parse_query_inputs()
 
+    preprocessing.configure_cache(args.cache_size, args.cache_path)
+    if args.trace is not None:
+        instrumentation.configure(args.trace)
+
     # Get the query, preprocessing method, and weighting scheme
     max_answers = args.k
     query = args.query
     preprocessing_method = args.tokenization
 
+    # Fail fast, without touching the network, when the NLTK data is missing
+    try:
+        preprocessing.check_resources([preprocessing_method])
+    except LookupError as error:
+        print(error, file=sys.stderr)
+        exit(1)
+
     tf_scheme = args.weighting_scheme[0]
     df_scheme = args.weighting_scheme[1]
     normalization = args.weighting_scheme[2]
     
     # Get the collection to query on
     collection_name = args.collection
-    if preprocessing_method == 'lemmatization':
-        file_type = 'corpus_lemmas'
+    if args.sharded and (args.mode != "ranked" or args.expand):
+        print('Shards only answer ranked queries, phrase, Boolean and expanded queries need the whole index', file=sys.stderr)
+        exit(1)
+    if args.sharded:
+        try:
+            index = load_sharded_index(collection, collection_name, preprocessing_method, args.format, args.shard_urls)
+        except (LookupError, ValueError) as error:
+            print(error, file=sys.stderr)
+            exit(1)
     else:
-        file_type = 'corpus_stems'
-    output_path = collection.get_output_path(collection_name, file_type, throw_file_exists_error=False)
-    
-    index = collection.read_data(output_path)
+        index = load_index(collection, collection_name, preprocessing_method, args.format)
 
     # Get answers to query
-    answers = tokenize_and_answer(query, df_scheme, tf_scheme, normalization, max_answers, preprocessing_method)
+    try:
+        answers = tokenize_and_answer(query, tf_scheme, df_scheme, normalization, max_answers, preprocessing_method, pruning=args.pruning, mode=args.mode, rank=not args.unranked, expand=args.expand)
+    except (LookupError, ValueError) as error:
+        # Phrase queries on an index built without positions, malformed phrase and Boolean queries
+        print(error, file=sys.stderr)
+        exit(1)
 
     # Print results
     for docID, score in answers:
         print("{d}:{s:.3f}".format(d = docID, s=score), end="\t")
+
+    if args.sharded:
+        index.close()
+    preprocessing.cache.flush()
+    instrumentation.write_summary()
     
     exit(0)
\ No newline at end of file
@@ -0,0 +1,63 @@
+'''
+
+Sends a keyword query to a running query_server.py and prints to STDOUT the IDs
+of the k documents with highest score, in the same format as query.py
+
+Input: the same arguments as query.py, and optionally --host and --port of the server
+
+The program will be run from the root of the repository.
+
+'''
+
+import json
+import sys
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+
+import collection_object
+
+
+def request_answers(host, port, collection_name, weighting_scheme, tokenization, k, query, mode="ranked", expand=False):
+    '''
+    Queries the server and returns its answers as a list of (docID, score).
+    '''
+    parameters = urlencode({
+        "collection": collection_name,
+        "scheme": weighting_scheme,
+        "tokenization": tokenization,
+        "k": k,
+        "query": query,
+        "mode": mode,
+        "expand": int(expand)
+    })
+    url = f'http://{host}:{port}/query?{parameters}'
+    try:
+        with urllib.request.urlopen(url) as response:
+            content = json.load(response)
+    except urllib.error.HTTPError as error:
+        content = json.load(error)
+        raise ValueError(content["error"])
+
+    return [(doc_id, score) for doc_id, score in content["answers"]]
+
+
+if __name__ == "__main__":
+    '''
+    main() function
+    '''
+    collection = collection_object.Collection()
+    args = collection.parse_client_inputs()
+
+    try:
+        # The server expects the short tokenization name ('l' or 's')
+        answers = request_answers(args.host, args.port, args.collection, args.weighting_scheme, args.tokenization[0], args.k, args.query, args.mode, args.expand)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        exit(1)
+
+    # Print results
+    for docID, score in answers:
+        print("{d}:{s:.3f}".format(d = docID, s=score), end="\t")
+
+    exit(0)
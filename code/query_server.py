@@ -0,0 +1,226 @@
+'''
+
+Long-lived query server. Loads the lemma and stem indexes of one or more collections
+and the NLTK models once, then answers queries over HTTP until it is stopped.
+
+Request:
+    GET /query?collection=<name>&scheme=<nnn>&tokenization=<l|s>&k=<k>&query=<text>[&mode=<ranked|phrase|boolean>][&expand=1]
+
+Response (JSON):
+    {"answers": [[docID, score], ...]} sorted by decreasing score, or {"error": message}
+
+    GET /cache
+returns the statistics of the result cache of every index (see result_cache.py).
+
+Answers are cached per index, --result-cache-size answers each (0 disables the cache). When the files
+of an index change (a rebuild, an update or a merge), its cached answers are dropped and it is read again.
+
+Concurrent clients are answered by separate threads. Use query_client.py to query
+the server from the command line.
+
+The program will be run from the root of the repository.
+
+'''
+
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import collection_object
+import preprocessing
+import query
+import result_cache
+import scoring
+from preprocessing import tokenize
+from preprocessing import normalize
+
+PREPROCESSING_METHODS = ['lemmatization', 'stemming']
+
+
+def load_indexes(collection, collection_names, index_format="json", cache_size=result_cache.DEFAULT_SIZE):
+    '''
+    Reads the lemma and stem indexes of every collection and creates their result caches.
+    Returns two dictionaries of (collection name, preprocessing method): index and result cache
+    '''
+    indexes = {}
+    caches = {}
+    for collection_name in collection_names:
+        for preprocessing_method in PREPROCESSING_METHODS:
+            index_path = query.get_index_path(collection, collection_name, preprocessing_method, index_format)
+            # The cache watches the files before they are read, so changes made while they are read are seen
+            caches[(collection_name, preprocessing_method)] = result_cache.ResultCache(cache_size, query.get_watched_files(collection, index_path))
+            indexes[(collection_name, preprocessing_method)] = query.load_index(collection, collection_name, preprocessing_method, index_format)
+        print(f'Loaded indexes of {collection_name}')
+    return indexes, caches
+
+def reload_changed_index(server, key):
+    '''
+    Reads an index again if its files changed since it was loaded, which also empties its result cache.
+    '''
+    cache = server.caches[key]
+    if cache.validate():
+        collection_name, preprocessing_method = key
+        # One index is read at a time, queries go on with the previous one meanwhile
+        with server.reload_lock:
+            inverted_index = query.load_index(server.collection, collection_name, preprocessing_method, server.index_format)
+            with server.index_lock:
+                previous = server.indexes[key]
+                server.indexes[key] = inverted_index
+                # Answers of the previous index, computed by queries still running on it, are no longer cached
+                cache.clear()
+                in_use = id(previous) in server.index_users
+        if not in_use:
+            scoring.release_index_state(previous)
+        print(f'Reloaded the {preprocessing_method} index of {collection_name}')
+
+def acquire_index(server, key):
+    '''
+    Return the index served for a key with its result cache at the generation the index belongs to.
+    The index is held by the query until release_index, its state is kept while it is held after a reload.
+    '''
+    with server.index_lock:
+        inverted_index = server.indexes[key]
+        cache = server.caches.get(key)
+        if cache is not None:
+            cache = cache.at_generation(cache.generation)
+        _, users = server.index_users.get(id(inverted_index), (inverted_index, 0))
+        server.index_users[id(inverted_index)] = (inverted_index, users + 1)
+    return inverted_index, cache
+
+def release_index(server, inverted_index):
+    '''
+    Gives back an index held by a query, the last query on an index replaced by a reload releases its state.
+    '''
+    with server.index_lock:
+        _, users = server.index_users[id(inverted_index)]
+        if users > 1:
+            server.index_users[id(inverted_index)] = (inverted_index, users - 1)
+            return
+        del server.index_users[id(inverted_index)]
+        replaced = all(served is not inverted_index for served in server.indexes.values())
+    if replaced:
+        scoring.release_index_state(inverted_index)
+
+def warm_up():
+    '''
+    Loads the POS tagger and WordNet, which nltk otherwise only loads for the first query.
+    '''
+    for preprocessing_method in PREPROCESSING_METHODS:
+        normalize(tokenize("warming up the models"), preprocessing_method)
+
+def answer_request(server, parameters):
+    '''
+    Validates the parameters of a request and returns the answers to its query.
+    '''
+    collection_name = parameters["collection"]
+    tf_scheme, df_scheme, normalization = collection_object.Collection.weighting_scheme(parameters["scheme"])
+    preprocessing_method = collection_object.Collection.tokenization(parameters["tokenization"])
+    k = collection_object.Collection.positive_int(parameters["k"])
+    mode = collection_object.Collection.query_mode(parameters.get("mode", "ranked"))
+    expand = parameters.get("expand", "0") == "1"
+
+    if (collection_name, preprocessing_method) not in server.indexes:
+        raise KeyError(f'The collection "{collection_name}" is not served')
+    inverted_index, cache = acquire_index(server, (collection_name, preprocessing_method))
+    try:
+        return query.tokenize_and_answer(parameters["query"], tf_scheme, df_scheme, normalization, k, preprocessing_method, inverted_index, cache=cache, mode=mode, expand=expand)
+    finally:
+        release_index(server, inverted_index)
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Answers GET /query requests using the indexes of the server.
+    '''
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/cache':
+            self.send_json(200, {f'{collection_name} {preprocessing_method}': cache.statistics()
+                                 for (collection_name, preprocessing_method), cache in self.server.caches.items()})
+            return
+        if url.path != '/query':
+            self.send_json(404, {"error": f'Unknown path {url.path}'})
+            return
+
+        parameters = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        missing = [name for name in ["collection", "scheme", "tokenization", "k", "query"] if name not in parameters]
+        if missing:
+            self.send_json(400, {"error": f'Missing parameters: {missing}'})
+            return
+
+        try:
+            key = (parameters["collection"], collection_object.Collection.tokenization(parameters["tokenization"]))
+            if key in self.server.caches:
+                reload_changed_index(self.server, key)
+            answers = answer_request(self.server, parameters)
+        except KeyError as error:
+            self.send_json(404, {"error": str(error.args[0])})
+            return
+        except Exception as error:
+            # Invalid parameters and query terms that are not in the vocabulary
+            self.send_json(400, {"error": str(error)})
+            return
+
+        self.send_json(200, {"answers": answers})
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the terminal quiet, one line per query is too much under load
+        pass
+
+class QueryServer(ThreadingHTTPServer):
+    '''
+    HTTP server which keeps the loaded indexes and their result caches for its request handlers.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, indexes, caches=None, collection=None, index_format="json"):
+        super().__init__(address, QueryRequestHandler)
+        self.indexes = indexes
+        self.caches = caches or {}
+        # Needed to read an index again once its files change
+        self.collection = collection
+        self.index_format = index_format
+        self.reload_lock = threading.Lock()
+        # Guards the swap of a reloaded index and the queries holding each index: id -> (index, number of queries)
+        self.index_lock = threading.Lock()
+        self.index_users = {}
+
+
+if __name__ == "__main__":
+    '''
+    main() function
+    '''
+    collection = collection_object.Collection()
+    args = collection.parse_server_inputs()
+
+    # Fail fast, without touching the network, when the NLTK data is missing
+    try:
+        preprocessing.check_resources(PREPROCESSING_METHODS)
+    except LookupError as error:
+        print(error, file=sys.stderr)
+        exit(1)
+
+    indexes, caches = load_indexes(collection, args.collections, args.format, args.result_cache_size)
+    warm_up()
+
+    server = QueryServer((args.host, args.port), indexes, caches, collection, args.format)
+    print(f'Serving {", ".join(args.collections)} on http://{args.host}:{args.port}/query')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    exit(0)
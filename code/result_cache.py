@@ -0,0 +1,155 @@
+'''
+
+Cache of query answers used by query.py and the query server
+
+Users repeat the same queries, and the answer to a query only depends on its query vector (the
+normalized terms and their counts, so "Cats" and "cat" share an answer), the weighting scheme,
+the text normalization and k. Answers are kept in a bounded least recently used cache keyed on all
+but k: an answer for k documents also answers every smaller k with its first documents, since
+rankings are totally ordered (see scoring.select_top_k), and an answer shorter than its k holds
+every matching document, so it answers any k.
+
+A cache belongs to one loaded index and watches the files it was read from (the index files, the
+segment manifest and the impacts). validate() drops the cached answers when one of them changed,
+its owner then reads the index again (the query server does it before every request). Every
+clear() starts a new generation of the cache: a query answered by the index read before it gives
+its answer with its older generation, which is not cached, so answers of a replaced index are not
+served after it.
+
+'''
+
+import os
+import threading
+from collections import OrderedDict
+
+# Number of answers kept in memory by default
+DEFAULT_SIZE = 1024
+
+
+def file_signature(paths):
+    '''
+    Return the modification time and size of every file, None for the files that do not exist.
+    '''
+    signature = []
+    for path in paths:
+        try:
+            status = os.stat(path)
+            signature.append((path, status.st_mtime_ns, status.st_size))
+        except FileNotFoundError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+def query_key(query_vector, tf_scheme, df_scheme, normalization, preprocessing_method):
+    '''
+    Return the cache key of a query vector (term: count) under a weighting scheme and text normalization.
+    '''
+    return (tuple(sorted(query_vector.items())), tf_scheme + df_scheme + normalization, preprocessing_method)
+
+class ResultCache:
+    '''
+    Bounded LRU cache of answers ([(docID, score), ...]) with the k they were computed for.
+    Counts hits, misses, evictions and invalidations (the watched files changed).
+    Answers may be looked up and added from several threads.
+    '''
+    def __init__(self, max_size=DEFAULT_SIZE, paths=()):
+        self.max_size = max_size
+        self.paths = list(paths)
+        self.signature = file_signature(self.paths)
+        self.entries = OrderedDict()    # key -> (k, answer)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def validate(self):
+        '''
+        Drops every answer if a watched file changed since the answers were computed.
+        Returns True if they were dropped, the index should then be read again.
+        '''
+        signature = file_signature(self.paths)
+        with self.lock:
+            if signature == self.signature:
+                return False
+            self.signature = signature
+            self.entries.clear()
+            self.invalidations += 1
+            return True
+
+    def clear(self):
+        '''
+        Drops every answer, e.g. the ones computed with the old index while the new one was read,
+        and starts a new generation.
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def get(self, key, k):
+        '''
+        Return the first k documents of the cached answer of a query, or None if it is not cached for k.
+        '''
+        if self.max_size == 0:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            # An answer shorter than its k holds every matching document
+            if entry is not None and (entry[0] >= k or len(entry[1]) < entry[0]):
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry[1][:k]
+            self.misses += 1
+            return None
+
+    def put(self, key, k, answer, generation=None):
+        '''
+        Caches the answer of a query for k documents, unless an answer for more documents is cached
+        or the answer was computed in an older generation than the current one.
+        '''
+        if self.max_size == 0:
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < k:
+                self.entries[key] = (k, list(answer))
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def at_generation(self, generation):
+        '''
+        Return the cache as seen by a query that read its index in the given generation.
+        '''
+        return GenerationCache(self, generation)
+
+    def statistics(self):
+        '''
+        Return the counters of the cache and its hit rate.
+        '''
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "size": len(self.entries),
+            "hit_rate": self.hits / lookups if lookups else 0
+        }
+
+class GenerationCache:
+    '''
+    Result cache of a query that read its index in one generation: its answer is only cached if the index was not replaced since.
+    '''
+    def __init__(self, cache, generation):
+        self.cache = cache
+        self.generation = generation
+
+    def get(self, key, k):
+        return self.cache.get(key, k)
+
+    def put(self, key, k, answer):
+        self.cache.put(key, k, answer, self.generation)
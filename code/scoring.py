@@ -0,0 +1,471 @@
+'''
+
+Term-at-a-time scoring of an inverted index into a dense score accumulator, used by query.py
+
+Documents are identified by their position in the document table of the index ('_D_', written by
+build_index.py), so the score of every document lives in one preallocated NumPy array instead of
+a dictionary per candidate. The k best documents are selected with argpartition.
+
+'''
+
+import array
+import itertools
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import instrumentation
+from weighting import df_weight
+from weighting import tf_weight
+
+# Relative margin kept when comparing score bounds, so rounding errors never prune a document of the top k
+PRUNING_SLACK = 1e-9
+# Looking a document up in a postings list by binary search costs about as much as scoring this many postings
+LOOKUP_COST = 8
+# Memory kept by each cache of the arrays of the terms a scorer has read or weighted, least recently used first out
+TERM_CACHE_BYTES = 64 * 2 ** 20
+
+# Postings of the terms that are not in the index, which are not cached
+EMPTY_POSTINGS = (np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32))
+for _empty in EMPTY_POSTINGS:
+    _empty.flags.writeable = False
+
+
+class TermCache:
+    '''
+    Bounded LRU cache of the arrays of a scorer by term or by (term, scheme), so a long-lived scorer
+    does not keep the arrays of every term it was ever queried for. Arrays may be looked up and added
+    from several threads. A cache without a budget (max_bytes None) keeps every array.
+    '''
+    def __init__(self, max_bytes=TERM_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # key -> (arrays, bytes)
+        self.size = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Return the arrays cached for a key, or None.
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def __setitem__(self, key, value):
+        parts = value if isinstance(value, tuple) else (value,)
+        size = sum(part.nbytes for part in parts if isinstance(part, np.ndarray))
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            # The arrays just added are kept even when they are larger than the budget on their own
+            while self.max_bytes is not None and self.size > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+def as_uint32(values):
+    '''
+    Return document numbers or term frequencies as a uint32 array, a view of the array the index holds when it is one.
+    '''
+    if isinstance(values, array.array):
+        return np.frombuffer(values, dtype=np.uint32)
+    return np.asarray(values).astype(np.uint32, copy=False)
+
+
+
+class AccumulatorScorer:
+    '''
+    Scores query vectors against one index. The postings of the terms that have been queried are
+    kept as uint32 arrays of document numbers and term frequencies, so they are only converted once,
+    up to cache_bytes of them (None keeps them all) and as much of their weights.
+    '''
+    def __init__(self, inverted_index, stored_impacts=None, cache_bytes=TERM_CACHE_BYTES):
+        self.index = inverted_index
+        self.stored_impacts = stored_impacts     # impacts.ImpactIndex written by build_index.py --impacts
+        self.doc_count = inverted_index['_M_']
+
+        if '_D_' in inverted_index:
+            self.documents = list(inverted_index['_D_'])
+        else:
+            # Indexes written before the document table was stored: number documents as they appear
+            self.documents = list(dict.fromkeys(doc_id for term, value in inverted_index.items() if not term.startswith('_') for _, doc_id in value[1]))
+        self.document_numbers = None    # docID -> document number, only needed for JSON postings
+        self.document_ranks = None      # document number -> position of the docID in sorted order, breaks ties
+        self.norms = {}                 # scheme -> array of document norms
+        self.postings = TermCache(cache_bytes)  # term -> (document numbers, term frequencies)
+        self.impacts = TermCache(cache_bytes)   # (term, scheme) -> array of the normalized weights of the term in its postings
+        self.skips = TermCache(cache_bytes)     # term -> skip pointers of its postings (see term_skips)
+        self.bounds = {}                # (term, scheme) -> largest weight of the term in any document, for the terms of the index
+        self.postings_scored = 0
+        self.postings_skipped = 0
+
+    def term_postings(self, term):
+        '''
+        Return the postings of a term as two parallel uint32 arrays: document numbers and term frequencies.
+        '''
+        postings = self.postings.get(term)
+        if postings is not None:
+            return postings
+        if term not in self.index:
+            # A shard of a sharded index (see sharding.py) only holds the terms of its own documents
+            return EMPTY_POSTINGS
+        if hasattr(self.index, 'postings_arrays'):
+            # Binary and compact indexes already store document numbers of the same document table
+            doc_numbers, term_frequencies = self.index.postings_arrays(term)
+            doc_numbers = as_uint32(doc_numbers)
+            term_frequencies = as_uint32(term_frequencies)
+        else:
+            if self.document_numbers is None:
+                self.document_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(self.documents)}
+            postings = self.index[term][1]
+            doc_numbers = np.fromiter((self.document_numbers[doc_id] for _, doc_id in postings), dtype=np.uint32, count=len(postings))
+            term_frequencies = np.fromiter((term_frequency for term_frequency, _ in postings), dtype=np.uint32, count=len(postings))
+        # Pruned retrieval looks documents up by binary search, which needs increasing document numbers
+        if np.any(doc_numbers[1:] < doc_numbers[:-1]):
+            order = np.argsort(doc_numbers, kind='stable')
+            doc_numbers = doc_numbers[order]
+            term_frequencies = term_frequencies[order]
+        postings = (doc_numbers, term_frequencies)
+        self.postings[term] = postings
+        return postings
+
+    def document_frequency(self, term):
+        '''
+        Return the DF of a term in the collection, which is the length of its postings unless the index is a shard.
+        '''
+        if term not in self.index:
+            return 0
+        # Shards store the DF of their terms in the whole collection under '_F_'
+        if '_F_' in self.index:
+            return self.index['_F_'][term]
+        return len(self.term_postings(term)[0])
+
+    def term_skips(self, term):
+        '''
+        Return the skip pointers of the postings of a term: every step-th document number, and the step,
+        about the square root of the length of the postings. A document is looked up in the skip pointers
+        first, then only in the block of postings between two of them.
+        '''
+        skips = self.skips.get(term)
+        if skips is None:
+            doc_numbers, _ = self.term_postings(term)
+            step = max(1, math.isqrt(len(doc_numbers)))
+            skips = (doc_numbers[::step].copy(), step)
+            if term in self.index:
+                self.skips[term] = skips
+        return skips
+
+    def tie_break_ranks(self):
+        '''
+        Return the rank of every document when sorted by docID, used to break ties between equal scores.
+        '''
+        if self.document_ranks is None:
+            ranks = np.empty(len(self.documents), dtype=np.int64)
+            ranks[sorted(range(len(self.documents)), key=self.documents.__getitem__)] = np.arange(len(self.documents))
+            self.document_ranks = ranks
+        return self.document_ranks
+
+    def document_norms(self, scheme):
+        '''
+        Return the lengths of the document vectors for a document weighting scheme (e.g. 'lt') as an array.
+        '''
+        if scheme not in self.norms:
+            if '_N_' not in self.index:
+                raise LookupError("The index has no document norms, rebuild it with build_index.py or convert_index.py")
+            norms = self.index['_N_'][scheme]
+            self.norms[scheme] = np.array([norms.get(doc_id, 0.0) for doc_id in self.documents], dtype=np.float64)
+        return self.norms[scheme]
+
+    def term_impacts(self, term, tf_scheme, df_scheme, normalization):
+        '''
+        Return the weight of a term in each document of its postings for a weighting scheme,
+        divided by the document norm for cosine normalization (0 for documents of norm 0).
+        '''
+        key = (term, tf_scheme + df_scheme + normalization)
+        weights = self.impacts.get(key)
+        if weights is None:
+            doc_numbers, _ = self.term_postings(term)
+            weights = self.posting_impacts(term, tf_scheme, df_scheme)
+            if normalization == "c":
+                norms = self.document_norms(tf_scheme + df_scheme)[doc_numbers]
+                weights = np.divide(weights, norms, out=np.zeros_like(weights), where=norms != 0)
+            if term in self.index:
+                self.impacts[key] = weights
+        return weights
+
+    def term_bound(self, term, tf_scheme, df_scheme, normalization):
+        '''
+        Return the largest weight of a term in any document for a weighting scheme, divided by the
+        document norm for cosine normalization. Uses the bounds stored by build_index.py under '_U_',
+        or computes them from the postings for indexes written without them.
+        '''
+        key = (term, tf_scheme + df_scheme + normalization)
+        if key not in self.bounds:
+            if '_U_' in self.index and term in self.index['_U_']["tf"]:
+                bounds = self.index['_U_']
+                df = df_weight(self.doc_count, self.document_frequency(term), df_scheme)
+                if normalization == "c":
+                    self.bounds[key] = bounds[tf_scheme + df_scheme][term] * df
+                else:
+                    self.bounds[key] = tf_weight(bounds["tf"][term], tf_scheme) * df
+            elif term in self.index:
+                impacts = self.term_impacts(term, tf_scheme, df_scheme, normalization)
+                self.bounds[key] = float(impacts.max()) if len(impacts) else 0.0
+            else:
+                return 0.0
+        return self.bounds[key]
+
+    def posting_impacts(self, term, tf_scheme, df_scheme):
+        '''
+        Return the weight of a term in each document of its postings (tf weight * df weight), read from
+        the impacts stored with the index when there are some instead of computed with log10.
+        '''
+        doc_numbers, term_frequencies = self.term_postings(term)
+        if self.stored_impacts is not None and term in self.stored_impacts:
+            return self.stored_impacts.term_impacts(term, len(doc_numbers), tf_scheme + df_scheme)
+        return self.posting_weights(term_frequencies, tf_scheme) * df_weight(self.doc_count, self.document_frequency(term), df_scheme)
+
+    @staticmethod
+    def posting_weights(term_frequencies, tf_scheme):
+        '''
+        Return the tf weights of an array of term frequencies.
+        '''
+        if tf_scheme == "l":
+            return np.log10(term_frequencies) + 1
+        return term_frequencies.astype(np.float64)
+
+    def score(self, query_vector, tf_scheme, df_scheme, normalization):
+        '''
+        Accumulates the scores of all documents one query term at a time.
+        Returns the score array and a mask of the documents that contain at least one query term.
+        '''
+        scores = np.zeros(len(self.documents), dtype=np.float64)
+        candidates = np.zeros(len(self.documents), dtype=bool)
+
+        postings_scanned = 0
+        with instrumentation.stage("score_postings"):
+            for term, query_weight in query_vector.items():
+                doc_numbers, _ = self.term_postings(term)
+                # A document appears once in the postings of a term, so fancy indexing adds correctly
+                scores[doc_numbers] += query_weight * self.posting_impacts(term, tf_scheme, df_scheme)
+                candidates[doc_numbers] = True
+                postings_scanned += len(doc_numbers)
+        self.postings_scored += postings_scanned
+        instrumentation.count("postings_scanned", postings_scanned)
+
+        if normalization == "c":
+            with instrumentation.stage("cosine_normalization"):
+                query_norm = math.sqrt(sum(value * value for value in query_vector.values()))
+                denominators = query_norm * self.document_norms(tf_scheme + df_scheme)
+                # Prevent division by zero, those documents score 0
+                np.divide(scores, denominators, out=scores, where=denominators != 0)
+                scores[denominators == 0] = 0
+
+        return scores, candidates
+
+    def top_k(self, query_vector, tf_scheme, df_scheme, normalization, k):
+        '''
+        Returns the k highest scoring documents as a list of (docID, score), sorted by decreasing score.
+        '''
+        scores, candidates = self.score(query_vector, tf_scheme, df_scheme, normalization)
+        with instrumentation.stage("select_top_k"):
+            doc_numbers = np.flatnonzero(candidates)
+            instrumentation.count("candidate_documents", len(doc_numbers))
+            return select_top_k(doc_numbers, scores[doc_numbers], k, self.documents, self.tie_break_ranks())
+
+    def top_k_pruned(self, query_vector, tf_scheme, df_scheme, normalization, k):
+        '''
+        Returns the same k documents and scores as top_k, without scoring postings that cannot reach the top k (MaxScore).
+        Terms are scored in decreasing order of their upper bound. Once the bounds of the remaining terms
+        add up to less than the k-th best score so far, no new document can reach the top k: the remaining
+        terms are only looked up, by binary search, for the candidates that can still reach it.
+        The scores of the last candidates are then added up again in query order, exactly like score().
+        '''
+        query_norm = 1
+        if normalization == "c":
+            query_norm = math.sqrt(sum(value * value for value in query_vector.values()))
+        if query_norm == 0:
+            return self.top_k(query_vector, tf_scheme, df_scheme, normalization, k)
+
+        scored_before, skipped_before = self.postings_scored, self.postings_skipped
+        with instrumentation.stage("score_postings"):
+            # Scores are compared with the bounds divided by the query norm, like the final scores
+            query_weights = {term: query_weight / query_norm for term, query_weight in query_vector.items()}
+            bounds = {term: query_weight * self.term_bound(term, tf_scheme, df_scheme, normalization) for term, query_weight in query_weights.items()}
+            order = sorted(query_weights, key=bounds.__getitem__, reverse=True)
+            # remaining[i]: largest score the terms from order[i] on can add to a document
+            remaining = list(itertools.accumulate(bounds[term] for term in reversed(order)))[::-1] + [0.0]
+
+            scores = np.zeros(len(self.documents), dtype=np.float64)
+            candidates = np.zeros(len(self.documents), dtype=bool)
+            threshold = 0.0     # never more than the k-th best score
+            position = 0
+            postings_scored = 0
+            next_threshold = 0  # the threshold costs as much to find as scoring postings, it is looked for each time they double
+            # Score whole postings lists while documents that are not candidates yet can still reach the top k
+            while position < len(order) and remaining[position] >= threshold * (1 - PRUNING_SLACK):
+                term = order[position]
+                doc_numbers, _ = self.term_postings(term)
+                scores[doc_numbers] += query_weights[term] * self.term_impacts(term, tf_scheme, df_scheme, normalization)
+                candidates[doc_numbers] = True
+                postings_scored += len(doc_numbers)
+                position += 1
+                # No score exceeds the bounds of the terms scored so far, the threshold cannot stop the loop before that
+                if postings_scored >= next_threshold and remaining[position] < remaining[0] - remaining[position]:
+                    # The k-th best score of the documents of this term is a lower bound of the k-th best score
+                    threshold = max(threshold, kth_largest(scores[doc_numbers], k))
+                    next_threshold = 2 * postings_scored
+            self.postings_scored += postings_scored
+
+            # Only look the remaining terms up for the candidates that can still reach the top k
+            doc_candidates = np.flatnonzero(candidates)
+            while True:
+                doc_numbers = self.term_postings(order[position])[0] if position < len(order) else []
+                # Pruning the candidates costs about as much as scoring a postings list of the same length
+                if position == len(order) or len(doc_candidates) <= len(doc_numbers):
+                    partial_scores = scores[doc_candidates]
+                    threshold = max(threshold, kth_largest(partial_scores, k))
+                    doc_candidates = doc_candidates[partial_scores + remaining[position] >= threshold * (1 - PRUNING_SLACK)]
+                if position == len(order):
+                    break
+
+                term = order[position]
+                impacts = self.term_impacts(term, tf_scheme, df_scheme, normalization)
+                if len(doc_numbers) <= LOOKUP_COST * len(doc_candidates):
+                    # Scoring the whole postings list is cheaper than looking the candidates up in it
+                    scores[doc_numbers] += query_weights[term] * impacts
+                    self.postings_scored += len(doc_numbers)
+                else:
+                    positions, found = lookup(doc_numbers, doc_candidates)
+                    scores[doc_candidates[found]] += query_weights[term] * impacts[positions[found]]
+                    matches = np.count_nonzero(found)
+                    self.postings_scored += matches
+                    self.postings_skipped += len(doc_numbers) - matches
+                position += 1
+
+            candidate_scores = self.score_candidates(query_vector, tf_scheme, df_scheme, normalization, doc_candidates)
+
+        instrumentation.count("postings_scanned", self.postings_scored - scored_before)
+        instrumentation.count("postings_skipped", self.postings_skipped - skipped_before)
+        instrumentation.count("candidate_documents", len(doc_candidates))
+
+        with instrumentation.stage("select_top_k"):
+            return select_top_k(doc_candidates, candidate_scores, k, self.documents, self.tie_break_ranks())
+
+    def score_candidates(self, query_vector, tf_scheme, df_scheme, normalization, doc_candidates):
+        '''
+        Return the exact scores of the candidate documents (sorted document numbers), with the same operations
+        in the same order as score(), looking the candidates up in the postings of every term.
+        '''
+        candidate_scores = np.zeros(len(doc_candidates), dtype=np.float64)
+        for term, query_weight in query_vector.items():
+            doc_numbers, _ = self.term_postings(term)
+            positions, found = lookup(doc_numbers, doc_candidates)
+            candidate_scores[found] += query_weight * self.posting_impacts(term, tf_scheme, df_scheme)[positions[found]]
+        if normalization == "c":
+            query_norm = math.sqrt(sum(value * value for value in query_vector.values()))
+            denominators = query_norm * self.document_norms(tf_scheme + df_scheme)[doc_candidates]
+            np.divide(candidate_scores, denominators, out=candidate_scores, where=denominators != 0)
+            candidate_scores[denominators == 0] = 0
+        return candidate_scores
+
+    def top_k_of(self, query_vector, tf_scheme, df_scheme, normalization, k, doc_candidates):
+        '''
+        Returns the k highest scoring documents among the candidates (sorted document numbers), e.g. the
+        documents that match a phrase query, with the scores top_k gives them.
+        '''
+        with instrumentation.stage("score_postings"):
+            candidate_scores = self.score_candidates(query_vector, tf_scheme, df_scheme, normalization, doc_candidates)
+        instrumentation.count("candidate_documents", len(doc_candidates))
+        with instrumentation.stage("select_top_k"):
+            return select_top_k(doc_candidates, candidate_scores, k, self.documents, self.tie_break_ranks())
+
+def kth_largest(values, k):
+    '''
+    Return the k-th largest value of an array, or 0 if it has fewer than k values (scores are never negative).
+    '''
+    if len(values) < k:
+        return 0.0
+    return float(np.partition(values, len(values) - k)[len(values) - k])
+
+def lookup(doc_numbers, doc_candidates):
+    '''
+    Finds candidate documents in the sorted document numbers of a postings list.
+    Returns the position of every candidate in the postings list and a mask of the candidates that are in it.
+    '''
+    positions = np.searchsorted(doc_numbers, doc_candidates)
+    positions[positions == len(doc_numbers)] = 0
+    found = doc_numbers[positions] == doc_candidates if len(doc_numbers) else np.zeros(len(doc_candidates), dtype=bool)
+    return positions, found
+
+def select_top_k(doc_numbers, candidate_scores, k, documents, document_ranks):
+    '''
+    Returns the k highest scoring candidates as a list of (docID, score), sorted by decreasing score.
+    Ties are ordered by decreasing docID, like the heap based ranking.
+    '''
+    if len(doc_numbers) > k:
+        # Keep every document that ties with the k-th best score, ties are broken below
+        kth_score = candidate_scores[np.argpartition(-candidate_scores, k - 1)[k - 1]]
+        keep = candidate_scores >= kth_score
+        doc_numbers = doc_numbers[keep]
+        candidate_scores = candidate_scores[keep]
+
+    # Sort by score, then docID, both decreasing
+    order = np.lexsort((document_ranks[doc_numbers], candidate_scores))[::-1][:k]
+    return [(documents[doc_number], score) for doc_number, score in zip(doc_numbers[order].tolist(), candidate_scores[order].tolist())]
+
+# Loaded state of the indexes that are plain dictionaries, which cannot hold it: index identity -> (index, state)
+dictionary_states = {}
+
+def index_state(inverted_index):
+    '''
+    Return the dictionary of what was loaded or built for an index: its scorer, positions and lexicon.
+    It is kept on the index itself, so it goes away with the index when the index is replaced, e.g. by a reload.
+    '''
+    attributes = getattr(inverted_index, '__dict__', None)
+    if attributes is not None:
+        return attributes.setdefault('_loaded', {})
+    entry = dictionary_states.get(id(inverted_index))
+    if entry is None or entry[0] is not inverted_index:
+        entry = dictionary_states[id(inverted_index)] = (inverted_index, {})
+    return entry[1]
+
+def release_index_state(inverted_index):
+    '''
+    Forgets the state of an index that is a plain dictionary once it is replaced. Other indexes release it themselves.
+    '''
+    entry = dictionary_states.get(id(inverted_index))
+    if entry is not None and entry[0] is inverted_index:
+        del dictionary_states[id(inverted_index)]
+
+def get_scorer(inverted_index, stored_impacts=None):
+    '''
+    Return the scorer of an index, creating it for the first query on that index.
+    Once given, the precomputed impacts of the index (see impacts.py) are used by every later query.
+    '''
+    state = index_state(inverted_index)
+    if 'scorer' not in state:
+        state['scorer'] = AccumulatorScorer(inverted_index)
+    scorer = state['scorer']
+    if stored_impacts is not None and scorer.stored_impacts is not stored_impacts:
+        scorer.stored_impacts = stored_impacts
+        # Quantized impacts differ from the computed weights
+        scorer.impacts.clear()
+    return scorer
@@ -0,0 +1,229 @@
+'''
+
+Delta segments of an index, used by update_index.py and query.py
+
+Documents added, replaced or deleted after build_index.py are not written into the index itself.
+Each update is stored in a small segment next to the index file:
+    <index file>.segments       JSON manifest: the segment files, oldest first
+    <index file>.seg<n>         JSON index of the added and replaced documents, with the docIDs
+                                deleted by the update under '_X_' (tombstones)
+
+A document is live in the newest layer (the index or a segment) that contains it, unless a newer
+segment deletes it. SegmentedIndex merges the layers when a term is looked up, so queries see the
+updated collection with the DF values, '_M_' and document norms of a full rebuild.
+"update_index.py <collection> merge" compacts the segments into the index.
+
+Writers hold an exclusive lock on <index file>.lock while they change the manifest, and readers a
+shared one while they load the layers, so a segment is never removed while it is being read.
+
+'''
+
+import fcntl
+import json
+import os
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+from weighting import compute_document_norms
+
+MANIFEST_EXTENSION = '.segments'
+SEGMENT_EXTENSION = '.seg'
+LOCK_EXTENSION = '.lock'
+# Held for the whole duration of a merge, so only one merge runs at a time
+MERGE_LOCK_EXTENSION = '.merge.lock'
+
+
+def get_manifest_path(index_path):
+    '''
+    Return the path of the segment manifest of an index file.
+    '''
+    return index_path + MANIFEST_EXTENSION
+
+@contextmanager
+def locked(index_path, shared=False, blocking=True, lock_extension=LOCK_EXTENSION):
+    '''
+    Hold a lock on the segments of an index file, raises BlockingIOError if it is taken and blocking is False.
+    '''
+    with open(index_path + lock_extension, 'a') as lock_file:
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def read_manifest(index_path):
+    '''
+    Return the manifest of an index file: {"next": number of the next segment, "segments": [file names]}
+    '''
+    manifest_path = get_manifest_path(index_path)
+    if not os.path.exists(manifest_path):
+        return {"next": 1, "segments": []}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+def write_manifest(index_path, manifest):
+    '''
+    Replace the manifest of an index file in one step, or remove it when no segments are left.
+    '''
+    manifest_path = get_manifest_path(index_path)
+    if not manifest["segments"]:
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        return
+    temporary_path = manifest_path + '.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(temporary_path, manifest_path)
+
+def segment_path(index_path, name):
+    '''
+    Return the path of a segment, which the manifest stores relative to the index file.
+    '''
+    return os.path.join(os.path.dirname(index_path), name)
+
+def add_segment(collection, index_path, segment):
+    '''
+    Writes a segment (term: [DF, postings], '_D_': docIDs, '_X_': deleted docIDs) after the existing
+    segments of an index file. Returns the number of segments.
+    '''
+    with locked(index_path):
+        manifest = read_manifest(index_path)
+        name = f'{os.path.basename(index_path)}{SEGMENT_EXTENSION}{manifest["next"]}'
+        collection.write_data(segment, segment_path(index_path, name), index_format="json")
+        manifest["segments"].append(name)
+        manifest["next"] += 1
+        write_manifest(index_path, manifest)
+    return len(manifest["segments"])
+
+def remove_segments(index_path, names=None):
+    '''
+    Removes segments of an index file (all of them by default), used once they are part of the index.
+    '''
+    if not os.path.exists(get_manifest_path(index_path)):
+        return
+    with locked(index_path):
+        drop_segments(index_path, names)
+
+def drop_segments(index_path, names=None):
+    '''
+    Removes segments of an index file from its manifest and deletes them, the caller holds the lock.
+    '''
+    manifest = read_manifest(index_path)
+    if names is None:
+        names = manifest["segments"]
+    manifest["segments"] = [name for name in manifest["segments"] if name not in names]
+    write_manifest(index_path, manifest)
+    for name in names:
+        if os.path.exists(segment_path(index_path, name)):
+            os.remove(segment_path(index_path, name))
+
+def read_layers(collection, index_path, compact=False):
+    '''
+    Reads an index file and its segments. Returns the index, the segments and the names of the segments.
+    With compact, a JSON index is read into a CompactIndex, the small segments are kept as dictionaries.
+    '''
+    with locked(index_path, shared=True):
+        names = read_manifest(index_path)["segments"]
+        main_index = collection.read_data(index_path, compact=compact)
+        segments = [collection.read_data(segment_path(index_path, name), index_format="json") for name in names]
+    return main_index, segments, names
+
+def open_index(collection, index_path, compact=False):
+    '''
+    Reads an index file, merged with its segments when it has been updated since it was built.
+    '''
+    if not os.path.exists(get_manifest_path(index_path)):
+        return collection.read_data(index_path, compact=compact)
+
+    main_index, segments, _ = read_layers(collection, index_path, compact)
+    if not segments:
+        return main_index
+    return SegmentedIndex(main_index, segments)
+
+class SegmentedIndex(Mapping):
+    '''
+    Read-only view of an index and its segments which behaves like the dictionary of a rebuilt index.
+    index[term] returns [DF, [[tf, docID], ...]] without the documents replaced or deleted by newer
+    segments, index['_M_'] the number of live documents, index['_D_'] their document table and
+    index['_N_'] their norms, which are computed the first time they are needed.
+    '''
+    def __init__(self, main_index, segments):
+        if '_D_' not in main_index:
+            raise LookupError("The index has no document table, rebuild it with build_index.py or convert_index.py")
+        self.layers = [main_index] + list(segments)
+
+        # Documents of every layer hidden by a newer segment that replaces or deletes them
+        self.hidden = [None] * len(self.layers)
+        shadowed = set()
+        for position in range(len(self.layers) - 1, -1, -1):
+            layer = self.layers[position]
+            self.hidden[position] = {doc_id for doc_id in layer['_D_'] if doc_id in shadowed}
+            shadowed.update(layer['_D_'])
+            shadowed.update(layer.get('_X_', []))
+
+        documents = [doc_id for layer, hidden in zip(self.layers, self.hidden) for doc_id in layer['_D_'] if doc_id not in hidden]
+        self.metadata = {'_M_': len(documents), '_D_': documents}
+        self.norms = None
+        self.terms = None
+
+    def postings(self, term):
+        '''
+        Return the live postings of a term in document table order, an empty list if it has none.
+        '''
+        postings = []
+        for layer, hidden in zip(self.layers, self.hidden):
+            if term in layer:
+                layer_postings = layer[term][1]
+                if hidden:
+                    layer_postings = [posting for posting in layer_postings if posting[1] not in hidden]
+                postings.extend(layer_postings)
+        return postings
+
+    def vocabulary(self):
+        '''
+        Return every term with at least one live posting.
+        '''
+        if self.terms is None:
+            candidates = dict.fromkeys(term for layer in self.layers for term in layer.keys() if not term.startswith('_'))
+            # A term can only lose all its postings in layers that hide documents
+            self.terms = [term for term in candidates
+                          if any(term in layer and not hidden for layer, hidden in zip(self.layers, self.hidden)) or self.postings(term)]
+        return self.terms
+
+    def document_norms(self):
+        '''
+        Return the norms of the live documents, which depend on the DF of every term and the document count.
+        '''
+        if self.norms is None:
+            index = {term: self[term] for term in self.vocabulary()}
+            index['_M_'] = self.metadata['_M_']
+            self.norms = compute_document_norms(index)
+        return self.norms
+
+    def __getitem__(self, key):
+        if key in self.metadata:
+            return self.metadata[key]
+        if key == '_N_':
+            return self.document_norms()
+        postings = self.postings(key) if not key.startswith('_') else []
+        if not postings:
+            raise KeyError(key)
+        return [len(postings), postings]
+
+    def __contains__(self, key):
+        if key in self.metadata or key == '_N_':
+            return True
+        if key.startswith('_'):
+            return False
+        return any(key in layer for layer in self.layers) and bool(self.postings(key))
+
+    def __iter__(self):
+        yield from self.vocabulary()
+        yield from self.metadata
+        yield '_N_'
+
+    def __len__(self):
+        return len(self.vocabulary()) + len(self.metadata) + 1
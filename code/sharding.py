@@ -0,0 +1,350 @@
+'''
+
+Document-partitioned shards of an index and the coordinator that answers queries from them,
+used by build_index.py --shards and query.py --sharded
+
+build_index.py --shards N splits every index into N shards of consecutive documents, written next to it
+in the same format:
+    <index name>.shard<i>.<extension>   index of the documents of shard i, which also stores the statistics of
+                                        the whole collection: '_M_' is its document count, '_F_' the DF of every
+                                        term of the shard, and '_N_' holds the norms of the documents of the
+                                        shard computed with them
+    <index file>.shards                 JSON manifest: the shard files, the document count and the vocabulary
+
+A shard therefore weights its postings exactly like the whole index, and the top k of the collection are
+the k best of the top k of every shard. ShardCoordinator scatters every query vector to the shards in
+parallel and merges their answers, ranked like scoring.select_top_k (by score, then by docID). Shards are reached through:
+    LocalShard      the shard loaded in the coordinator process, a stand-in for the other two in tests
+    ProcessShard    a worker process that loads the shard once, so a query uses one core per shard
+    RemoteShard     a shard server on another node, started with
+                    python3 ./code/sharding.py <collection> <l|s> <shard number> --port <port>
+
+Shards are written by build_index.py only, rebuild them after update_index.py.
+
+Input of the shard server (in order):
+    collection name, tokenization, shard number
+    Optional: --format, --host, --port
+
+'''
+
+import array
+import heapq
+import itertools
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import collection_object
+from binary_index import UINT32
+from compact_index import CompactIndex
+from compact_index import TermEntry
+from scoring import get_scorer
+from weighting import compute_term_bounds
+
+MANIFEST_EXTENSION = '.shards'
+
+
+def get_manifest_path(index_path):
+    '''
+    Return the path of the shard manifest of an index file.
+    '''
+    return index_path + MANIFEST_EXTENSION
+
+def get_shard_path(index_path, shard_number):
+    '''
+    Return the path of a shard of an index file, e.g. <name>.shard0.json next to <name>.json.
+    '''
+    root, extension = os.path.splitext(index_path)
+    return f'{root}.shard{shard_number}{extension}'
+
+def read_manifest(index_path):
+    '''
+    Return the shard manifest of an index file: {"shards": [file names], "documents": M, "terms": [vocabulary]}
+    '''
+    with open(get_manifest_path(index_path), 'r') as file:
+        return json.load(file)
+
+def partition_index(index, shard_count):
+    '''
+    Splits a finished index into shard_count shards of consecutive documents of its document table.
+    Returns a list of CompactIndex, each with the postings and norms of its documents and the
+    document count and DF of the whole collection.
+    '''
+    if not isinstance(index, CompactIndex):
+        compact = CompactIndex()
+        for key, value in index.items():
+            compact[key] = value
+        index = compact
+
+    documents = index['_D_']
+    shard_size = -(-len(documents) // shard_count) if documents else 1
+    shards = [CompactIndex(documents[start:start + shard_size]) for start in range(0, shard_size * shard_count, shard_size)]
+    frequencies = [{} for _ in shards]
+
+    for term, entry in index.entries.items():
+        doc_numbers, term_frequencies = index.postings_arrays(term)
+        doc_numbers = np.frombuffer(doc_numbers, dtype=np.uint32)
+        term_frequencies = np.frombuffer(term_frequencies, dtype=np.uint32)
+        shard_numbers = doc_numbers // shard_size
+        for shard_number in np.unique(shard_numbers).tolist():
+            mask = shard_numbers == shard_number
+            # Document numbers of a shard start at 0
+            shard_doc_numbers = (doc_numbers[mask] - shard_number * shard_size).astype(np.uint32)
+            shards[shard_number].entries[term] = TermEntry(len(shard_doc_numbers), array.array(UINT32, shard_doc_numbers.tobytes()),
+                                                           array.array(UINT32, term_frequencies[mask].tobytes()))
+            frequencies[shard_number][term] = entry.document_frequency
+
+    for shard, shard_frequencies in zip(shards, frequencies):
+        shard['_M_'] = index['_M_']
+        shard['_D_'] = shard.documents
+        shard['_N_'] = {scheme: {doc_id: norms[doc_id] for doc_id in shard.documents if doc_id in norms} for scheme, norms in index['_N_'].items()}
+        # Upper bounds of the weights of the terms in the documents of the shard
+        shard['_U_'] = compute_term_bounds(shard, shard['_N_'])
+        shard['_F_'] = shard_frequencies
+    return shards
+
+def write_shards(collection, index, index_path, shard_count, index_format=None):
+    '''
+    Writes the shards of a finished index next to its file and their manifest. Returns the shard paths.
+    '''
+    remove_shards(collection, index_path)
+    shard_paths = []
+    for shard_number, shard in enumerate(partition_index(index, shard_count)):
+        shard_paths.append(get_shard_path(index_path, shard_number))
+        collection.write_data(shard, shard_paths[-1], index_format)
+
+    manifest = {
+        "shards": [os.path.basename(shard_path) for shard_path in shard_paths],
+        "documents": index['_M_'],
+        "terms": [term for term in index.keys() if not term.startswith('_')]
+    }
+    with open(get_manifest_path(index_path), 'w') as file:
+        json.dump(manifest, file)
+    return shard_paths
+
+def remove_shards(collection, index_path):
+    '''
+    Removes the shards of an index file and their manifest, if it has any.
+    '''
+    manifest_path = get_manifest_path(index_path)
+    if not os.path.exists(manifest_path):
+        return
+    for name in read_manifest(index_path)["shards"]:
+        for path in collection.get_index_files(os.path.join(os.path.dirname(index_path), name)):
+            if os.path.exists(path):
+                os.remove(path)
+    os.remove(manifest_path)
+
+def answer_shard(index, request):
+    '''
+    Answers a request of the coordinator with the top k documents of one shard, a list of (docID, score).
+    The request holds the query vector, the weighting scheme, k and whether to prune.
+    '''
+    tf_scheme, df_scheme, normalization = request["scheme"]
+    scorer = get_scorer(index)
+    if request.get("pruning"):
+        return scorer.top_k_pruned(request["query_vector"], tf_scheme, df_scheme, normalization, request["k"])
+    return scorer.top_k(request["query_vector"], tf_scheme, df_scheme, normalization, request["k"])
+
+def merge_answers(shard_answers, k):
+    '''
+    Merges the top k of every shard into the top k of the collection, sorted by decreasing score
+    with ties ordered by decreasing docID, like scoring.select_top_k.
+    '''
+    return [tuple(answer) for answer in heapq.nlargest(k, itertools.chain.from_iterable(shard_answers), key=lambda answer: (answer[1], answer[0]))]
+
+class LocalShard:
+    '''
+    Shard index held by the coordinator process.
+    '''
+    def __init__(self, index):
+        self.index = index
+
+    def answer(self, request):
+        return answer_shard(self.index, request)
+
+    def close(self):
+        pass
+
+def serve_process(connection, shard_path, index_format):
+    '''
+    Loads a shard and answers the requests sent through a pipe until it receives None.
+    '''
+    index = collection_object.Collection().read_data(shard_path, index_format, compact=True)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        try:
+            connection.send(answer_shard(index, request))
+        except Exception as error:
+            connection.send(error)
+    connection.close()
+
+class ProcessShard:
+    '''
+    Shard loaded and scored by a worker process of this machine, one request at a time.
+    '''
+    def __init__(self, shard_path, index_format=None):
+        import multiprocessing
+
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve_process, args=(child_connection, shard_path, index_format), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.lock = threading.Lock()
+
+    def answer(self, request):
+        with self.lock:
+            self.connection.send(request)
+            response = self.connection.recv()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        with self.lock:
+            self.connection.send(None)
+            self.process.join()
+            self.connection.close()
+
+class RemoteShard:
+    '''
+    Shard served over HTTP by a shard server (POST /shard with the request as JSON).
+    '''
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip('/') + '/shard'
+        self.timeout = timeout
+
+    def answer(self, request):
+        from urllib.request import Request
+        from urllib.request import urlopen
+
+        http_request = Request(self.url, data=json.dumps(request).encode(), headers={"Content-Type": "application/json"})
+        with urlopen(http_request, timeout=self.timeout) as response:
+            content = json.load(response)
+        if "error" in content:
+            raise ValueError(content["error"])
+        return [tuple(answer) for answer in content["answers"]]
+
+    def close(self):
+        pass
+
+class ShardCoordinator:
+    '''
+    Answers queries from the shards of an index: scatters the query vector to every shard in parallel and
+    merges their top k. Has the top_k and top_k_pruned methods of a scorer, and "term in coordinator"
+    tells whether a term is in the vocabulary of the collection, so query.tokenize_and_answer takes it as an index.
+    '''
+    def __init__(self, shards, document_count, vocabulary):
+        self.shards = list(shards)
+        self.doc_count = document_count
+        self.vocabulary = set(vocabulary)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.shards))
+
+    def __contains__(self, term):
+        return term in self.vocabulary
+
+    def answer(self, query_vector, tf_scheme, df_scheme, normalization, k, pruning=False):
+        '''
+        Returns the k highest scoring documents of the collection as a list of (docID, score), sorted by decreasing score.
+        '''
+        request = {"query_vector": query_vector, "scheme": tf_scheme + df_scheme + normalization, "k": k, "pruning": pruning}
+        futures = [self.executor.submit(shard.answer, request) for shard in self.shards]
+        return merge_answers([future.result() for future in futures], k)
+
+    def top_k(self, query_vector, tf_scheme, df_scheme, normalization, k):
+        return self.answer(query_vector, tf_scheme, df_scheme, normalization, k)
+
+    def top_k_pruned(self, query_vector, tf_scheme, df_scheme, normalization, k):
+        return self.answer(query_vector, tf_scheme, df_scheme, normalization, k, pruning=True)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self.executor.shutdown()
+
+def open_coordinator(collection, index_path, transport="process", urls=None, index_format=None):
+    '''
+    Return the coordinator of the shards of an index file, reached through worker processes ("process"),
+    loaded in this process ("local"), or served at the given URLs, in shard order ("remote").
+    '''
+    if not os.path.exists(get_manifest_path(index_path)):
+        raise LookupError(f'{index_path} has no shards, build them with build_index.py --shards')
+    manifest = read_manifest(index_path)
+    shard_paths = [os.path.join(os.path.dirname(index_path), name) for name in manifest["shards"]]
+
+    if transport == "remote":
+        if len(urls) != len(shard_paths):
+            raise ValueError(f'{index_path} has {len(shard_paths)} shards, {len(urls)} shard URLs were given')
+        shards = [RemoteShard(url) for url in urls]
+    elif transport == "local":
+        shards = [LocalShard(collection.read_data(shard_path, index_format, compact=True)) for shard_path in shard_paths]
+    else:
+        shards = [ProcessShard(shard_path, index_format) for shard_path in shard_paths]
+    return ShardCoordinator(shards, manifest["documents"], manifest["terms"])
+
+def make_shard_server(address, index):
+    '''
+    Return an HTTP server that answers the requests of a coordinator with the top k of one shard.
+    '''
+    from http.server import BaseHTTPRequestHandler
+    from http.server import ThreadingHTTPServer
+
+    class ShardRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/shard':
+                self.send_json(404, {"error": f'Unknown path {self.path}'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                answers = answer_shard(index, request)
+            except Exception as error:
+                self.send_json(400, {"error": str(error)})
+                return
+            self.send_json(200, {"answers": answers})
+
+        def send_json(self, status, content):
+            body = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(address, ShardRequestHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    '''
+    main() function: serves one shard to a coordinator on another node
+    '''
+    import query
+
+    collection = collection_object.Collection()
+    args = collection.parse_shard_server_inputs()
+    index_path = query.get_index_path(collection, args.collection, args.tokenization, args.format)
+    shard_path = get_shard_path(index_path, args.shard)
+    if not os.path.exists(shard_path):
+        print(f'There is no shard at {shard_path}, build the shards with build_index.py --shards', file=sys.stderr)
+        exit(1)
+
+    server = make_shard_server((args.host, args.port), collection.read_data(shard_path, args.format, compact=True))
+    print(f'Serving {shard_path} on http://{args.host}:{args.port}/shard')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    exit(0)
@@ -0,0 +1,189 @@
+'''
+
+Bounded-memory index construction, used by build_index.py --memory-limit
+
+The documents are streamed from the corpus file in batches and indexed into partial indexes in memory.
+Whenever the postings held in memory reach the limit, every partial index is spilled to a run file
+on disk. At the end, the runs of each index are k-way merged term by term and the index is written
+while the document frequencies and norms are computed, so only the vocabulary, the document table
+and one postings list at a time are kept besides the partial indexes.
+
+Runs are sorted by the position at which each term first appears in the collection rather than
+alphabetically, so the written indexes are identical to the ones built in memory, down to the
+floating point sums of the norms.
+
+'''
+
+import heapq
+import itertools
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from build_index import SHARDS_PER_WORKER
+from build_index import index_shard
+from build_index import merge_shards
+from impacts import ImpactWriter
+from impacts import impact_items
+from weighting import DOCUMENT_SCHEMES
+from weighting import add_term_bounds
+from weighting import add_term_norms
+from weighting import finish_document_norms
+
+# Estimated memory of one posting in a partial index ([tf, docID] list, its slot in the postings list, term overhead)
+POSTING_BYTES = 100
+# Number of documents read from the corpus file at a time
+BATCH_DOCUMENTS = 256
+
+
+class SpillingIndexer:
+    '''
+    Builds the index of one normalization from partial indexes, spilling them to sorted runs on disk.
+    '''
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.ranks = {}         # term -> position of its first appearance in the collection
+        self.postings = {}      # term -> postings of the documents indexed since the last spill
+        self.posting_count = 0
+        self.runs = []          # paths of the spilled runs, in document order
+
+    def add(self, partial_index):
+        '''
+        Adds the partial index of the next documents (term: [DF, postings]).
+        '''
+        for term, value in partial_index.items():
+            if term not in self.ranks:
+                self.ranks[term] = len(self.ranks)
+            if term in self.postings:
+                self.postings[term].extend(value[1])
+            else:
+                self.postings[term] = value[1]
+            self.posting_count += len(value[1])
+
+    def sorted_entries(self):
+        '''
+        Return the postings in memory as [rank, term, postings], sorted by rank.
+        '''
+        ranks = self.ranks
+        return sorted(([ranks[term], term, postings] for term, postings in self.postings.items()), key=lambda entry: entry[0])
+
+    def spill(self):
+        '''
+        Writes the postings in memory to a new run file, one JSON entry per line, and clears them.
+        '''
+        if not self.postings:
+            return
+        path = os.path.join(self.directory, f'{self.name}.run{len(self.runs)}')
+        with open(path, 'w') as file:
+            for entry in self.sorted_entries():
+                file.write(json.dumps(entry))
+                file.write('\n')
+        self.runs.append(path)
+        self.postings = {}
+        self.posting_count = 0
+
+    def merged_postings(self):
+        '''
+        Merges the runs and the postings still in memory. Yields (term, postings) in order of first appearance.
+        '''
+        files = [open(path, 'r') for path in self.runs]
+        try:
+            runs = [map(json.loads, file) for file in files]
+            # The postings in memory belong to the last documents, so they form the last run
+            runs.append(iter(self.sorted_entries()))
+            # Entries of the same term are merged in run order, which is document order
+            merged = heapq.merge(*runs, key=lambda entry: entry[0])
+            for _, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+                entries = list(entries)
+                term = entries[0][1]
+                if len(entries) == 1:
+                    yield term, entries[0][2]
+                else:
+                    yield term, [posting for entry in entries for posting in entry[2]]
+        finally:
+            for file in files:
+                file.close()
+
+    def items(self, documents):
+        '''
+        Yields the (key, value) items of the finished index in the order of build_index.finish_index:
+        every term with its DF and postings, then '_M_', '_D_', '_N_' and '_U_'.
+        '''
+        doc_count = len(documents)
+        squared_sums = {scheme: {} for scheme in DOCUMENT_SCHEMES}
+        for term, postings in self.merged_postings():
+            add_term_norms(squared_sums, doc_count, len(postings), postings)
+            yield term, [len(postings), postings]
+
+        yield '_M_', doc_count
+        yield '_D_', documents
+        norms = finish_document_norms(squared_sums)
+        yield '_N_', norms
+
+        # Term bounds need the norms, the runs are merged a second time
+        bounds = {"tf": {}}
+        bounds.update({scheme: {} for scheme in DOCUMENT_SCHEMES})
+        for term, postings in self.merged_postings():
+            add_term_bounds(bounds, term, postings, norms)
+        yield '_U_', bounds
+
+def batches(documents, size):
+    '''
+    Splits an iterable of (docID, text) into lists of up to size documents.
+    '''
+    documents = iter(documents)
+    while True:
+        batch = list(itertools.islice(documents, size))
+        if not batch:
+            return
+        yield batch
+
+def write_indexes_streaming(collection, documents, output_paths, memory_limit, workers=1, spill_directory=None, quantization=None):
+    '''
+    Builds and writes one index per normalization (output_paths is a dictionary of normalization: path)
+    from an iterable of (docID, text) with unique docIDs, keeping the postings in memory under memory_limit bytes.
+    With a quantization, the impacts of every index are written with it (see impacts.py).
+    Returns the document count and the number of runs spilled per index.
+    '''
+    normalizations = list(output_paths.keys())
+    max_postings = max(1, memory_limit // POSTING_BYTES)
+    doc_ids = []
+    seen = set()
+
+    with tempfile.TemporaryDirectory(dir=spill_directory) as directory:
+        indexers = {normalization: SpillingIndexer(directory, normalization) for normalization in normalizations}
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            for batch in batches(documents, BATCH_DOCUMENTS * max(1, workers)):
+                if executor is not None:
+                    shard_size = max(1, -(-len(batch) // (workers * SHARDS_PER_WORKER)))
+                    shards = [batch[start:start + shard_size] for start in range(0, len(batch), shard_size)]
+                    # Postings lists are spilled as they are, the batches are too small to gain from compact indexes
+                    shard_indexes = list(executor.map(index_shard, shards, [normalizations] * len(shards), [False] * len(shards)))
+                else:
+                    shard_indexes = [index_shard(batch, normalizations, compact=False)]
+
+                for doc_id, _ in batch:
+                    if doc_id in seen:
+                        raise ValueError(f'Document {doc_id} appears more than once in the corpus')
+                    seen.add(doc_id)
+                    doc_ids.append(doc_id)
+                for normalization, indexer in indexers.items():
+                    indexer.add(merge_shards([shard_index[normalization] for shard_index in shard_indexes]))
+
+                if sum(indexer.posting_count for indexer in indexers.values()) >= max_postings:
+                    for indexer in indexers.values():
+                        indexer.spill()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        for normalization, indexer in indexers.items():
+            items = indexer.items(doc_ids)
+            if quantization is not None:
+                items = impact_items(items, ImpactWriter(output_paths[normalization], doc_ids, quantization))
+            collection.write_index_items(items, doc_ids, output_paths[normalization])
+
+        return len(doc_ids), {normalization: len(indexer.runs) for normalization, indexer in indexers.items()}
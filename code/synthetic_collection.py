@@ -0,0 +1,137 @@
+'''
+
+Generates a synthetic test collection in the format of the collections folder (.ALL, .QRY and .REL),
+used by the speed and memory benchmarks (see benchmark.py scaling) at sizes the real collections do not reach.
+
+The words are made up lowercase words drawn from a vocabulary with Zipfian frequencies: the word of
+rank r appears in proportion to 1 / r^s, like the words of natural language. Document lengths vary
+around the requested length. Every query is made of words of medium frequency, and its relevant
+documents are drawn at random and contain every word of the query, so the collection can also be evaluated.
+
+Input (in order):
+    name of the collection,
+    Optional: --documents, --vocabulary, --length, --zipf, --queries, --query-length, --relevant, --seed
+
+Output:
+    collections/<name>.ALL, collections/<name>.QRY and collections/<name>.REL
+
+The program will be run from the root of the repository.
+
+'''
+
+import os
+import sys
+
+import numpy as np
+
+CONSONANTS = "bcdfghjklmnprstvz"
+VOWELS = "aeiou"
+# Number of documents generated and written at a time
+BATCH_DOCUMENTS = 10000
+
+
+def make_vocabulary(size):
+    '''
+    Return size distinct made-up words, the word of rank r spells r with syllables (a consonant and a vowel).
+    Frequent words are the shortest ones, like in natural language.
+    '''
+    syllables = [consonant + vowel for consonant in CONSONANTS for vowel in VOWELS]
+    words = []
+    for rank in range(size):
+        # Every word has at least two syllables, single syllables are too close to stopwords
+        number = rank + len(syllables)
+        word = []
+        while number > 0:
+            number, syllable = divmod(number, len(syllables))
+            word.append(syllables[syllable])
+        words.append(''.join(reversed(word)))
+    return np.array(words, dtype=object)
+
+def zipf_probabilities(size, exponent):
+    '''
+    Return the probability of every rank of a vocabulary of size words under Zipf's law.
+    '''
+    weights = 1 / np.arange(1, size + 1, dtype=np.float64) ** exponent
+    return weights / weights.sum()
+
+def make_queries(vocabulary, document_count, query_count, query_length, relevant, rng):
+    '''
+    Draws the words of every query among the words of medium frequency (ranks 1% to 10% of the vocabulary)
+    and its relevant documents. Returns the queries (query ID: text) and the judgements (query ID: [docID, ...]).
+    '''
+    low = max(1, len(vocabulary) // 100)
+    high = max(low + query_length, len(vocabulary) // 10)
+    queries = {}
+    answers = {}
+    for query_id in range(1, query_count + 1):
+        words = vocabulary[rng.choice(np.arange(low, min(high, len(vocabulary))), size=query_length, replace=False)]
+        queries[query_id] = ' '.join(words)
+        doc_numbers = rng.choice(document_count, size=min(relevant, document_count), replace=False)
+        answers[query_id] = sorted(int(doc_number) + 1 for doc_number in doc_numbers)
+    return queries, answers
+
+def write_collection(path_prefix, document_count, vocabulary_size=50000, length=100, zipf=1.1,
+                     query_count=100, query_length=5, relevant=20, seed=361):
+    '''
+    Writes a synthetic collection to path_prefix + '.ALL', '.QRY' and '.REL', the documents in batches
+    so that collections of millions of documents are never held in memory.
+    Returns the number of words written to the documents.
+    '''
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(vocabulary_size)
+    probabilities = zipf_probabilities(vocabulary_size, zipf)
+    queries, answers = make_queries(vocabulary, document_count, query_count, query_length, relevant, rng)
+
+    # Words of the queries each relevant document contains
+    injected = {}
+    for query_id, doc_ids in answers.items():
+        for doc_id in doc_ids:
+            injected.setdefault(doc_id, []).append(queries[query_id])
+
+    word_count = 0
+    with open(path_prefix + '.ALL', 'w') as file:
+        for start in range(0, document_count, BATCH_DOCUMENTS):
+            batch_size = min(BATCH_DOCUMENTS, document_count - start)
+            lengths = np.maximum(rng.poisson(length, size=batch_size), 1)
+            words = vocabulary[rng.choice(vocabulary_size, size=int(lengths.sum()), p=probabilities)]
+            offsets = np.concatenate(([0], np.cumsum(lengths)))
+            lines = []
+            for position in range(batch_size):
+                doc_id = start + position + 1
+                text = ' '.join(words[offsets[position]:offsets[position + 1]])
+                if doc_id in injected:
+                    text = ' '.join([text] + injected[doc_id])
+                lines.append(f'.I {doc_id}\n.W\n{text}\n')
+            file.write(''.join(lines))
+            word_count += int(lengths.sum())
+
+    with open(path_prefix + '.QRY', 'w') as file:
+        for query_id, text in queries.items():
+            file.write(f'.I {query_id}\n.W\n{text}\n')
+
+    with open(path_prefix + '.REL', 'w') as file:
+        for query_id, doc_ids in answers.items():
+            for doc_id in doc_ids:
+                file.write(f'\t{query_id}\t{doc_id}\n')
+    return word_count
+
+
+if __name__ == "__main__":
+    '''
+    main() function
+    '''
+    import collection_object
+
+    collection = collection_object.Collection()
+    args = collection.parse_synthetic_inputs()
+    path_prefix = os.path.join('collections', args.collection)
+    if os.path.exists(path_prefix + '.ALL'):
+        print(f'The collection "{args.collection}" already exists', file=sys.stderr)
+        exit(1)
+
+    word_count = write_collection(path_prefix, args.documents, args.vocabulary, args.length, args.zipf,
+                                  args.queries, args.query_length, args.relevant, args.seed)
+    print(f'{args.documents} documents ({word_count} words), {args.queries} queries written to {path_prefix}.ALL, .QRY and .REL')
+    print("SUCCESS")
+
+    exit(0)
@@ -1,66 +1,211 @@
 '''
 
-Uses "test_scheme.py" to iterate over all possible scheme combinations and collect MMR and MAP scores.
-Collects the outputs and uses that data to populate an excel sheet which it stores into a "results" folder as "evaluation_results.xlsx"
+Evaluates every combination of evaluation metric, text normalization and weighting scheme (the grid)
+and collects the MRR and MAP scores into an excel sheet, which it stores into a "results" folder as "evaluation_results.xlsx"
+
+Every cell evaluates the same sample of judged queries, drawn with a fixed seed so scores of different
+cells can be compared. Each index is loaded and the sampled queries are normalized once, in this process,
+and each cell answers its queries with one sparse matrix product (see test_scheme.py --matrix), or
+one query at a time with the accumulator scoring when scipy is not installed.
+The cells are spread over a pool of worker processes forked after the indexes are loaded, which
+share them instead of reading them again.
+
+Input (all optional):
+    collection name (CISI_simplified by default),
+    --k, --n or --all-queries, --seed, --baseline, --workers, --format
+
+Output:
+    the score and time of every cell with the p-value of a paired randomization test against
+    the baseline scheme (see evaluation.py), the total wall time, and the excel sheet
+
+The program will be run from the root of the repository.
 
 '''
 
-import subprocess
+import argparse
+import multiprocessing
 import os
-import pandas as pd
+import random
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from evaluation import Qrels
+from evaluation import evaluate
+from evaluation import randomization_test
 
-# Initialize and validate file paths
-evaluation_program_path = "./code/test_scheme.py"
-collection_name = "CISI_simplified"
 weightings = ["nnn", "nnc", "ntn", "ntc", "lnn", "lnc", "ltn", "ltc"]
 tokenizations = ["l", "s"]
-k_results = "100"
-n_queries = "10"
-evaluations = ['map', 'mrr']  # Keep single quotes for subprocess
+evaluations = ['map', 'mrr']
+
+# Loaded before the workers are forked: tokenization -> (MatrixRetriever, query vectors), the sampled queries and the judgements
+grid = {}
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Evaluate every weighting scheme and text normalization with MRR and MAP.')
+    parser.add_argument('collection', type=str, nargs='?', default="CISI_simplified", help='Name of the collection')
+    parser.add_argument('--k', type=int, default=100, help='Number of results to return for each query')
+    parser.add_argument('--n', type=int, default=10, help='Number of queries in the sample evaluated by every cell')
+    parser.add_argument('--all-queries', action='store_true', help='Evaluate every judged query in the .QRY file instead of a sample')
+    parser.add_argument('--seed', type=int, default=361, help='Seed of the query sample')
+    parser.add_argument('--baseline', choices=weightings, default="ltc", help='Weighting scheme the others are tested against (paired randomization test)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes that evaluate cells')
+    parser.add_argument('--format', choices=['json', 'binary', 'compressed'], default='json', help='On-disk format of the indexes')
+    return parser.parse_args()
+
+def sample_queries(collection_name, n, seed, all_queries=False):
+    '''
+    Returns the judged queries evaluated by every cell as a list of (query ID, text), and the judgements.
+    '''
+    from utils import read_queries, read_answers
+
+    queries = read_queries(f"./collections/{collection_name}.QRY")
+    answers = read_answers(f"./collections/{collection_name}.REL")
+    # Queries without relevance judgements cannot be scored
+    judged_queries = [(query_id, query_text) for query_id, query_text in queries.items() if int(query_id) in answers]
+    if all_queries:
+        return judged_queries, answers
+    return random.Random(seed).sample(judged_queries, min(n, len(judged_queries))), answers
+
+class ScorerRetriever:
+    '''
+    Answers a batch of query vectors one at a time with the accumulator scoring, like MatrixRetriever without scipy.
+    '''
+    def __init__(self, inverted_index):
+        from scoring import get_scorer
+
+        self.scorer = get_scorer(inverted_index)
+
+    def term_document_matrix(self, tf_scheme, df_scheme):
+        # Nothing is built in advance, the weights of the postings are computed for the first query on them
+        return None
+
+    def top_k(self, query_vectors, tf_scheme, df_scheme, normalization, k):
+        return [self.scorer.top_k(query_vector, tf_scheme, df_scheme, normalization, k) for query_vector in query_vectors]
+
+def load_grid(collection_name, selected_queries, answers, index_format="json"):
+    '''
+    Loads the index of every text normalization and normalizes the sampled queries with it.
+    '''
+    import preprocessing
+    import query
+    from collection_object import Collection
+    try:
+        from batch_retrieval import MatrixRetriever
+    except ImportError:
+        # scipy is optional, the scores are the same
+        print("scipy is not installed, the queries are answered one at a time", file=sys.stderr)
+        MatrixRetriever = ScorerRetriever
+
+    collection = Collection()
+    preprocessing_methods = {tokenization: Collection.tokenization(tokenization) for tokenization in tokenizations}
+    preprocessing.check_resources(list(preprocessing_methods.values()))
+
+    for tokenization, preprocessing_method in preprocessing_methods.items():
+        inverted_index = query.load_index(collection, collection_name, preprocessing_method, index_format)
+        query_vectors = []
+        for _, query_text in selected_queries:
+            try:
+                query_vectors.append(query.build_query_vector(query_text, preprocessing_method, inverted_index))
+            except ValueError:
+                # "query.py" prints no results when a query term is not in the vocabulary
+                query_vectors.append({})
+
+        retriever = MatrixRetriever(inverted_index)
+        # Matrices built now are shared by every worker
+        for weighting in weightings:
+            retriever.term_document_matrix(weighting[0], weighting[1])
+        grid[tokenization] = (retriever, query_vectors)
+
+    grid["queries"] = selected_queries
+    grid["qrels"] = Qrels(answers)
+
+def evaluate_cell(cell, k):
+    '''
+    Answers the sampled queries for one cell (evaluation metric, tokenization, weighting) and scores them.
+    Returns the cell, the score of every query and the time it took.
+    '''
+    start_time = time.perf_counter()
+    eval_metric, tokenization, weighting = cell
+    retriever, query_vectors = grid[tokenization]
+    tf_scheme, df_scheme, normalization = weighting
+
+    answers = retriever.top_k(query_vectors, tf_scheme, df_scheme, normalization, k)
+    query_results = [(int(query_id), [int(doc_id) for doc_id, _ in query_answers]) for (query_id, _), query_answers in zip(grid["queries"], answers)]
+    query_scores = evaluate(query_results, grid["qrels"], cutoffs=())[eval_metric]
+    return cell, query_scores, time.perf_counter() - start_time
+
+def evaluate_grid(k, workers):
+    '''
+    Evaluates every cell of the grid, in a pool of forked worker processes when there is more than one worker.
+    Returns dictionaries of cell: array of the scores of the queries and cell: seconds.
+    '''
+    cells = [(eval_metric, tokenization, weighting) for eval_metric in evaluations for tokenization in tokenizations for weighting in weightings]
+    if workers > 1:
+        # Forked workers inherit the loaded indexes, matrices and query vectors
+        with ProcessPoolExecutor(max_workers=min(workers, len(cells)), mp_context=multiprocessing.get_context('fork')) as executor:
+            results = list(executor.map(evaluate_cell, cells, [k] * len(cells)))
+    else:
+        results = [evaluate_cell(cell, k) for cell in cells]
+
+    scores = {cell: query_scores for cell, query_scores, _ in results}
+    seconds = {cell: cell_seconds for cell, _, cell_seconds in results}
+    return scores, seconds
+
+def write_results(scores):
+    '''
+    Writes the score of every cell to results/evaluation_results.xlsx, one sheet per evaluation metric.
+    '''
+    import pandas as pd
 
-def test_all_methods():
-    output = {eval_metric: {tokenization: {weighting: None for weighting in weightings} for tokenization in tokenizations} for eval_metric in evaluations}
-    for eval_metric in evaluations:
-        for tokenization in tokenizations:
-            for weighting in weightings:
-                print("Running:", "python3", evaluation_program_path, collection_name, weighting, tokenization, k_results, n_queries, eval_metric)
-                process = subprocess.Popen(
-                    [sys.executable, evaluation_program_path, collection_name, weighting, tokenization, k_results, n_queries, eval_metric],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT)  # Merge stderr with stdout
-                stdout, stderr = process.communicate()  # Wait for process to finish and get the output
-                if stderr:
-                    print("Error:", stderr.decode().strip())
-                if stderr:
-                    print("Error:", stderr)
-                if process.returncode == 0:  # Check if subprocess succeeded
-                    # Assuming the output is a float in string format, e.g., '0.123\n'
-                    try:
-                        metric_value = float(stdout.decode().strip())
-                        output[eval_metric][tokenization][weighting] = metric_value
-                        print("Results:", metric_value)
-                    except ValueError:
-                        # Handle the case where the output is not a float
-                        print(f"Error parsing metric value from output: {stdout}")
-
-    # Convert the structured data into pandas DataFrames and save to Excel
     results_folder = 'results'
     os.makedirs(results_folder, exist_ok=True)
-    
+
     results_path = os.path.join(results_folder, 'evaluation_results.xlsx')
     with pd.ExcelWriter(results_path) as writer:
         for eval_metric in evaluations:
             data = []
             for tokenization in tokenizations:
                 for weighting in weightings:
-                    score = output[eval_metric][tokenization][weighting]
+                    score = scores.get((eval_metric, tokenization, weighting))
                     # Only include if there is a score (it's not None)
                     if score is not None:
                         data.append((tokenization, weighting, score))
             df = pd.DataFrame(data, columns=['Tokenization', 'Weighting', 'Score'])
-            # Remove single quotes from the sheet name
-            sheet_name = eval_metric.strip("'")
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+            df.to_excel(writer, sheet_name=eval_metric, index=False)
+    return results_path
+
+def main():
+    args = parse_arguments()
+    start_time = time.perf_counter()
+
+    selected_queries, answers = sample_queries(args.collection, args.n, args.seed, args.all_queries)
+    try:
+        load_grid(args.collection, selected_queries, answers, args.format)
+    except LookupError as error:
+        print(error, file=sys.stderr)
+        exit(1)
+    load_seconds = time.perf_counter() - start_time
+    print(f"Loaded the indexes and {len(selected_queries)} queries in {load_seconds:.2f}s")
+
+    query_scores, seconds = evaluate_grid(args.k, args.workers)
+    scores = {cell: float(cell_scores.mean()) if len(cell_scores) else 0.0 for cell, cell_scores in query_scores.items()}
+
+    # Every scheme is tested against the baseline of the same metric and tokenization on the same queries
+    p_values = {}
+    for eval_metric in evaluations:
+        for tokenization in tokenizations:
+            cells = [(eval_metric, tokenization, weighting) for weighting in weightings]
+            cell_p_values = randomization_test(query_scores[(eval_metric, tokenization, args.baseline)], [query_scores[cell] for cell in cells], seed=args.seed)
+            p_values.update(zip(cells, cell_p_values))
+
+    print(f"{'cell':<10}{'score':>8}{'p vs ' + args.baseline:>10}{'time':>13}")
+    for cell, score in scores.items():
+        print(f"{' '.join(cell):<10}{score:>8.3f}{p_values[cell]:>10.3f}{seconds[cell] * 1000:>10.1f} ms")
+
+    results_path = write_results(scores)
+    print(f"{len(scores)} cells in {time.perf_counter() - start_time:.2f}s wall time "
+          f"({sum(seconds.values()):.2f}s in cells, {args.workers} workers), results in {results_path}")
 
-test_all_methods()
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,11 @@
 Picks and runs "n" random queries from the collection using "query.py".
 Collects the results and evaluates performance using the chosen metric
 
+By default the queries are answered inside this process: the index and the
+text normalizer are loaded once and every query goes through "tokenize_and_answer".
+Pass --subprocess to start one "query.py" process per query instead, or --matrix
+to answer all the queries with one sparse matrix product (requires scipy).
+
 Input (in order):
     collection name, 
     weighting scheme for documents (see collection_object.py for details), 
@@ -10,9 +15,12 @@ Input (in order):
     the number of results to be returned for each query (k), 
     a number of queries to be tested (n), 
     and an evaluation metric (mrr or map)
+    Optional: --all-queries, --subprocess or --matrix, --all-metrics, --throughput, --format, --trace
 
 Output:
-    The value of mrr or map@k that it calculated
+    The value of mrr or map@k that it calculated, or every metric of evaluation.py with --all-metrics
+    With --trace, the stages of every query answered in this process (see instrumentation.py), and their
+    histograms next to every metric in <trace file>.summary.json
 
 '''
 
@@ -21,6 +29,11 @@ import subprocess
 import os
 import random
 import sys
+import time
+
+import instrumentation
+from evaluation import evaluate
+from evaluation import summarize
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Evaluate retrieval performance using MRR or MAP.')
@@ -30,40 +43,100 @@ def parse_arguments():
     parser.add_argument('k', type=int, help='Number of results to return for each query')
     parser.add_argument('n', type=int, help='Number of queries to test')
     parser.add_argument('evaluation_metric', choices=['mrr', 'map'], help='Evaluation metric: MRR or MAP')
+    parser.add_argument('--all-queries', action='store_true', help='Evaluate every judged query in the .QRY file instead of n random ones')
+    engines = parser.add_mutually_exclusive_group()
+    engines.add_argument('--subprocess', action='store_true', help='Run each query in its own "query.py" process')
+    engines.add_argument('--matrix', action='store_true', help='Answer all queries with one sparse matrix product')
+    parser.add_argument('--all-metrics', action='store_true', help='Print every metric of evaluation.py (MAP, MRR, P@k, recall@k, nDCG@k) instead of one')
+    parser.add_argument('--throughput', action='store_true', help='Report the number of queries answered per second on stderr')
+    parser.add_argument('--format', choices=['json', 'binary', 'compressed'], default='json', help='On-disk format of the index to query')
+    parser.add_argument('--trace', type=str, default=None, help='Time the stages of every query and write the traces to this file as JSON lines, with histograms in FILE.summary.json')
     return parser.parse_args()
 
 def calculate_mrr(queries, all_answers):
-    reciprocal_ranks = []
-    for query_id, found_answers in queries:
-        rank = None
-        for i, doc_id in enumerate(found_answers, start=1):
-            if doc_id in all_answers[query_id]:
-                rank = i
-                break
-        if rank is not None:
-            reciprocal_ranks.append(1 / rank)
-        else:
-            reciprocal_ranks.append(0)
-    return sum(reciprocal_ranks) / len(reciprocal_ranks)
+    '''
+    Mean reciprocal rank of the first relevant document, queries is a list of (query ID, ranked docIDs).
+    '''
+    return summarize(evaluate(queries, all_answers, cutoffs=()))["mrr"]
 
 def calculate_map(queries, all_answers):
-    avg_precisions = []
-    for query_id, found_answers in queries:
-        relevant_docs = all_answers[query_id]
-        precisions = []
-        hit_count = 0
-        for i, doc_id in enumerate(found_answers, start=1):
-            if doc_id in relevant_docs:
-                hit_count += 1
-                precisions.append(hit_count / i)
-        if precisions:
-            avg_precisions.append(sum(precisions) / len(relevant_docs))
-        else:
-            avg_precisions.append(0)
-    return sum(avg_precisions) / len(avg_precisions) if avg_precisions else 0
+    '''
+    Mean average precision of the ranked docIDs of each query, queries is a list of (query ID, ranked docIDs).
+    '''
+    return summarize(evaluate(queries, all_answers, cutoffs=()))["map"]
+
+def run_queries_in_subprocesses(collection_name, weighting_scheme, text_normalization, k, selected_queries, index_format="json"):
+    '''
+    Runs every query through a new "query.py" process and parses its output.
+    '''
+    query_results = []
+
+    for query_id, query_text in selected_queries:
+        command = [
+            sys.executable, "./code/query.py", collection_name, weighting_scheme, text_normalization, str(k), query_text, "--format", index_format
+        ]
+        process = subprocess.run(command, capture_output=True, text=True)
+        output = process.stdout.strip().split('\t')
+        found_answers = [int(pair.split(':')[0]) for pair in output if pair]
+        query_results.append((query_id, found_answers))  # Note: Keep query_id as int for consistency
+
+    return query_results
+
+def run_queries_in_process(collection_name, weighting_scheme, text_normalization, k, selected_queries, index_format="json"):
+    '''
+    Runs every query through "tokenize_and_answer" inside this process.
+    The index and the normalizer are loaded once and shared by all the queries.
+    '''
+    import query
+    from collection_object import Collection
+
+    collection = Collection()
+    preprocessing_method = Collection.tokenization(text_normalization)
+    tf_scheme, df_scheme, normalization = Collection.weighting_scheme(weighting_scheme)
+    inverted_index = query.load_index(collection, collection_name, preprocessing_method, index_format)
+
+    query_results = []
+
+    for query_id, query_text in selected_queries:
+        try:
+            answers = query.tokenize_and_answer(query_text, tf_scheme, df_scheme, normalization, k, preprocessing_method, inverted_index)
+        except ValueError:
+            # "query.py" prints no results when a query term is not in the vocabulary
+            answers = []
+        found_answers = [int(doc_id) for doc_id, score in answers]
+        query_results.append((query_id, found_answers))
+
+    return query_results
+
+def run_queries_as_matrix(collection_name, weighting_scheme, text_normalization, k, selected_queries, index_format="json"):
+    '''
+    Answers all the queries at once with a sparse matrix product (see batch_retrieval.py).
+    Gives the same rankings as "tokenize_and_answer".
+    '''
+    import query
+    from batch_retrieval import MatrixRetriever
+    from collection_object import Collection
+
+    collection = Collection()
+    preprocessing_method = Collection.tokenization(text_normalization)
+    tf_scheme, df_scheme, normalization = Collection.weighting_scheme(weighting_scheme)
+    inverted_index = query.load_index(collection, collection_name, preprocessing_method, index_format)
+
+    query_vectors = []
+    for query_id, query_text in selected_queries:
+        try:
+            query_vectors.append(query.build_query_vector(query_text, preprocessing_method, inverted_index))
+        except ValueError:
+            # "query.py" prints no results when a query term is not in the vocabulary
+            query_vectors.append({})
+
+    answers = MatrixRetriever(inverted_index).top_k(query_vectors, tf_scheme, df_scheme, normalization, k)
+    return [(query_id, [int(doc_id) for doc_id, score in query_answers]) for (query_id, _), query_answers in zip(selected_queries, answers)]
 
 def main():
     args = parse_arguments()
+    if args.trace is not None:
+        instrumentation.configure(args.trace)
 
     from utils import read_queries, read_answers
 
@@ -76,20 +149,34 @@ def main():
     all_queries = read_queries(query_filepath)
     all_answers = read_answers(answer_filepath)
 
-    selected_queries = random.sample(list(all_queries.items()), args.n)
+    if args.all_queries:
+        # Queries without relevance judgements cannot be scored
+        selected_queries = [(query_id, query_text) for query_id, query_text in all_queries.items() if int(query_id) in all_answers]
+    else:
+        selected_queries = random.sample(list(all_queries.items()), args.n)
 
-    query_results = []
+    start_time = time.perf_counter()
+    if args.subprocess:
+        query_results = run_queries_in_subprocesses(args.collection, args.weighting_scheme, args.text_normalization, args.k, selected_queries, args.format)
+    elif args.matrix:
+        query_results = run_queries_as_matrix(args.collection, args.weighting_scheme, args.text_normalization, args.k, selected_queries, args.format)
+    else:
+        query_results = run_queries_in_process(args.collection, args.weighting_scheme, args.text_normalization, args.k, selected_queries, args.format)
+    elapsed_time = time.perf_counter() - start_time
 
-    for query_id, query_text in selected_queries:
-        command = [
-            sys.executable, "./code/query.py", args.collection, args.weighting_scheme, args.text_normalization, str(args.k), query_text
-        ]
-        process = subprocess.run(command, capture_output=True, text=True)
-        output = process.stdout.strip().split('\t')
-        found_answers = [int(pair.split(':')[0]) for pair in output if pair]
-        query_results.append((query_id, found_answers))  # Note: Keep query_id as int for consistency
+    if args.throughput:
+        print(f"{len(selected_queries)} queries in {elapsed_time:.3f}s ({len(selected_queries) / elapsed_time:.1f} queries/sec)", file=sys.stderr)
 
     formatted_query_results = [(int(query_id), found_answers) for query_id, found_answers in query_results]
+    if instrumentation.enabled:
+        # The histograms of the stages are stored with the scores of the same run
+        instrumentation.write_summary({"metrics": summarize(evaluate(formatted_query_results, all_answers)), "queries_per_second": len(selected_queries) / elapsed_time})
+
+    if args.all_metrics:
+        # Every metric in one pass over the rankings
+        for name, value in summarize(evaluate(formatted_query_results, all_answers)).items():
+            print(f"{name:<12}{value:.3f}")
+        return
 
     if args.evaluation_metric == 'mrr':
         metric_value = calculate_mrr(formatted_query_results, all_answers)
@@ -0,0 +1,163 @@
+'''
+
+Updates the indexes of a collection without rebuilding them. Added, replaced and deleted documents
+are written to small delta segments next to the indexes (see segments.py), which queries merge with
+the index on the fly, and the segments are merged into the index once there are enough of them.
+
+Input (in order):
+    collection name,
+    the update:
+        add <path>          index the documents of a file in the .ALL format, a document whose .I id
+                            is already in the index replaces it
+        delete <id> ...     delete documents by .I id
+        merge               merge the segments into the indexes
+    Optional: --format, --workers, --merge-threshold, --cache-path, --cache-size
+
+The corpus file of the collection is not changed, so a later build_index.py run starts over
+from it and drops the segments.
+
+The program will be run from the root of the repository.
+
+'''
+
+import os
+import subprocess
+import sys
+import preprocessing
+import collection_object
+import impacts
+import lexicon
+import positional_index
+import segments
+from build_index import build_indexes
+from build_index import finish_index
+from build_index import read_documents
+
+def build_segments(documents, deleted, normalizations, workers=1):
+    '''
+    Builds one segment per normalization from the added or replaced documents (a dictionary of docID: text)
+    and the deleted docIDs. Returns a dictionary of normalization: segment
+    '''
+    if documents:
+        indexes = build_indexes(documents, normalizations, workers)
+    else:
+        indexes = {normalization: {'_D_': []} for normalization in normalizations}
+
+    for index in indexes.values():
+        # The document count, norms and term bounds of a segment depend on the rest of the collection
+        index.pop('_M_', None)
+        index.pop('_N_', None)
+        index.pop('_U_', None)
+        index['_X_'] = list(deleted)
+    return indexes
+
+def compact_index(segmented_index):
+    '''
+    Returns the index a full rebuild would give for the live documents of a segmented index.
+    '''
+    index = {term: [0, segmented_index[term][1]] for term in segmented_index.vocabulary()}
+    return finish_index(index, dict.fromkeys(segmented_index['_D_']))
+
+def merge_segments(collection, index_path, index_format):
+    '''
+    Merges the segments of an index file into it. The new index is written next to the old one and
+    replaces it in one step, so queries and updates can go on while it is built. Segments added
+    in the meantime are kept for the next merge.
+    Returns the number of merged segments.
+    '''
+    main_index, segment_indexes, names = segments.read_layers(collection, index_path)
+    if not names:
+        return 0
+    index = compact_index(segments.SegmentedIndex(main_index, segment_indexes))
+
+    root, extension = os.path.splitext(index_path)
+    temporary_path = f'{root}.merging{extension}'
+    collection.write_data(index, temporary_path, index_format)
+    temporary_files = collection.get_index_files(temporary_path, index_format)
+    index_files = collection.get_index_files(index_path, index_format)
+
+    # The impacts of the index are rewritten for the merged index
+    if os.path.exists(impacts.get_impact_paths(index_path)[0]):
+        impacts.write_impacts(index, temporary_path, impacts.ImpactIndex(index_path).quantization)
+        temporary_files += impacts.get_impact_paths(temporary_path)
+        index_files += impacts.get_impact_paths(index_path)
+    # So is its lexicon, the segments may add and remove terms
+    if os.path.exists(lexicon.get_lexicon_paths(index_path)[0]):
+        lexicon.write_lexicon(index, temporary_path)
+        temporary_files += lexicon.get_lexicon_paths(temporary_path)
+        index_files += lexicon.get_lexicon_paths(index_path)
+
+    with segments.locked(index_path):
+        for temporary_file, index_file in zip(temporary_files, index_files):
+            os.replace(temporary_file, index_file)
+        segments.drop_segments(index_path, names)
+        # Positions cannot be recomputed from the postings, the merged index is queried without them
+        positional_index.remove_positions(index_path)
+    return len(names)
+
+def start_background_merge(collection_name, index_format):
+    '''
+    Starts "update_index.py <collection> merge" in a process that outlives this one.
+    '''
+    command = [sys.executable, os.path.abspath(__file__), collection_name, "--format", index_format, "merge"]
+    subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+if __name__ == "__main__":
+    '''
+    main() function
+    '''
+    # Validate inputs and initialize paths
+    collection = collection_object.Collection()
+    args = collection.parse_update_inputs()
+    index_paths = {normalization: collection.get_output_path(args.collection,
+                                            file_type=file_type,
+                                            throw_file_exists_error=False,
+                                            index_format=args.format)
+                   for normalization, file_type in collection.index_file_types.items()}
+    for index_path in index_paths.values():
+        if not os.path.exists(index_path):
+            print(f'There is no index at {index_path}, build it with build_index.py', file=sys.stderr)
+            exit(1)
+
+    if args.update == "merge":
+        for index_path in index_paths.values():
+            try:
+                with segments.locked(index_path, blocking=False, lock_extension=segments.MERGE_LOCK_EXTENSION):
+                    merged = merge_segments(collection, index_path, args.format)
+            except BlockingIOError:
+                print(f'{index_path} is already being merged')
+                continue
+            print(f'{index_path}: merged {merged} segments')
+        print("SUCCESS")
+        exit(0)
+
+    if args.update == "add":
+        preprocessing.configure_cache(args.cache_size, args.cache_path)
+
+        # Fail fast, without touching the network, when the NLTK data is missing
+        try:
+            preprocessing.check_resources(list(index_paths.keys()))
+        except LookupError as error:
+            print(error, file=sys.stderr)
+            exit(1)
+
+        documents = read_documents(args.path)
+        deleted = []
+    else:
+        documents = {}
+        deleted = args.doc_ids
+
+    segment_indexes = build_segments(documents, deleted, list(index_paths.keys()), args.workers)
+
+    segment_count = 0
+    for normalization, segment in segment_indexes.items():
+        segment_count = segments.add_segment(collection, index_paths[normalization], segment)
+    print(f'{len(documents)} documents added or replaced, {len(deleted)} deleted, {segment_count} segments')
+
+    if args.merge_threshold > 0 and segment_count >= args.merge_threshold:
+        start_background_merge(args.collection, args.format)
+        print('Merging the segments in the background')
+
+    print("SUCCESS")
+
+    exit(0)
@@ -0,0 +1,107 @@
+'''
+
+tf-idf weighting functions shared by build_index.py and query.py
+(see collection_object.py for the format of a weighting scheme)
+
+'''
+
+import math
+
+# tf and df parts of every weighting scheme that is applied to documents
+DOCUMENT_SCHEMES = ["nn", "nt", "ln", "lt"]
+
+
+def tf_weight(term_frequency, tf_scheme):
+    '''
+    Return the weight of a term frequency: 'n' uses it as is, 'l' uses 1 + log10(tf).
+    '''
+    if tf_scheme == "l":
+        return math.log10(term_frequency) + 1
+    return term_frequency
+
+def df_weight(doc_count, document_frequency, df_scheme):
+    '''
+    Return the weight of a document frequency: 'n' is always 1, 't' uses the idf log10(M / df).
+    '''
+    if df_scheme == "t":
+        if document_frequency == 0 or doc_count == 0:
+            return 0
+        return math.log10(doc_count / document_frequency)
+    return 1
+
+def add_term_norms(squared_sums, doc_count, document_frequency, postings):
+    '''
+    Adds the squared weights of the postings of one term to the squared sums of every document, by scheme.
+    '''
+    df_weights = {df_scheme: df_weight(doc_count, document_frequency, df_scheme) for df_scheme in "nt"}
+
+    for term_frequency, doc_id in postings:
+        for scheme in DOCUMENT_SCHEMES:
+            weight = tf_weight(term_frequency, scheme[0]) * df_weights[scheme[1]]
+            squared_sums[scheme][doc_id] = squared_sums[scheme].get(doc_id, 0) + weight * weight
+
+def finish_document_norms(squared_sums):
+    '''
+    Returns the norms of the documents from their squared sums, a dictionary of scheme: {docID: norm}
+    '''
+    return {scheme: {doc_id: math.sqrt(total) for doc_id, total in totals.items()} for scheme, totals in squared_sums.items()}
+
+def compute_document_norms(index):
+    '''
+    Computes the length of every document vector for each document weighting scheme.
+    Returns a dictionary of scheme: {docID: norm}, stored in the index under '_N_'.
+    '''
+    doc_count = index['_M_']
+    squared_sums = {scheme: {} for scheme in DOCUMENT_SCHEMES}
+
+    for term, value in index.items():
+        # Skip collection statistics such as '_M_'
+        if term.startswith('_'):
+            continue
+        document_frequency, postings = value
+        add_term_norms(squared_sums, doc_count, document_frequency, postings)
+
+    return finish_document_norms(squared_sums)
+
+def round_up(value, digits=6):
+    '''
+    Round a non-negative number to a few significant digits without making it smaller,
+    so that a rounded upper bound is still an upper bound.
+    '''
+    rounded = float(f'{value:.{digits}g}')
+    if rounded < value:
+        rounded = float(f'{value * (1 + 10 ** (1 - digits)):.{digits}g}')
+    return rounded
+
+def add_term_bounds(bounds, term, postings, norms):
+    '''
+    Adds the upper bounds of one term to the bounds of an index: its largest term frequency and,
+    for each document scheme, its largest cosine normalized weight (tf weight / document norm).
+    The idf is left out, it is the same in every document of the term and applied at query time.
+    '''
+    bounds["tf"][term] = max(term_frequency for term_frequency, _ in postings)
+    for scheme in DOCUMENT_SCHEMES:
+        scheme_norms = norms[scheme]
+        largest = 0
+        for term_frequency, doc_id in postings:
+            norm = scheme_norms.get(doc_id, 0)
+            if norm > 0:
+                largest = max(largest, tf_weight(term_frequency, scheme[0]) / norm)
+        bounds[scheme][term] = round_up(largest)
+
+def compute_term_bounds(index, norms):
+    '''
+    Computes the upper bounds of the weight of every term in any document, used to prune top-k retrieval.
+    Returns a dictionary with the largest tf of every term under 'tf' and, for each document scheme,
+    the largest tf weight divided by the document norm under the scheme, stored in the index under '_U_'.
+    '''
+    bounds = {"tf": {}}
+    bounds.update({scheme: {} for scheme in DOCUMENT_SCHEMES})
+
+    for term, value in index.items():
+        # Skip collection statistics such as '_M_'
+        if term.startswith('_'):
+            continue
+        add_term_bounds(bounds, term, value[1], norms)
+
+    return bounds
@@ -0,0 +1,33 @@
+import multiprocessing
+import os
+import string
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pytest
+
+# The modules of the repository are scripts in code/, imported by name like they import each other
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+
+def split_words(text):
+    return text.translate(str.maketrans('', '', string.punctuation)).split()
+
+@pytest.fixture
+def plain_normalization(monkeypatch):
+    '''
+    Tokenizes on whitespace and normalizes without the NLTK data: lemmas are the lowercased tokens and
+    stems their first five characters. Worker processes are forked, so they normalize the same way.
+    '''
+    import build_index
+    import preprocessing
+    import streaming_index
+
+    monkeypatch.setattr(build_index, "tokenize", split_words)
+    monkeypatch.setattr(preprocessing, "tokenize", split_words)
+    monkeypatch.setitem(preprocessing.normalizers, "lemmatization", list)
+    monkeypatch.setitem(preprocessing.normalizers, "stemming", lambda tokens: [token[:5] for token in tokens])
+    fork_pool = partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context("fork"))
+    monkeypatch.setattr(build_index, "ProcessPoolExecutor", fork_pool)
+    monkeypatch.setattr(streaming_index, "ProcessPoolExecutor", fork_pool)
@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+import build_index
+import impacts
+import sharding
+from compact_index import CompactIndex
+from scoring import get_scorer
+
+batch_retrieval = pytest.importorskip("batch_retrieval")
+
+SCHEMES = [(tf_scheme, df_scheme, normalization) for tf_scheme in "nl" for df_scheme in "nt" for normalization in "nc"]
+
+
+def build_random_index(seed):
+    rng = random.Random(seed)
+    vocabulary = [f"term{number}" for number in range(60)]
+    documents = {str(doc_id): [rng.choice(vocabulary) for _ in range(rng.randint(1, 40))] for doc_id in range(120)}
+    index = CompactIndex()
+    for doc_id, tokens in documents.items():
+        index.add_document(doc_id, tokens)
+    build_index.finish_index(index, documents)
+    return index, vocabulary
+
+def query_vectors(vocabulary, seed):
+    rng = random.Random(seed)
+    return [{rng.choice(vocabulary): float(rng.randint(1, 3)) for _ in range(rng.randint(1, 5))} for _ in range(40)]
+
+def assert_same_answers(index, vectors):
+    retriever = batch_retrieval.MatrixRetriever(index)
+    scorer = get_scorer(index)
+    for scheme in SCHEMES:
+        assert retriever.top_k(vectors, *scheme, 10) == [scorer.top_k(vector, *scheme, 10) for vector in vectors]
+
+def test_shards_use_the_document_frequencies_of_the_collection():
+    index, vocabulary = build_random_index(1)
+    vectors = query_vectors(vocabulary, 1)
+    for shard in sharding.partition_index(index, 3):
+        assert_same_answers(shard, vectors)
+
+@pytest.mark.parametrize("quantization", ["float", "quantized"])
+def test_stored_impacts_are_the_weights_of_the_matrix(tmp_path, quantization):
+    index, vocabulary = build_random_index(2)
+    index_path = str(tmp_path / "index.json")
+    impacts.write_impacts(index, index_path, quantization)
+    get_scorer(index, impacts.ImpactIndex(index_path))
+    assert_same_answers(index, query_vectors(vocabulary, 2))
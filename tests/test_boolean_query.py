@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+import boolean_query
+import build_index
+from compact_index import CompactIndex
+from conftest import split_words
+from scoring import get_scorer
+
+VOCABULARY = [f"term{number}" for number in range(40)]
+
+
+def build_random_index(rng, document_count):
+    # Skewed term frequencies, so conjunctions look few candidates up in long postings lists
+    weights = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+    documents = {str(doc_id): rng.choices(VOCABULARY, weights, k=rng.randint(0, 20)) for doc_id in range(document_count)}
+    index = CompactIndex()
+    for doc_id, tokens in documents.items():
+        index.add_document(doc_id, tokens)
+    build_index.finish_index(index, documents)
+    return index, [set(tokens) for tokens in documents.values()]
+
+def random_tree(rng, depth):
+    if depth == 0 or rng.random() < 0.3:
+        return ("term", rng.choice(VOCABULARY + ["missing"]))
+    operator = rng.choice(["and", "or", "not"])
+    if operator == "not":
+        return ("not", random_tree(rng, depth - 1))
+    return (operator, tuple(random_tree(rng, depth - 1) for _ in range(rng.randint(2, 4))))
+
+def matching_documents(tree, documents):
+    operator, value = tree
+    if operator == "term":
+        return {doc_number for doc_number, terms in enumerate(documents) if value in terms}
+    if operator == "not":
+        return set(range(len(documents))) - matching_documents(value, documents)
+    matches = [matching_documents(child, documents) for child in value]
+    return set.intersection(*matches) if operator == "and" else set.union(*matches)
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_matches_are_the_set_algebra_of_the_postings(seed):
+    rng = random.Random(seed)
+    index, documents = build_random_index(rng, 2000)
+    matcher = boolean_query.BooleanMatcher(get_scorer(index))
+    for _ in range(200):
+        tree = random_tree(rng, 3)
+        doc_numbers = matcher.match(tree)
+        assert list(doc_numbers) == sorted(matching_documents(tree, documents)), tree
+    assert len(matcher.match(None)) == 0
+
+def test_queries_are_parsed_by_precedence(monkeypatch, plain_normalization):
+    monkeypatch.setattr(boolean_query, "tokenize", split_words)
+    tree = boolean_query.parse_query("index AND (retrieval OR search) NOT library query", "lemmatization")
+    assert tree == ("and", (("term", "index"), ("or", (("term", "retrieval"), ("term", "search"))),
+                            ("not", ("term", "library")), ("term", "query")))
+    assert boolean_query.parse_query("a OR b c OR NOT NOT d", "lemmatization") == \
+        ("or", (("term", "a"), ("and", (("term", "b"), ("term", "c"))), ("not", ("not", ("term", "d")))))
+    assert boolean_query.parse_query("... ?!", "lemmatization") is None
+    for malformed in ["(index", "index)", "index AND", "OR index", "()"]:
+        with pytest.raises(ValueError):
+            boolean_query.parse_query(malformed, "lemmatization")
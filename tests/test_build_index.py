@@ -0,0 +1,78 @@
+import os
+import random
+
+import pytest
+
+import collection_object
+import impacts
+import streaming_index
+from build_index import build_indexes
+
+WORDS = ["retrieval", "retrieve", "index", "indexing", "query", "queries", "library", "search", "document", "ranking",
+         "Library's", "U.S.A", "data-base", "information", "informative"]
+NORMALIZATIONS = ["lemmatization", "stemming"]
+
+
+def random_documents(seed, count=300):
+    rng = random.Random(seed)
+    return {str(doc_id): " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 30))) for doc_id in range(1, count + 1)}
+
+def output_paths(collection, name, index_format):
+    return {normalization: collection.get_output_path(name, file_type, throw_file_exists_error=False, index_format=index_format)
+            for normalization, file_type in collection.index_file_types.items()}
+
+def written_files(collection, paths, index_format, quantization=None):
+    files = []
+    for path in paths.values():
+        files += collection.get_index_files(path, index_format)
+        if quantization is not None:
+            files += impacts.get_impact_paths(path)
+    contents = []
+    for file in files:
+        with open(file, 'rb') as handle:
+            contents.append(handle.read())
+    return contents
+
+def write_in_memory(collection, documents, paths, workers=1, quantization=None):
+    for normalization, index in build_indexes(documents, NORMALIZATIONS, workers).items():
+        collection.write_data(index, paths[normalization])
+        if quantization is not None:
+            impacts.write_impacts(index, paths[normalization], quantization)
+
+@pytest.mark.parametrize("index_format", ["json", "binary", "compressed"])
+def test_parallel_builds_write_the_same_files(tmp_path, monkeypatch, plain_normalization, index_format):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    documents = random_documents(1)
+    single_paths = output_paths(collection, "SINGLE", index_format)
+    parallel_paths = output_paths(collection, "PARALLEL", index_format)
+    write_in_memory(collection, documents, single_paths)
+    write_in_memory(collection, documents, parallel_paths, workers=3)
+    assert written_files(collection, parallel_paths, index_format) == written_files(collection, single_paths, index_format)
+
+@pytest.mark.parametrize("index_format", ["json", "binary", "compressed"])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_streaming_builds_write_the_same_files(tmp_path, monkeypatch, plain_normalization, index_format, workers):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    # Small batches, so the postings are spilled in several runs
+    monkeypatch.setattr(streaming_index, "BATCH_DOCUMENTS", 16)
+    collection = collection_object.Collection()
+    documents = random_documents(2)
+    memory_paths = output_paths(collection, "MEMORY", index_format)
+    streaming_paths = output_paths(collection, "STREAMING", index_format)
+    write_in_memory(collection, documents, memory_paths, quantization="quantized")
+    document_count, runs = streaming_index.write_indexes_streaming(collection, documents.items(), streaming_paths, 300 * streaming_index.POSTING_BYTES,
+                                                                   workers, str(tmp_path), "quantized")
+    assert document_count == len(documents)
+    assert min(runs.values()) > 1
+    assert written_files(collection, streaming_paths, index_format, "quantized") == written_files(collection, memory_paths, index_format, "quantized")
+
+def test_streaming_builds_reject_repeated_documents(tmp_path, monkeypatch, plain_normalization):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    documents = [("1", "library search"), ("2", "index"), ("1", "query")]
+    with pytest.raises(ValueError):
+        streaming_index.write_indexes_streaming(collection, documents, output_paths(collection, "REPEATED", "json"), 10 ** 6)
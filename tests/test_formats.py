@@ -0,0 +1,44 @@
+import os
+import random
+
+import pytest
+
+import collection_object
+import query
+from build_index import build_indexes
+from scoring import AccumulatorScorer
+
+WORDS = [f"word{number}" for number in range(80)]
+SCHEMES = [("n", "n", "n"), ("n", "t", "c"), ("l", "n", "c"), ("l", "t", "n"), ("l", "t", "c")]
+
+
+def write_json_index(collection, seed):
+    rng = random.Random(seed)
+    documents = {str(doc_id): " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 50))) for doc_id in range(1, 201)}
+    index = build_indexes(documents, ["lemmatization"])["lemmatization"]
+    collection.write_data(index, query.get_index_path(collection, "TINY", "lemmatization"))
+    return index
+
+def random_query_vectors(seed):
+    rng = random.Random(seed)
+    return [{rng.choice(WORDS + ["missing"]): float(rng.randint(1, 3)) for _ in range(rng.randint(1, 6))} for _ in range(50)]
+
+@pytest.mark.parametrize("index_format", ["binary", "compressed"])
+def test_formats_give_the_answers_of_the_json_index(tmp_path, monkeypatch, plain_normalization, index_format):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    index = write_json_index(collection, 1)
+    collection.write_data(index, query.get_index_path(collection, "TINY", "lemmatization", index_format))
+
+    json_scorer = AccumulatorScorer(query.load_index(collection, "TINY", "lemmatization", compact=False))
+    loaded = query.load_index(collection, "TINY", "lemmatization", index_format)
+    scorer = AccumulatorScorer(loaded)
+    assert list(loaded['_D_']) == list(index['_D_'])
+    for term in ["word3", "word41"]:
+        assert loaded[term] == index[term]
+    for query_vector in random_query_vectors(1):
+        for scheme in SCHEMES:
+            expected = json_scorer.top_k(query_vector, *scheme, 10)
+            assert scorer.top_k(query_vector, *scheme, 10) == expected
+            assert scorer.top_k_pruned(query_vector, *scheme, 10) == expected
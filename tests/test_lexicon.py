@@ -0,0 +1,51 @@
+import random
+import re
+
+import lexicon
+
+ALPHABET = "abcde"
+
+
+def levenshtein(word, term):
+    previous = list(range(len(term) + 1))
+    for row, character in enumerate(word, 1):
+        current = [row]
+        for column, other in enumerate(term, 1):
+            current.append(min(previous[column] + 1, current[column - 1] + 1, previous[column - 1] + (character != other)))
+        previous = current
+    return previous[-1]
+
+def random_terms(rng, count, longest):
+    return sorted({"".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, longest))) for _ in range(count)})
+
+def test_short_words_reach_every_close_term():
+    terms = ["a", "ab", "abc", "ac", "aac", "adc", "abcd", "bc", "xyz", "ba", "abd", "b"]
+    word_lexicon = lexicon.build_lexicon(terms)
+    assert [term for term, _ in word_lexicon.expand_fuzzy("abc", 1)] == ["aac", "ab", "abc", "abcd", "abd", "ac", "adc", "bc"]
+    assert [term for term, _ in word_lexicon.expand_fuzzy("ab", 1)] == ["a", "ab", "abc", "abd", "ac", "b"]
+
+def test_fuzzy_expansions_match_a_scan_of_the_vocabulary():
+    rng = random.Random(11)
+    terms = random_terms(rng, 600, 9)
+    word_lexicon = lexicon.build_lexicon(terms)
+    for _ in range(300):
+        word = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 10)))
+        max_distance = rng.randint(0, 3)
+        expected = [(term, levenshtein(word, term)) for term in terms if levenshtein(word, term) <= max_distance]
+        assert word_lexicon.expand_fuzzy(word, max_distance) == expected, (word, max_distance)
+
+def random_pattern(rng):
+    pattern = "".join(rng.choice(ALPHABET + "*?") for _ in range(rng.randint(0, 6)))
+    if '*' not in pattern and '?' not in pattern:
+        position = rng.randint(0, len(pattern))
+        pattern = pattern[:position] + rng.choice("*?") + pattern[position:]
+    return pattern
+
+def test_pattern_expansions_match_a_scan_of_the_vocabulary():
+    rng = random.Random(12)
+    terms = random_terms(rng, 600, 9)
+    word_lexicon = lexicon.build_lexicon(terms)
+    for _ in range(500):
+        pattern = random_pattern(rng)
+        expression = re.compile(pattern.replace('*', '.*').replace('?', '.'))
+        assert word_lexicon.expand_pattern(pattern) == [term for term in terms if expression.fullmatch(term)], pattern
@@ -0,0 +1,39 @@
+import threading
+
+from normalization_cache import NormalizationCache
+
+THREADS = 8
+LOOKUPS = 5000
+
+
+def normalize_from_threads(cache):
+    errors = []
+    def lookups(seed):
+        try:
+            for lookup in range(LOOKUPS):
+                token = f"token{(lookup * 7 + seed) % 24}"
+                assert cache.get("stemming", token, "n", str.upper, token) == token.upper()
+        except Exception as error:
+            errors.append(error)
+    threads = [threading.Thread(target=lookups, args=(seed,)) for seed in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+def test_threads_share_the_cache():
+    cache = NormalizationCache(max_size=8)
+    assert normalize_from_threads(cache) == []
+    statistics = cache.statistics()
+    assert statistics["hits"] + statistics["misses"] == THREADS * LOOKUPS
+    assert statistics["size"] == 8
+
+def test_threads_share_the_store(tmp_path):
+    path = str(tmp_path / "normalized.sqlite")
+    cache = NormalizationCache(max_size=8, path=path)
+    assert normalize_from_threads(cache) == []
+    cache.flush()
+    reopened = NormalizationCache(max_size=0, path=path)
+    assert reopened.get("stemming", "token5", "n", lambda: None) == "TOKEN5"
+    assert reopened.statistics()["disk_hits"] == 1
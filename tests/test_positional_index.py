@@ -0,0 +1,63 @@
+import random
+
+import numpy as np
+
+import positional_index
+from compact_index import CompactIndex
+from scoring import AccumulatorScorer
+
+
+def build_matcher(documents, tmp_path):
+    index = CompactIndex(positions=True)
+    for doc_id, tokens in documents.items():
+        index.add_document(doc_id, tokens)
+    index['_M_'] = len(documents)
+    index['_D_'] = list(documents)
+    index_path = str(tmp_path / 'index.json')
+    positional_index.write_positions(index, index_path)
+    positions = positional_index.open_positions(index_path, index)
+    return positional_index.PhraseMatcher(AccumulatorScorer(index), positions), positions
+
+def chain_documents(documents, operands, distances):
+    '''
+    Documents in which some match of every operand is within the distance of the span of the matches before it.
+    '''
+    matches = []
+    for doc_id, tokens in documents.items():
+        spans = {(start, start) for start, token in enumerate(tokens) if token == operands[0]}
+        for operand, distance in zip(operands[1:], distances):
+            spans = {(min(start, position), max(end, position)) for start, end in spans
+                     for position, token in enumerate(tokens) if token == operand and start - distance <= position <= end + distance}
+        if spans:
+            matches.append(doc_id)
+    return matches
+
+def test_near_chain_keeps_the_closest_partner():
+    # "the" at 27 and 30, "of" at 29, "serv" at 24: the NEAR/2 of spans [27, 29] and [29, 30],
+    # only the first one, which does not end last, is within 4 positions of serv
+    the = (np.array([27, 30]), np.array([27, 30]))
+    of = (np.array([29]), np.array([29]))
+    serv = (np.array([24]), np.array([24]))
+    spans = positional_index.PhraseMatcher.near_spans(the, of, 2)
+    assert [tuple(span) for span in zip(*spans)] == [(27, 29), (29, 30)]
+    starts, ends = positional_index.PhraseMatcher.near_spans(spans, serv, 4)
+    assert [tuple(span) for span in zip(starts, ends)] == [(24, 29)]
+
+def test_near_chains_match_every_document(tmp_path):
+    rng = random.Random(7)
+    vocabulary = ["the", "of", "serv", "data", "base", "index"]
+    documents = {str(doc_id): [rng.choice(vocabulary) for _ in range(rng.randint(1, 40))] for doc_id in range(200)}
+    documents['1412'] = ["data"] * 24 + ["serv", "base", "index", "the", "data", "of", "the"]
+    matcher, positions = build_matcher(documents, tmp_path)
+    doc_ids = list(documents)
+    try:
+        for _ in range(200):
+            operands = tuple(rng.choice(vocabulary) for _ in range(rng.randint(2, 4)))
+            distances = tuple(rng.randint(1, 5) for _ in range(len(operands) - 1))
+            clause = (tuple((operand,) for operand in operands), distances)
+            found = [doc_ids[doc_number] for doc_number in matcher.match([clause])]
+            assert found == chain_documents(documents, operands, distances), (operands, distances)
+        clause = ((("the",), ("of",), ("serv",)), (2, 4))
+        assert '1412' in [doc_ids[doc_number] for doc_number in matcher.match([clause])]
+    finally:
+        positions.close()
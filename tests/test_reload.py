@@ -0,0 +1,137 @@
+import gc
+import os
+import pickle
+import threading
+import types
+import weakref
+
+import pytest
+
+import build_index
+import collection_object
+import lexicon
+import positional_index
+import query
+import query_server
+import result_cache
+import scoring
+from compact_index import CompactIndex
+
+DOCUMENTS = {"1": ["index", "of", "the", "data", "base"], "2": ["the", "data", "serv"], "3": ["base", "index"]}
+
+
+def write_index(collection):
+    index = CompactIndex(positions=True)
+    for doc_id, tokens in DOCUMENTS.items():
+        index.add_document(doc_id, tokens)
+    build_index.finish_index(index, DOCUMENTS)
+    index_path = query.get_index_path(collection, "TINY", "stemming")
+    collection.write_data(index, index_path)
+    positional_index.write_positions(index, index_path)
+    return index_path
+
+@pytest.fixture(autouse=True)
+def no_dictionary_states(monkeypatch):
+    # The plain dictionaries scored by other tests are still registered
+    monkeypatch.setattr(scoring, "dictionary_states", {})
+
+def serve(collection, index_path, key, compact=True):
+    return types.SimpleNamespace(collection=collection, index_format="json", reload_lock=threading.Lock(),
+                                 index_lock=threading.Lock(), index_users={},
+                                 indexes={key: query.load_index(collection, *key, compact=compact)},
+                                 caches={key: result_cache.ResultCache(8, query.get_watched_files(collection, index_path))})
+
+def test_reloads_release_the_replaced_indexes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    index_path = write_index(collection)
+    key = ("TINY", "stemming")
+    server = serve(collection, index_path, key)
+
+    replaced = []
+    for reload in range(20):
+        index = server.indexes[key]
+        scoring.get_scorer(index)
+        lexicon.get_lexicon(index)
+        replaced.append((weakref.ref(index), positional_index.get_positions(index)))
+        del index
+        # A newer modification time makes the cache see a changed index file
+        os.utime(index_path, ns=(0, (reload + 1) * 10**9))
+        query_server.reload_changed_index(server, key)
+    gc.collect()
+
+    assert all(index() is None for index, _ in replaced)
+    assert all(positions.gaps is None and positions._file.closed for _, positions in replaced)
+    assert not scoring.dictionary_states
+    assert positional_index.get_positions(server.indexes[key]).gaps is not None
+
+def test_attached_positions_replace_the_previous_ones(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    index_path = write_index(collection)
+    index = query.load_index(collection, "TINY", "stemming")
+    previous = positional_index.get_positions(index)
+    positional_index.attach_positions(index, positional_index.open_positions(index_path, index))
+    assert previous.gaps is None and previous._file.closed
+
+def test_plain_dictionary_states_are_released(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    write_index(collection)
+    for _ in range(20):
+        index = query.load_index(collection, "TINY", "stemming", compact=False)
+        scoring.get_scorer(index)
+        lexicon.get_lexicon(index)
+        assert len(scoring.dictionary_states) == 1
+        scoring.release_index_state(index)
+    assert not scoring.dictionary_states
+
+def test_answers_of_a_replaced_index_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    index_path = write_index(collection)
+    key = ("TINY", "stemming")
+    server = serve(collection, index_path, key)
+    index, cache = query_server.acquire_index(server, key)
+    os.utime(index_path, ns=(0, 10**9))
+    query_server.reload_changed_index(server, key)
+    # The query started before the reload ends after it
+    cache.put(("query",), 10, [("1", 1.0)])
+    query_server.release_index(server, index)
+    assert server.caches[key].get(("query",), 10) is None
+    _, cache = query_server.acquire_index(server, key)
+    cache.put(("query",), 10, [("1", 1.0)])
+    assert server.caches[key].get(("query",), 10) == [("1", 1.0)]
+
+def test_plain_dictionaries_are_released_by_their_last_query(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    index_path = write_index(collection)
+    key = ("TINY", "stemming")
+    server = serve(collection, index_path, key, compact=False)
+    for reload in range(5):
+        held = [query_server.acquire_index(server, key)[0] for _ in range(2)]
+        os.utime(index_path, ns=(0, (reload + 1) * 10**9))
+        query_server.reload_changed_index(server, key)
+        for index in held:
+            # Queries still running on the replaced index
+            scoring.get_scorer(index)
+            query_server.release_index(server, index)
+        assert not scoring.dictionary_states
+        assert not server.index_users
+
+def test_loaded_indexes_are_picklable(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    write_index(collection)
+    index = query.load_index(collection, "TINY", "stemming")
+    scoring.get_scorer(index)
+    copy = pickle.loads(pickle.dumps(index))
+    assert dict(copy.items()) == dict(index.items())
+    assert 'scorer' not in scoring.index_state(copy)
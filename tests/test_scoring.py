@@ -0,0 +1,52 @@
+import random
+
+import numpy as np
+
+import build_index
+from compact_index import CompactIndex
+from scoring import AccumulatorScorer
+
+
+def build_index_of(documents):
+    index = CompactIndex()
+    for doc_id, tokens in documents.items():
+        index.add_document(doc_id, tokens)
+    build_index.finish_index(index, documents)
+    return index
+
+def random_documents(seed, count=300):
+    rng = random.Random(seed)
+    vocabulary = [f"term{number}" for number in range(150)]
+    return {str(doc_id): [rng.choice(vocabulary) for _ in range(rng.randint(1, 60))] for doc_id in range(count)}
+
+def test_terms_out_of_the_vocabulary_are_not_cached():
+    scorer = AccumulatorScorer(build_index_of(random_documents(1)))
+    for number in range(1000):
+        query_vector = {f"unknown{number}": 1.0, "term1": 1.0}
+        scorer.top_k(query_vector, "l", "t", "c", 10)
+        scorer.top_k_pruned(query_vector, "l", "t", "c", 10)
+        scorer.term_skips(f"unknown{number}")
+    assert len(scorer.postings) == 1
+    assert len(scorer.skips) == 0
+    assert {term for term, _ in scorer.bounds} == {"term1"}
+    assert len(scorer.impacts) == 1
+
+def test_postings_are_views_of_the_index():
+    index = build_index_of(random_documents(2))
+    doc_numbers, term_frequencies = AccumulatorScorer(index).term_postings("term3")
+    assert doc_numbers.dtype == np.uint32 and term_frequencies.dtype == np.uint32
+    assert np.shares_memory(doc_numbers, np.frombuffer(index.postings_arrays("term3")[0], dtype=np.uint32))
+
+def test_bounded_caches_give_the_same_answers():
+    index = build_index_of(random_documents(3))
+    bounded = AccumulatorScorer(index, cache_bytes=4096)
+    unbounded = AccumulatorScorer(index, cache_bytes=None)
+    rng = random.Random(3)
+    for _ in range(200):
+        query_vector = {f"term{rng.randrange(150)}": float(rng.randint(1, 3)) for _ in range(rng.randint(1, 6))}
+        for scheme in [("l", "t", "c"), ("n", "n", "n"), ("l", "n", "c")]:
+            assert bounded.top_k(query_vector, *scheme, 10) == unbounded.top_k(query_vector, *scheme, 10)
+            assert bounded.top_k_pruned(query_vector, *scheme, 10) == unbounded.top_k(query_vector, *scheme, 10)
+    for cache in [bounded.postings, bounded.impacts, bounded.skips]:
+        assert cache.size <= 4096 or len(cache) == 1
+    assert bounded.postings.evictions > 0
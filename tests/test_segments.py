@@ -0,0 +1,104 @@
+import os
+import random
+
+import pytest
+
+import collection_object
+import query
+import segments
+import update_index
+from build_index import build_indexes
+from scoring import AccumulatorScorer
+
+WORDS = ["retrieval", "retrieve", "index", "indexing", "query", "queries", "library", "search", "document", "ranking"]
+NORMALIZATIONS = ["lemmatization", "stemming"]
+
+
+def random_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 25)))
+
+def write_collection(collection, documents):
+    index_paths = {}
+    for normalization, index in build_indexes(documents, NORMALIZATIONS).items():
+        index_paths[normalization] = query.get_index_path(collection, "TINY", normalization)
+        collection.write_data(index, index_paths[normalization])
+    return index_paths
+
+def apply_updates(collection, index_paths, documents, rng, update_count):
+    '''
+    Adds, replaces and deletes random documents in segments. Returns the live documents in the order of
+    the document table of the segmented index: the live documents of the index, then those of every segment.
+    '''
+    layers = [dict(documents)]
+    next_id = len(documents) + 1
+    for _ in range(update_count):
+        live = [doc_id for layer in layers for doc_id in layer]
+        added = {doc_id: random_text(rng) for doc_id in rng.sample(live, min(3, len(live)))}
+        for _ in range(rng.randint(0, 3)):
+            added[str(next_id)] = random_text(rng)
+            next_id += 1
+        deleted = [doc_id for doc_id in rng.sample(live, min(2, len(live))) if doc_id not in added]
+        for normalization, segment in update_index.build_segments(added, deleted, NORMALIZATIONS).items():
+            segments.add_segment(collection, index_paths[normalization], segment)
+        for layer in layers:
+            for doc_id in list(layer):
+                if doc_id in added or doc_id in deleted:
+                    del layer[doc_id]
+        layers.append(added)
+    return {doc_id: text for layer in layers for doc_id, text in layer.items()}
+
+def assert_same_index(index, rebuilt):
+    assert sorted(term for term in index.keys() if not term.startswith('_')) == sorted(term for term in rebuilt.keys() if not term.startswith('_'))
+    for term in rebuilt.keys():
+        if not term.startswith('_'):
+            assert index[term] == rebuilt[term], term
+    assert index['_M_'] == rebuilt['_M_']
+    assert list(index['_D_']) == list(rebuilt['_D_'])
+    for scheme, norms in rebuilt['_N_'].items():
+        assert index['_N_'][scheme] == pytest.approx(norms)
+
+def assert_same_answers(index, rebuilt, rng):
+    scorer, rebuilt_scorer = AccumulatorScorer(index), AccumulatorScorer(rebuilt)
+    every_document = index['_M_']
+    for _ in range(30):
+        query_vector = {word[:5]: float(rng.randint(1, 2)) for word in rng.sample(WORDS, rng.randint(1, 3))}
+        for scheme in [("n", "n", "n"), ("l", "t", "c")]:
+            answers = dict(scorer.top_k(query_vector, *scheme, every_document))
+            assert answers == pytest.approx(dict(rebuilt_scorer.top_k(query_vector, *scheme, every_document)))
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_segments_match_a_full_rebuild(tmp_path, monkeypatch, plain_normalization, seed):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    rng = random.Random(seed)
+    collection = collection_object.Collection()
+    documents = {str(doc_id): random_text(rng) for doc_id in range(1, 41)}
+    index_paths = write_collection(collection, documents)
+    live_documents = apply_updates(collection, index_paths, documents, rng, 4)
+
+    rebuilt = build_indexes(live_documents, ["stemming"])["stemming"]
+    segmented = query.load_index(collection, "TINY", "stemming")
+    assert isinstance(segmented, segments.SegmentedIndex)
+    assert_same_index(segmented, rebuilt)
+    assert_same_answers(segmented, rebuilt, rng)
+
+    # Merged into the index, the segments give the index of a full rebuild
+    assert update_index.merge_segments(collection, index_paths["stemming"], "json") == 4
+    merged = query.load_index(collection, "TINY", "stemming")
+    assert not isinstance(merged, segments.SegmentedIndex)
+    assert_same_index(merged, rebuilt)
+    assert_same_answers(merged, rebuilt, rng)
+
+def test_deleting_every_document_of_a_term_removes_it(tmp_path, monkeypatch, plain_normalization):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    index_paths = write_collection(collection, {"1": "library search", "2": "search index", "3": "index"})
+    for normalization, segment in update_index.build_segments({"2": "query"}, ["1"], NORMALIZATIONS).items():
+        segments.add_segment(collection, index_paths[normalization], segment)
+
+    segmented = query.load_index(collection, "TINY", "lemmatization")
+    assert "library" not in segmented and "search" not in segmented
+    assert segmented["index"] == [1, [[1, "3"]]]
+    assert segmented["query"] == [1, [[1, "2"]]]
+    assert segmented['_D_'] == ["3", "2"]
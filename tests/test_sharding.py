@@ -0,0 +1,72 @@
+import os
+import random
+import threading
+
+import pytest
+
+import collection_object
+import query
+import sharding
+from build_index import build_indexes
+from scoring import AccumulatorScorer
+
+WORDS = [f"word{number}" for number in range(60)]
+SCHEMES = [("n", "n", "n"), ("n", "t", "c"), ("l", "n", "c"), ("l", "t", "n"), ("l", "t", "c")]
+
+
+def write_index(collection, seed):
+    rng = random.Random(seed)
+    documents = {str(doc_id): " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 40))) for doc_id in range(1, 151)}
+    index = build_indexes(documents, ["lemmatization"])["lemmatization"]
+    index_path = query.get_index_path(collection, "TINY", "lemmatization")
+    collection.write_data(index, index_path)
+    return index, index_path
+
+def assert_same_answers(coordinator, index, seed):
+    rng = random.Random(seed)
+    scorer = AccumulatorScorer(index)
+    for _ in range(30):
+        query_vector = {rng.choice(WORDS + ["missing"]): float(rng.randint(1, 3)) for _ in range(rng.randint(1, 5))}
+        for scheme in SCHEMES:
+            expected = scorer.top_k(query_vector, *scheme, 10)
+            assert coordinator.top_k(query_vector, *scheme, 10) == expected
+            assert coordinator.top_k_pruned(query_vector, *scheme, 10) == expected
+
+@pytest.mark.parametrize("index_format", ["json", "binary", "compressed"])
+@pytest.mark.parametrize("shard_count", [1, 2, 3, 7])
+def test_shards_give_the_answers_of_the_index(tmp_path, monkeypatch, plain_normalization, index_format, shard_count):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    index, index_path = write_index(collection, shard_count)
+    sharding.write_shards(collection, index, index_path, shard_count, index_format)
+
+    coordinator = sharding.open_coordinator(collection, index_path, "local", index_format=index_format)
+    try:
+        assert all(term in coordinator for term in WORDS if term in index)
+        assert_same_answers(coordinator, index, shard_count)
+    finally:
+        coordinator.close()
+
+def test_every_transport_gives_the_answers_of_the_index(tmp_path, monkeypatch, plain_normalization):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("processed")
+    collection = collection_object.Collection()
+    index, index_path = write_index(collection, 4)
+    shard_paths = sharding.write_shards(collection, index, index_path, 3)
+
+    servers = [sharding.make_shard_server(("127.0.0.1", 0), collection.read_data(shard_path, compact=True)) for shard_path in shard_paths]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f"http://127.0.0.1:{server.server_address[1]}" for server in servers]
+    try:
+        for transport in ["process", "remote"]:
+            coordinator = sharding.open_coordinator(collection, index_path, transport, urls)
+            try:
+                assert_same_answers(coordinator, index, 4)
+            finally:
+                coordinator.close()
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()